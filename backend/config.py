@@ -8,11 +8,97 @@ class Config:
     RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "10"))
     RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
     RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "5"))
+    RERANK_MODE = os.getenv("RERANK_MODE", "llm")  # llm (RERANK_MODEL call) or local (in-process BM25 + cosine)
+    RERANK_LOCAL_BM25_WEIGHT = float(os.getenv("RERANK_LOCAL_BM25_WEIGHT", "0.3"))  # Rest of the score is embedding cosine
+    RERANK_CACHE_ENABLED = os.getenv("RERANK_CACHE_ENABLED", "true").lower() == "true"
+    RERANK_CACHE_TTL_SECONDS = int(os.getenv("RERANK_CACHE_TTL_SECONDS", "3600"))
+    RERANK_CACHE_MAX_ITEMS = int(os.getenv("RERANK_CACHE_MAX_ITEMS", "1024"))
+    CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))  # Estimated prompt budget for context passages, 0 = no limit
+    # End-to-end /chat deadline (0 = none), split into retrieval, rerank and generation budgets;
+    # a stage out of budget degrades (drops a search leg, skips rerank, shrinks context, truncates the answer)
+    CHAT_DEADLINE_MS = int(os.getenv("CHAT_DEADLINE_MS", "0"))
+    CHAT_BUDGET_RETRIEVAL = float(os.getenv("CHAT_BUDGET_RETRIEVAL", "0.2"))  # Share of the deadline
+    CHAT_BUDGET_RERANK = float(os.getenv("CHAT_BUDGET_RERANK", "0.15"))  # Share of the deadline
+    CHAT_CONTEXT_FULL_MS = int(os.getenv("CHAT_CONTEXT_FULL_MS", "4000"))  # Less time left for generation shrinks the context
+    # Per-stage timeouts of the /chat pipeline in seconds (0 = none); search, rerank and sources degrade instead of failing
+    PIPELINE_TIMEOUT_EMBED = float(os.getenv("PIPELINE_TIMEOUT_EMBED", "10"))
+    PIPELINE_TIMEOUT_SEARCH = float(os.getenv("PIPELINE_TIMEOUT_SEARCH", "10"))
+    PIPELINE_TIMEOUT_RERANK = float(os.getenv("PIPELINE_TIMEOUT_RERANK", "15"))
+    PIPELINE_TIMEOUT_SOURCES = float(os.getenv("PIPELINE_TIMEOUT_SOURCES", "5"))
+    PIPELINE_TIMEOUT_GENERATE = float(os.getenv("PIPELINE_TIMEOUT_GENERATE", "120"))
+    CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "500"))  # Questions per /chat/batch request
+    CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))  # Questions of one batch answered at once
+    HYBRID_SEARCH_RPC = os.getenv("HYBRID_SEARCH_RPC", "false").lower() == "true"  # One-call hybrid_search (sql/04)
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    VECTOR_EF_SEARCH = int(os.getenv("VECTOR_EF_SEARCH", "0"))  # HNSW ef_search passed to the RPCs (sql/05), 0 = SQL default
+    # Where chunks are stored and searched: supabase (RPCs) or local (memory-mapped segments in RETRIEVAL_LOCAL_DIR,
+    # shared by all API and worker processes on the host; the sources table stays in Supabase)
+    RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "supabase")
+    RETRIEVAL_LOCAL_DIR = os.getenv("RETRIEVAL_LOCAL_DIR", "data/vectors")
+    RETRIEVAL_LOCAL_MAX_SEGMENTS = int(os.getenv("RETRIEVAL_LOCAL_MAX_SEGMENTS", "16"))  # Above this, the smallest neighbours get merged
+    # Two-stage semantic search: shortlist match_count * VECTOR_RESCORE_FACTOR candidates on coarse vectors (the leading
+    # VECTOR_COARSE_DIMENSIONS components, 0 = all, stored as none/halfvec/int8), then rescore them at full precision.
+    # Off when both are at their defaults. The supabase backend then calls match_chunks_coarse (sql/06, halfvec only).
+    VECTOR_COARSE_DIMENSIONS = int(os.getenv("VECTOR_COARSE_DIMENSIONS", "0"))
+    VECTOR_COARSE_QUANTIZATION = os.getenv("VECTOR_COARSE_QUANTIZATION", "none")
+    VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
     
     # Caching Configuration
     CACHE_ENABLED = os.getenv("CACHE_ENABLED", "false").lower() == "true"
     CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "600"))
     CACHE_MAX_ITEMS = int(os.getenv("CACHE_MAX_ITEMS", "256"))
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))  # Cosine similarity
+    CHAT_CACHE_L2_URL = os.getenv("CHAT_CACHE_L2_URL", "")  # Shared tier: sqlite:///path.db or redis://host:port/db, empty = L1 only
+    CHAT_CACHE_L2_MAX_ITEMS = int(os.getenv("CHAT_CACHE_L2_MAX_ITEMS", "100000"))  # SQLite tier bound
+    CHAT_COALESCE_ENABLED = os.getenv("CHAT_COALESCE_ENABLED", "true").lower() == "true"  # Single-flight for concurrent identical questions
+    CACHE_EVENT_POLL_SECONDS = float(os.getenv("CACHE_EVENT_POLL_SECONDS", "1"))  # Source change log polling for invalidation
+    
+    # OpenAI Connection Pool (async request path)
+    OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    
+    # OpenAI Rate Limiting (every call goes through the scheduler, interactive before ingestion)
+    OPENAI_RATE_LIMITS = os.getenv("OPENAI_RATE_LIMITS", "")  # model=rpm:tpm,... for this process; unlisted = learned from response headers
+    OPENAI_INTERACTIVE_RESERVE = float(os.getenv("OPENAI_INTERACTIVE_RESERVE", "0.2"))  # Share of each bucket ingestion may not use
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))  # Per call, after 429 / connection errors / 5xx
+    OPENAI_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("OPENAI_COMPLETION_TOKENS_ESTIMATE", "500"))  # Reserved per completion until usage is known
+    
+    # Embedding Cache Configuration (queries and ingestion)
+    EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+    EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # In-memory LRU tier (query vectors), ~6 KB per 1536-dim vector
+    EMBED_CACHE_DB_PATH = os.getenv("EMBED_CACHE_DB_PATH", "")  # Optional SQLite tier, empty = memory only
+    EMBED_CACHE_DISK_MAX_ITEMS = int(os.getenv("EMBED_CACHE_DISK_MAX_ITEMS", "1000000"))
+    
+    # Embedding Engine Configuration (ingestion)
+    EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "16000"))
+    EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "256"))
+    EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+    # `dimensions` requested from the embeddings API (Matryoshka-style truncation, text-embedding-3 models), 0 = model
+    # default; the vector(1536) columns and functions in sql/ must be declared with the same size
+    EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+    
+    # Ingestion Pipeline Configuration
+    INGEST_WINDOW_CHUNKS = int(os.getenv("INGEST_WINDOW_CHUNKS", "256"))  # Chunks held in memory per pipeline stage
+    UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "data/uploads")  # Must be visible to the workers
+    INGEST_PROCESS_WORKERS = int(os.getenv("INGEST_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0 = extract in-thread
+    INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "25"))
+    
+    # Job Queue Configuration (indexing)
+    JOB_DB_PATH = os.getenv("JOB_DB_PATH", "data/jobs.db")
+    JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "20"))  # Admission limit: queued + running jobs
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+    JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+    JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+    JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))  # For python -m backend.worker
+    JOB_EMBEDDED_WORKERS = int(os.getenv("JOB_EMBEDDED_WORKERS", "0"))  # Worker threads inside the API process (dev only), 0 = none
+    
+    # Observability
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json (one object per line) or text
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    METRICS_DIR = os.getenv("METRICS_DIR", "data/metrics")  # Per-process snapshots summed by /metrics, empty = this process only
+    METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
     
     # Index Version
     INDEX_VERSION = os.getenv("INDEX_VERSION", "v1")
@@ -1,47 +1,230 @@
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException
-from typing import List, Dict, Any
+from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Tuple, Optional, AsyncIterator
+import json
+import os
+import hashlib
 import uuid
 import asyncio
 import time
+import tempfile
+from postgrest.exceptions import APIError
 from backend.services.storage import get_supabase_client
-from backend.services.ingestion import process_document
-from backend.services.llm import get_embedding, generate_answer
-from backend.services.rerank import rerank
-from backend.services.cache import chat_cache
+from backend.services.jobs import Job, job_queue, QueueFullError
+from backend.services.ingestion import shutdown_process_pool
+from backend.services.extraction import READ_BLOCK_SIZE
+from backend.services.llm import get_embedding_async, get_embeddings_async, generate_answer_stream, async_client
+from backend.services.ratelimit import request_priority
+from backend.services.rerank import rerank_async
+from backend.services.context import pack_context
+from backend.services.retrieval import get_retrieval_backend
+from backend.services.pipeline import Pipeline, PipelineRun, Stage, StopPipeline
+from backend.services.logs import get_logger
+from backend.services.metrics import metrics, CHAT_STAGE_SECONDS, CHAT_REQUEST_SECONDS, CHAT_DEGRADATIONS
+from backend.services.cache import chat_cache, embedding_cache, rerank_cache, Flight
 from backend.config import Config
-from backend.models import SourceResponse, ChatRequest, ChatResponse, Source
+from backend.models import SourceResponse, ChatRequest, ChatResponse, Source, ChatBatchRequest, ChatBatchResult, ChatBatchResponse
 
-app = FastAPI(title="Docs Q&A RAG API")
+log = get_logger("api")
+
+# Postgres unique_violation: another source already holds the content_hash (see sql/03)
+UNIQUE_VIOLATION = "23505"
+
+# Last applied entry of the source event log (see _sync_source_events)
+_source_event_seq = 0
+_source_event_polled_at = 0.0
+
+async def _sync_source_events(force: bool = False):
+    """
+    Applies source changes published by any API or worker process (upload, re-index, delete)
+    to this process's chat cache. Polls the shared event log at most every CACHE_EVENT_POLL_SECONDS.
+    """
+    global _source_event_seq, _source_event_polled_at
+    now = time.monotonic()
+    if not force and now - _source_event_polled_at < Config.CACHE_EVENT_POLL_SECONDS:
+        return
+    _source_event_polled_at = now
+    events = await asyncio.to_thread(job_queue.source_events_since, _source_event_seq)
+    for seq, source_id, kind in events:
+        if kind == "deleted":
+            chat_cache.on_source_deleted(source_id, seq)
+        else:
+            chat_cache.on_source_indexed(source_id, seq)
+        rerank_cache.on_source_changed(source_id)
+        _source_event_seq = seq
+    if events:
+        log.info("cache.source_events_applied", events=len(events), invalidations_total=chat_cache.invalidations)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    metrics.start()
+    # Fails at startup on an unsupported backend configuration instead of on the first /chat
+    get_retrieval_backend()
+    # Replays the retained event log, so entries of the shared cache tier are checked against it
+    await _sync_source_events(force=True)
+    # Opt-in in-process indexing workers for development; indexing normally runs in `python -m backend.worker`
+    worker = None
+    if Config.JOB_EMBEDDED_WORKERS > 0:
+        from backend.worker import JobWorker
+        worker = JobWorker(Config.JOB_EMBEDDED_WORKERS)
+        worker.start()
+    yield
+    if worker:
+        worker.stop(timeout=5)
+    # PDF extraction processes, started on first use
+    await asyncio.to_thread(shutdown_process_pool)
+    await async_client.close()
+
+app = FastAPI(title="Docs Q&A RAG API", lifespan=lifespan)
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus text format, summed over all processes sharing METRICS_DIR."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def _spool_upload(file: UploadFile) -> Tuple[str, str]:
+    """Spools an upload to disk in blocks instead of reading it into memory. Returns (path, sha256)."""
+    suffix = os.path.splitext(file.filename or "")[1]
+    os.makedirs(Config.UPLOAD_SPOOL_DIR, exist_ok=True)
+    spool = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=Config.UPLOAD_SPOOL_DIR)
+    digest = hashlib.sha256()
+    try:
+        with spool:
+            while block := await file.read(READ_BLOCK_SIZE):
+                digest.update(block)
+                await asyncio.to_thread(spool.write, block)
+    except Exception:
+        os.remove(spool.name)
+        raise
+    return os.path.abspath(spool.name), digest.hexdigest()
+
+async def _check_admission():
+    # Admission control: reject early instead of piling up indexing work
+    if await asyncio.to_thread(job_queue.pending_count) >= Config.JOB_MAX_PENDING:
+        raise HTTPException(status_code=429, detail="Indexing queue is full, try again later")
+
+async def _find_source_by_hash(content_hash: str) -> Optional[Dict[str, Any]]:
+    supabase = get_supabase_client()
+    res = await asyncio.to_thread(lambda: supabase.table("sources").select("*").eq("content_hash", content_hash).neq("status", "failed").limit(1).execute())
+    return res.data[0] if res.data else None
+
 @app.post("/documents/upload", response_model=SourceResponse)
-async def upload_document(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_document(file: UploadFile = File(...)):
     supabase = get_supabase_client()
+    await _check_admission()
+    
+    file_path, content_hash = await _spool_upload(file)
     
-    # Read file content
-    content = await file.read()
+    # Identical file already uploaded: return the existing source instead of indexing again
+    existing = await _find_source_by_hash(content_hash)
+    if existing:
+        os.remove(file_path)
+        log.info("upload.deduplicated", filename=file.filename, source_id=existing["id"])
+        return existing
     
     # Create source record
     data = {
         "filename": file.filename,
         "filetype": file.content_type,
-        "status": "uploaded"
+        "status": "uploaded",
+        "content_hash": content_hash
     }
     
-    response = supabase.table("sources").insert(data).execute()
+    try:
+        response = await asyncio.to_thread(lambda: supabase.table("sources").insert(data).execute())
+    except APIError as e:
+        os.remove(file_path)
+        if e.code != UNIQUE_VIOLATION:
+            raise
+        # A concurrent identical upload inserted first
+        existing = await _find_source_by_hash(content_hash)
+        if not existing:
+            raise HTTPException(status_code=409, detail="An identical file is being uploaded, try again")
+        log.info("upload.deduplicated", filename=file.filename, source_id=existing["id"], race=True)
+        return existing
     if not response.data:
+        os.remove(file_path)
         raise HTTPException(status_code=500, detail="Failed to create source record")
     
     source_record = response.data[0]
     source_id = source_record["id"]
     
-    # Trigger background indexing
-    background_tasks.add_task(process_document, source_id, content, file.filename)
+    # Enqueue indexing job, a worker picks it up
+    payload = {"source_id": source_id, "file_path": file_path, "filename": file.filename}
+    try:
+        job_id = await asyncio.to_thread(job_queue.enqueue, "index_document", payload)
+    except QueueFullError as e:
+        os.remove(file_path)
+        await asyncio.to_thread(lambda: supabase.table("sources").delete().eq("id", str(source_id)).execute())
+        raise HTTPException(status_code=429, detail=str(e))
     
-    return source_record
+    return {**source_record, "job_id": job_id}
+
+def _remove_queued_spools(cancelled: List[Job]):
+    """Removes the spooled uploads of cancelled jobs that never started; a running job's worker removes its own."""
+    for job in cancelled:
+        if job.status == "queued":
+            try:
+                os.remove(job.payload["file_path"])
+            except OSError:
+                pass
+
+@app.put("/documents/{source_id}", response_model=SourceResponse)
+async def replace_document(source_id: uuid.UUID, file: UploadFile = File(...)):
+    """
+    Re-indexes an existing source with new file content. Chunks whose text did not change
+    reuse their stored embeddings, only changed chunks are embedded again.
+    """
+    supabase = get_supabase_client()
+    res = await asyncio.to_thread(lambda: supabase.table("sources").select("*").eq("id", str(source_id)).execute())
+    if not res.data:
+        raise HTTPException(status_code=404, detail="Source not found")
+    source_record = res.data[0]
+    await _check_admission()
+    
+    file_path, content_hash = await _spool_upload(file)
+    
+    # Same content as currently indexed: nothing to do
+    if source_record.get("content_hash") == content_hash and source_record["status"] != "failed":
+        os.remove(file_path)
+        return source_record
+    
+    # Claim the new hash first: the unique index rejects content another source already has
+    data = {"filename": file.filename, "filetype": file.content_type, "content_hash": content_hash, "status": "uploaded"}
+    try:
+        res = await asyncio.to_thread(lambda: supabase.table("sources").update(data).eq("id", str(source_id)).execute())
+    except APIError as e:
+        os.remove(file_path)
+        if e.code != UNIQUE_VIOLATION:
+            raise
+        existing = await _find_source_by_hash(content_hash)
+        detail = f"Identical content is already indexed as source {existing['id']}" if existing else "Identical content is being uploaded, try again"
+        raise HTTPException(status_code=409, detail=detail)
+    
+    # Earlier jobs of the source are cancelled with the enqueue, so only the new content is stored
+    payload = {"source_id": str(source_id), "file_path": file_path, "filename": file.filename}
+    try:
+        job_id, cancelled = await asyncio.to_thread(job_queue.enqueue_replacing, "index_document", payload)
+    except QueueFullError as e:
+        os.remove(file_path)
+        previous = {key: source_record.get(key) for key in data}
+        await asyncio.to_thread(lambda: supabase.table("sources").update(previous).eq("id", str(source_id)).execute())
+        raise HTTPException(status_code=429, detail=str(e))
+    _remove_queued_spools(cancelled)
+    
+    return {**(res.data[0] if res.data else source_record), "job_id": job_id}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
 @app.get("/documents", response_model=List[SourceResponse])
 def get_documents():
@@ -50,13 +233,19 @@ def get_documents():
     return response.data
 
 @app.delete("/documents/{source_id}")
-def delete_document(source_id: uuid.UUID):
+async def delete_document(source_id: uuid.UUID):
     supabase = get_supabase_client()
+    # Stop indexing first, so no window of a running job is stored after the chunks are deleted
+    _remove_queued_spools(await asyncio.to_thread(job_queue.cancel_source, str(source_id)))
     # Cascading delete in SQL should handle chunks
-    response = supabase.table("sources").delete().eq("id", str(source_id)).execute()
+    response = await asyncio.to_thread(lambda: supabase.table("sources").delete().eq("id", str(source_id)).execute())
     if not response.data:
          # It might return empty list if already deleted or not found, but trying to be robust
          pass
+    await asyncio.to_thread(get_retrieval_backend().delete_source, str(source_id))
+    # Invalidates cached answers depending on this source, here and in other API processes
+    await asyncio.to_thread(job_queue.publish_source_event, str(source_id), "deleted")
+    await _sync_source_events(force=True)
     return {"message": "Deleted"}
 
 def rrf_fusion(semantic_list: List[Dict], keyword_list: List[Dict], k: int = 60) -> List[Dict]:
@@ -91,138 +280,552 @@ def rrf_fusion(semantic_list: List[Dict], keyword_list: List[Dict], k: int = 60)
         
     return result
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    t0 = time.perf_counter()
-    
-    # 1. Check Cache
-    source_ids_str = [str(uid) for uid in request.source_ids] if request.source_ids else []
-    cached_response = chat_cache.get(request.question, source_ids_str)
-    
-    if cached_response:
-        t_total = (time.perf_counter() - t0) * 1000
-        print(f"\n[CACHE HIT] key='{request.question}' | Total: {t_total:.2f}ms")
-        return cached_response
-    
-    print(f"\n[CACHE MISS] key='{request.question}' - Proceeding to retrieval...")
-    
-    t_retrieval_start = time.perf_counter()
-    supabase = get_supabase_client()
-    
-    # 2. Embed query
-    query_embedding = get_embedding(request.question)
-    
-    # 3. Parallel Search Execution (Semantic + Keyword)
-    filter_ids = source_ids_str if source_ids_str else None
-    
-    # Semantic Search Params
-    semantic_params = {
-        "query_embedding": query_embedding,
-        "match_threshold": 0.3, 
-        "match_count": Config.RETRIEVAL_TOP_K * 2, # Fetch more for fusion
-        "filter_source_ids": filter_ids
-    }
-    
-    # Keyword Search Params
-    keyword_params = {
-        "query_text": request.question,
-        "match_count": Config.RETRIEVAL_TOP_K * 2,
-        "filter_source_ids": filter_ids
-    }
+def _use_hybrid_search() -> bool:
+    return Config.HYBRID_SEARCH_RPC and get_retrieval_backend().has_hybrid_search
 
-    # Execute in parallel
-    task_semantic = asyncio.to_thread(lambda: supabase.rpc("match_chunks", semantic_params).execute())
-    task_keyword = asyncio.to_thread(lambda: supabase.rpc("match_chunks_keyword", keyword_params).execute())
+async def _hybrid_search(question: str, query_embedding: List[float], source_ids_str: List[str]) -> List[Dict]:
+    """
+    Hybrid search top-K. With HYBRID_SEARCH_RPC the database does both searches, RRF and
+    the filename join in one call; the two-RPC path with Python RRF is the fallback.
+    """
+    if _use_hybrid_search():
+        try:
+            return await _hybrid_search_rpc(question, query_embedding, source_ids_str)
+        except Exception as e:
+            log.warning("search.hybrid_rpc_failed", error=str(e), fallback="two_rpc")
+    return await _hybrid_search_two_rpc(question, query_embedding, source_ids_str)
 
-    results = await asyncio.gather(task_semantic, task_keyword, return_exceptions=True)
+async def _hybrid_search_rpc(question: str, query_embedding: List[float], source_ids_str: List[str]) -> List[Dict]:
+    """Single round trip: sql/04_hybrid_search_rpc.sql, results already carry `filename`."""
+    return await get_retrieval_backend().hybrid_search(question, query_embedding, source_ids_str, Config.RETRIEVAL_TOP_K)
+
+async def _semantic_search(query_embedding: List[float], source_ids_str: List[str]) -> List[Dict]:
+    """Semantic leg of the two-leg path (match_chunks RPC or the local store)."""
+    # Fetch more for fusion
+    return await get_retrieval_backend().semantic_search(query_embedding, source_ids_str, Config.RETRIEVAL_TOP_K * 2)
+
+async def _keyword_search(question: str, source_ids_str: List[str]) -> List[Dict]:
+    """Keyword leg of the two-leg path (match_chunks_keyword RPC or the local store), needs no embedding."""
+    return await get_retrieval_backend().keyword_search(question, source_ids_str, Config.RETRIEVAL_TOP_K * 2)
+
+def _fuse(semantic_matches: List[Dict], keyword_matches: List[Dict]) -> List[Dict]:
+    # RRF Fusion
+    fused_matches = rrf_fusion(semantic_matches, keyword_matches, k=Config.RRF_K)
+    return fused_matches[:Config.RETRIEVAL_TOP_K]
+
+async def _hybrid_search_two_rpc(question: str, query_embedding: List[float], source_ids_str: List[str]) -> List[Dict]:
+    """Runs semantic and keyword search in parallel and fuses them with RRF."""
+    # Execute in parallel
+    results = await asyncio.gather(
+        _semantic_search(query_embedding, source_ids_str),
+        _keyword_search(question, source_ids_str),
+        return_exceptions=True
+    )
     
     # Handle results
     semantic_res = results[0]
     keyword_res = results[1]
     
-    semantic_matches = semantic_res.data if not isinstance(semantic_res, Exception) and semantic_res.data else []
-    keyword_matches = keyword_res.data if not isinstance(keyword_res, Exception) and keyword_res.data else []
-    
     if isinstance(semantic_res, Exception):
-        print(f"Error in Semantic Search: {semantic_res}")
+        log.warning("search.semantic_failed", error=str(semantic_res))
+        semantic_res = []
     if isinstance(keyword_res, Exception):
-        print(f"Error in Keyword Search: {keyword_res}")
+        log.warning("search.keyword_failed", error=str(keyword_res))
+        keyword_res = []
+
+    return _fuse(semantic_res, keyword_res)
+
+async def _build_sources(candidates: List[Dict], known_filenames: Optional[Dict[str, str]] = None) -> List[Source]:
+    """
+    Formats reranked candidates as response sources, looking up filenames the search did not return.
+    known_filenames (shared by the items of a batch) skips sources already looked up and collects new ones.
+    """
+    supabase = get_supabase_client()
+    known = known_filenames if known_filenames is not None else {}
+    source_ids = list(set([m["source_id"] for m in candidates if not m.get("filename") and m["source_id"] not in known]))
+    filename_map = {**known, **{m["source_id"]: m["filename"] for m in candidates if m.get("filename")}}
+    if source_ids:
+        try:
+            src_res = await asyncio.to_thread(lambda: supabase.table("sources").select("id, filename").in_("id", source_ids).execute())
+            found = {item["id"]: item["filename"] for item in src_res.data}
+            filename_map.update(found)
+            known.update(found)
+        except Exception as e:
+            log.warning("sources.filename_lookup_failed", error=str(e))
+
+    return [
+        Source(
+            source_id=m["source_id"],
+            filename=filename_map.get(m["source_id"], "Unknown"),
+            chunk_index=m["chunk_index"],
+            similarity=m["similarity"],
+            chunk_text=m["content"]
+        )
+        for m in candidates
+    ]
+
+NO_RESULTS_ANSWER = "I couldn't find any relevant information via Semantic or Keyword search."
+NO_TIME_ANSWER = "I couldn't generate an answer within the time limit."
+
+def _log_stats(question: str, t0: float, timings: Dict[str, float], t_gen_ms: float):
+    t_total = (time.perf_counter() - t0) * 1000
+    CHAT_STAGE_SECONDS.observe(t_total / 1000, stage="total")
+    log.info("chat.timing", question=question, total_ms=round(t_total, 2), retrieval_ms=round(timings.get("retrieval", 0), 2),
+             rerank_ms=round(timings.get("rerank", 0), 2), gen_ms=round(t_gen_ms, 2))
+    log.debug("chat.cache_stats", chat_cache=chat_cache.stats(), rerank_cache=rerank_cache.stats(), embedding_cache=embedding_cache.stats())
+
+def _retrieval_report(candidates: List[Dict]):
+    # Log Retrieval Results
+    log.info("chat.retrieval", top_k=Config.RETRIEVAL_TOP_K, candidates=len(candidates), top=[
+        {"source_id": m.get("source_id"), "chunk_index": m.get("chunk_index"), "score": round(m.get("similarity") or 0.0, 4)}
+        for m in candidates[:5]
+    ])
+
+class ChatBudget:
+    """
+    Absolute end times (time.perf_counter()) of the /chat phases, from an end-to-end deadline
+    split by CHAT_BUDGET_RETRIEVAL and CHAT_BUDGET_RERANK; generation gets the rest. Time a
+    phase leaves unused rolls over to the next one. All None when there is no deadline.
+    """
+    def __init__(self, t0: float, deadline_ms: int):
+        self.deadline_ms = deadline_ms
+        if deadline_ms > 0:
+            total = deadline_ms / 1000
+            self.retrieval_end = t0 + total * Config.CHAT_BUDGET_RETRIEVAL
+            self.rerank_end = self.retrieval_end + total * Config.CHAT_BUDGET_RERANK
+            self.generation_end = t0 + total
+        else:
+            self.retrieval_end = self.rerank_end = self.generation_end = None
+
+    def context_tokens(self, max_tokens: int) -> int:
+        """
+        Context budget scaled down when less than CHAT_CONTEXT_FULL_MS is left for generation
+        (a shorter prompt starts answering sooner), never below a quarter of max_tokens.
+        """
+        if self.generation_end is None or not max_tokens or Config.CHAT_CONTEXT_FULL_MS <= 0:
+            return max_tokens
+        remaining_ms = (self.generation_end - time.perf_counter()) * 1000
+        if remaining_ms >= Config.CHAT_CONTEXT_FULL_MS:
+            return max_tokens
+        return max(int(max_tokens * remaining_ms / Config.CHAT_CONTEXT_FULL_MS), max_tokens // 4)
+
+def _chat_pipeline(question: str, source_ids_str: List[str], flight: Flight, budget: ChatBudget, degradations: List[str],
+                   query_embedding: Optional[List[float]] = None, known_filenames: Optional[Dict[str, str]] = None) -> Pipeline:
+    """
+    The cache-miss half of /chat as a DAG, so independent stages overlap:
+
+        embed ──> semantic_cache ─────────┐
+          └────> semantic_search ──> fuse ──> rerank ──> context ──> sources
+                 keyword_search ───┘                        └─────> generate
+
+    The keyword leg starts immediately (it needs no embedding), and the filename lookup
+    (sources) runs alongside generation; generate holds its first token until the sources
+    event is out. With HYBRID_SEARCH_RPC (and a backend that has it), one hybrid_search stage
+    replaces both legs and fuse.
+
+    Stages that run out of time or fail degrade instead of failing the request, and record
+    what they gave up in degradations. A query_embedding computed beforehand (/chat/batch
+    embeds all its questions in one call) makes embed a no-op.
+    """
+    def degrade(label: str):
+        if label not in degradations:
+            degradations.append(label)
 
-    # 4. RRF Fusion
-    fused_matches = rrf_fusion(semantic_matches, keyword_matches, k=60)
-    retrieval_candidates = fused_matches[:Config.RETRIEVAL_TOP_K]
+    async def embed(ctx: PipelineRun):
+        if query_embedding is not None:
+            return query_embedding
+        return await get_embedding_async(question)
+
+    async def semantic_cache(ctx: PipelineRun):
+        # Near-duplicate question already answered under the same filter
+        if ctx.results["embed"] is None:
+            return
+        semantic_response = chat_cache.get_semantic(ctx.results["embed"], source_ids_str)
+        if semantic_response:
+            log.info("chat.cache_hit", tier="semantic", question=question, total_ms=round((time.perf_counter() - ctx.t0) * 1000, 2))
+            raise StopPipeline(semantic_response)
+
+    async def semantic_search(ctx: PipelineRun):
+        if ctx.results["embed"] is None:
+            raise RuntimeError("no question embedding")
+        return await _semantic_search(ctx.results["embed"], source_ids_str)
+
+    async def keyword_search(ctx: PipelineRun):
+        return await _keyword_search(question, source_ids_str)
+
+    async def fuse(ctx: PipelineRun):
+        candidates = _fuse(ctx.results["semantic_search"], ctx.results["keyword_search"])
+        _retrieval_report(candidates)
+        return candidates
+
+    async def hybrid_search(ctx: PipelineRun):
+        if ctx.results["embed"] is None:
+            # Keyword leg alone, in whatever retrieval budget is left
+            degrade("semantic_search_skipped")
+            candidates = (await _keyword_search(question, source_ids_str))[:Config.RETRIEVAL_TOP_K]
+        else:
+            candidates = await _hybrid_search(question, ctx.results["embed"], source_ids_str)
+        _retrieval_report(candidates)
+        return candidates
+
+    retrieval_stage = "hybrid_search" if _use_hybrid_search() else "fuse"
+
+    async def rerank(ctx: PipelineRun):
+        reranked = await rerank_async(question, ctx.results[retrieval_stage], top_n=Config.RERANK_TOP_N, query_embedding=ctx.results["embed"])
+        # Log Rerank Results
+        if Config.RERANK_ENABLED:
+            log.info("chat.rerank", top_n=Config.RERANK_TOP_N, top=[
+                {"source_id": m.get("source_id"), "chunk_index": m.get("chunk_index"), "preview": (m.get("content") or "")[:50]}
+                for m in reranked
+            ])
+        return reranked
+
+    async def context(ctx: PipelineRun):
+        # Merge adjacent chunks, drop duplicates, fit the token budget
+        reranked = ctx.results["rerank"]
+        max_tokens = budget.context_tokens(Config.CONTEXT_MAX_TOKENS)
+        packed = pack_context(reranked, max_tokens)
+        if max_tokens < Config.CONTEXT_MAX_TOKENS and (packed.truncated or len(packed.candidates) + packed.duplicates < len(reranked)):
+            degrade("context_shrunk")
+        log.info("chat.context", chunks=len(packed.candidates), candidates=len(reranked), spans=len(packed.texts), tokens=packed.tokens,
+                 max_tokens=max_tokens, verbatim_tokens=packed.input_tokens, duplicates=packed.duplicates, truncated=packed.truncated)
+        return packed
+
+    def emit_sources(final_sources: List[Source]) -> List[Source]:
+        flight.emit(("sources", [src.model_dump(mode="json") for src in final_sources]))
+        return final_sources
+
+    async def sources(ctx: PipelineRun):
+        # Exactly the chunks whose text is in the prompt
+        return emit_sources(await _build_sources(ctx.results["context"].candidates, known_filenames))
+
+    answer_parts: List[str] = []
+
+    async def generate(ctx: PipelineRun):
+        packed = ctx.results["context"]
+        if not packed.texts:
+            await ctx.result("sources")
+            flight.emit(("token", {"text": NO_RESULTS_ANSWER}))
+            return NO_RESULTS_ANSWER
+        async for token in generate_answer_stream(question, packed.texts):
+            if not answer_parts:
+                await ctx.result("sources")  # Keeps `sources` ahead of the first token
+            answer_parts.append(token)
+            flight.emit(("token", {"text": token}))
+        return "".join(answer_parts)
+
+    def embed_fallback(ctx: PipelineRun, error: Exception):
+        degrade("semantic_search_skipped")
+        return None
+
+    def leg_fallback(label: str):
+        def fallback(ctx: PipelineRun, error: Exception):
+            degrade(label)
+            return []
+        return fallback
+
+    def rerank_fallback(ctx: PipelineRun, error: Exception):
+        degrade("rerank_skipped")
+        return ctx.results[retrieval_stage][:Config.RERANK_TOP_N]
+
+    def sources_fallback(ctx: PipelineRun, error: Exception):
+        degrade("filenames_skipped")
+        return emit_sources([
+            Source(source_id=m["source_id"], filename=m.get("filename") or "Unknown", chunk_index=m["chunk_index"], similarity=m["similarity"], chunk_text=m["content"])
+            for m in ctx.results["context"].candidates
+        ])
+
+    def generate_fallback(ctx: PipelineRun, error: Exception):
+        # Out of time: keep what was generated; real errors still fail the request
+        if not isinstance(error, asyncio.TimeoutError):
+            raise error
+        degrade("answer_truncated")
+        if not answer_parts:
+            flight.emit(("token", {"text": NO_TIME_ANSWER}))
+            return NO_TIME_ANSWER
+        return "".join(answer_parts)
+
+    stages = [
+        Stage("embed", embed, timeout=Config.PIPELINE_TIMEOUT_EMBED, fallback=embed_fallback, deadline=budget.retrieval_end),
+        Stage("semantic_cache", semantic_cache, deps=["embed"])
+    ]
+    if _use_hybrid_search():
+        stages.append(Stage("hybrid_search", hybrid_search, deps=["embed", "semantic_cache"], timeout=Config.PIPELINE_TIMEOUT_SEARCH,
+                            fallback=leg_fallback("search_skipped"), deadline=budget.retrieval_end))
+    else:
+        # One failed or slow leg still leaves the other one's results
+        stages += [
+            Stage("semantic_search", semantic_search, deps=["embed"], timeout=Config.PIPELINE_TIMEOUT_SEARCH,
+                  fallback=leg_fallback("semantic_search_skipped"), deadline=budget.retrieval_end),
+            Stage("keyword_search", keyword_search, timeout=Config.PIPELINE_TIMEOUT_SEARCH,
+                  fallback=leg_fallback("keyword_search_skipped"), deadline=budget.retrieval_end),
+            Stage("fuse", fuse, deps=["semantic_search", "keyword_search", "semantic_cache"])
+        ]
+    stages += [
+        Stage("rerank", rerank, deps=[retrieval_stage], timeout=Config.PIPELINE_TIMEOUT_RERANK, fallback=rerank_fallback, deadline=budget.rerank_end),
+        Stage("context", context, deps=["rerank"]),
+        Stage("sources", sources, deps=["context"], timeout=Config.PIPELINE_TIMEOUT_SOURCES, fallback=sources_fallback, deadline=budget.generation_end),
+        Stage("generate", generate, deps=["context"], timeout=Config.PIPELINE_TIMEOUT_GENERATE, fallback=generate_fallback, deadline=budget.generation_end)
+    ]
+    return Pipeline(stages)
+
+def _deadline_ms(deadline_ms: Optional[int]) -> int:
+    """Effective deadline of a request: its own, or CHAT_DEADLINE_MS. 0 = no deadline."""
+    return Config.CHAT_DEADLINE_MS if deadline_ms is None else deadline_ms
+
+def _time_left(t0: float, deadline_ms: int) -> Optional[float]:
+    """Seconds until the deadline of a request that started at t0, None without a deadline."""
+    if deadline_ms <= 0:
+        return None
+    return max(0.0, t0 + deadline_ms / 1000 - time.perf_counter())
+
+def _partial_answer(flight: Flight) -> ChatResponse:
+    """What a flight emitted so far, for a caller whose own deadline passed before it finished."""
+    sources = next((data for event, data in flight.items if event == "sources"), [])
+    answer = "".join(data["text"] for event, data in flight.items if event == "token")
+    CHAT_DEGRADATIONS.inc(kind="answer_truncated")
+    return ChatResponse(answer=answer or NO_TIME_ANSWER, sources=sources, degradations=["answer_truncated"])
+
+async def _flight_answer(flight: Flight, t0: float, deadline_ms: int) -> ChatResponse:
+    """
+    The flight's answer, waited for only until this caller's own deadline; after that the
+    caller gets what was generated so far and the flight keeps running for the others.
+    """
+    if not await flight.wait(_time_left(t0, deadline_ms)):
+        log.warning("chat.deadline_left_flight", deadline_ms=deadline_ms)
+        return _partial_answer(flight)
+    return await flight.result()
+
+async def _answer(question: str, source_ids_str: List[str], flight: Flight, deadline_ms: int,
+                  query_embedding: Optional[List[float]] = None, known_filenames: Optional[Dict[str, str]] = None) -> ChatResponse:
+    """
+    Cache-miss pipeline (steps 2-7), run once per flight of concurrent identical questions
+    with the same effective deadline (see _deadline_ms).
+    Emits `sources` and `token` events as they become available for /chat/stream subscribers.
+    """
+    t0 = time.perf_counter()
+    snapshot = chat_cache.snapshot()
+    budget = ChatBudget(t0, deadline_ms)
+    degradations: List[str] = []
     
-    t_retrieval_end = time.perf_counter()
-    t_retrieval_ms = (t_retrieval_end - t_retrieval_start) * 1000
+    # 2-6. Embed, search, rerank, pack context, look up filenames, generate
+    pipeline = _chat_pipeline(question, source_ids_str, flight, budget, degradations, query_embedding, known_filenames)
+    run = await pipeline.run()
+    pipeline.report(run, question=question)
+    for stage, duration_ms in run.durations.items():
+        CHAT_STAGE_SECONDS.observe(duration_ms / 1000, stage=stage)
+    if run.stopped:
+        return run.stopped.result
+
+    final_sources = run.results["sources"]
+    chat_response = ChatResponse(
+        answer=run.results["generate"],
+        sources=final_sources,
+        degradations=degradations
+    )
+    if degradations:
+        for kind in degradations:
+            CHAT_DEGRADATIONS.inc(kind=kind)
+        log.warning("chat.degraded", question=question, degradations=degradations, deadline_ms=budget.deadline_ms)
     
-    # Log Retrieval Results
-    print("\n--- Retrieval Mini-Report ---")
-    print(f"Top-{Config.RETRIEVAL_TOP_K} candidates after RRF:")
-    for i, m in enumerate(retrieval_candidates[:5]):
-        print(f"{i+1}. ID: {m.get('source_id')} | Chunk: {m.get('chunk_index')} | Score: {m.get('similarity'):.4f}")
+    # 7. Set Cache (degraded answers are not worth repeating once upstreams recover)
+    if final_sources and not degradations:
+        await chat_cache.set_async(question, chat_response, source_ids_str, query_embedding=run.results["embed"],
+                                   used_source_ids=[str(src.source_id) for src in final_sources], snapshot=snapshot)
+        
+    # Final Config/Timing Log
+    retrieval_stage = "hybrid_search" if _use_hybrid_search() else "fuse"
+    timings = {"retrieval": run.finished_at(retrieval_stage), "rerank": run.durations.get("rerank", 0.0)}
+    _log_stats(question, t0, timings, run.durations.get("generate", 0.0))
+    
+    return chat_response
 
-    # 5. Rerank
-    t_rerank_start = time.perf_counter()
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    t0 = time.perf_counter()
     
-    reranked_candidates = rerank(request.question, retrieval_candidates, top_n=Config.RERANK_TOP_N)
+    # 1. Check Cache
+    await _sync_source_events()
+    source_ids_str = [str(uid) for uid in request.source_ids] if request.source_ids else []
+    cached_response = await chat_cache.get_async(request.question, source_ids_str)
     
-    t_rerank_end = time.perf_counter()
-    t_rerank_ms = (t_rerank_end - t_rerank_start) * 1000
+    if cached_response:
+        t_total = time.perf_counter() - t0
+        CHAT_REQUEST_SECONDS.observe(t_total, endpoint="chat", cache="hit")
+        log.info("chat.cache_hit", question=request.question, total_ms=round(t_total * 1000, 2))
+        return cached_response
+    
+    log.info("chat.cache_miss", question=request.question)
+    
+    # 2-7. Computed once for all concurrent requests with the same cache key and deadline
+    deadline_ms = _deadline_ms(request.deadline_ms)
+    compute = lambda flight: _answer(request.question, source_ids_str, flight, deadline_ms)
+    async with chat_cache.flight(request.question, source_ids_str, compute, deadline_ms) as flight:
+        response = await _flight_answer(flight, t0, deadline_ms)
+    CHAT_REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint="chat", cache="miss")
+    return response
 
-    # Log Rerank Results
-    if Config.RERANK_ENABLED:
-        print("\n--- Rerank Mini-Report ---")
-        print(f"Top-{Config.RERANK_TOP_N} candidates after Rerank:")
-        for i, m in enumerate(reranked_candidates):
-            print(f"{i+1}. ID: {m.get('source_id')} | Chunk: {m.get('chunk_index')} | Content Preview: {m.get('content')[:50]}...")
+def _sse(event: str, data: Any) -> str:
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    # 6. Generate Answer
-    t_gen_start = time.perf_counter()
+async def _chat_events(request: ChatRequest) -> AsyncIterator[str]:
+    """
+    Event stream for /chat/stream: `sources` as soon as rerank finishes, then `token`
+    events as the answer is generated, then `done`. Cache hits replay immediately; a request
+    joining an identical question in flight replays what was generated so far, then follows it.
+    """
+    t0 = time.perf_counter()
+    await _sync_source_events()
+    source_ids_str = [str(uid) for uid in request.source_ids] if request.source_ids else []
     
-    if not reranked_candidates:
-        chat_response = ChatResponse(
-            answer="I couldn't find any relevant information via Semantic or Keyword search.",
-            sources=[]
-        )
+    cached_response = await chat_cache.get_async(request.question, source_ids_str)
+    if cached_response:
+        log.info("chat.cache_hit", question=request.question, stream=True)
     else:
-        context_chunks = [match["content"] for match in reranked_candidates]
-        answer = generate_answer(request.question, context_chunks)
+        log.info("chat.cache_miss", question=request.question, stream=True)
+        streamed = False
+        deadline_ms = _deadline_ms(request.deadline_ms)
+        compute = lambda flight: _answer(request.question, source_ids_str, flight, deadline_ms)
+        async with chat_cache.flight(request.question, source_ids_str, compute, deadline_ms) as flight:
+            try:
+                async for event, data in flight.stream(_time_left(t0, deadline_ms)):
+                    streamed = True
+                    yield _sse(event, data)
+                if not flight.task.done():
+                    # This request's deadline passed: end its stream, the flight goes on for the others
+                    log.warning("chat.deadline_left_flight", deadline_ms=deadline_ms, stream=True)
+                    partial = _partial_answer(flight)
+                    if not any(event == "sources" for event, _ in flight.items):
+                        yield _sse("sources", [])
+                    if not any(event == "token" for event, _ in flight.items):
+                        yield _sse("token", {"text": partial.answer})
+                    yield _sse("done", {"cached": False, "degradations": partial.degradations})
+                    return
+                cached_response = await flight.result()
+            except Exception as e:
+                log.exception("chat.stream_failed", question=request.question, error=str(e))
+                yield _sse("error", {"detail": str(e)})
+                return
+        if streamed:
+            CHAT_REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint="chat_stream", cache="miss")
+            yield _sse("done", {"cached": False, "degradations": cached_response.degradations})
+            return
         
-        # Format Sources
-        source_ids = list(set([m["source_id"] for m in reranked_candidates]))
-        filename_map = {}
-        if source_ids:
+    # Semantic cache hits and flights started by /chat produce no events
+    CHAT_REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint="chat_stream", cache="hit")
+    yield _sse("sources", [src.model_dump(mode="json") for src in cached_response.sources])
+    yield _sse("token", {"text": cached_response.answer})
+    yield _sse("done", {"cached": True, "degradations": cached_response.degradations})
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    return StreamingResponse(_chat_events(request), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def _embed_questions(questions: List[str]) -> List[Optional[List[float]]]:
+    """Question embeddings of a batch in one embeddings call; on failure every item embeds its own."""
+    try:
+        return await get_embeddings_async(questions, priority="batch")
+    except Exception as e:
+        log.warning("chat.batch_embed_failed", questions=len(questions), error=str(e), fallback="per_item")
+        return [None] * len(questions)
+
+async def _chat_batch(requests: List[ChatRequest]) -> AsyncIterator[Tuple[List[int], Optional[ChatResponse], Optional[str], bool]]:
+    """
+    Answers a batch of questions, yielding (input indexes, response, error, cached) for every
+    distinct question as soon as it is answered. Identical questions (same cache key) are
+    answered once. Cache hits come first; the misses are embedded in one call and then run
+    through the /chat pipeline CHAT_BATCH_CONCURRENCY at a time, sharing filename lookups.
+    Their OpenAI calls queue in the "batch" priority class, behind interactive /chat traffic.
+    A failed question yields its error instead of failing the batch.
+    """
+    t0 = time.perf_counter()
+    await _sync_source_events()
+    # Items are deduplicated by cache key and effective deadline: an answer computed under a
+    # shorter deadline may be degraded, one without a deadline may come too late
+    groups: Dict[Tuple[str, int], List[int]] = {}
+    unique: Dict[Tuple[str, int], Tuple[str, List[str], int]] = {}
+    for index, request in enumerate(requests):
+        source_ids_str = [str(uid) for uid in request.source_ids] if request.source_ids else []
+        deadline_ms = _deadline_ms(request.deadline_ms)
+        key = (chat_cache.key(request.question, source_ids_str), deadline_ms)
+        if key not in groups:
+            groups[key] = []
+            unique[key] = (request.question, source_ids_str, deadline_ms)
+        groups[key].append(index)
+
+    cached = await asyncio.gather(*(chat_cache.get_async(question, source_ids_str) for question, source_ids_str, _ in unique.values()))
+    misses = []
+    for key, cached_response in zip(unique, cached):
+        if cached_response:
+            yield groups[key], cached_response, None, True
+        else:
+            misses.append(key)
+    log.info("chat.batch", items=len(requests), unique=len(unique), cache_hits=len(unique) - len(misses))
+    if not misses:
+        return
+
+    embeddings = await _embed_questions([unique[key][0] for key in misses])
+    known_filenames: Dict[str, str] = {}
+    semaphore = asyncio.Semaphore(max(1, Config.CHAT_BATCH_CONCURRENCY))
+
+    async def answer(key: Tuple[str, int], query_embedding: Optional[List[float]]) -> Tuple[Tuple[str, int], Optional[ChatResponse], Optional[str]]:
+        request_priority.set("batch")  # Task-local
+        question, source_ids_str, deadline_ms = unique[key]
+        async with semaphore:
             try:
-                src_res = await asyncio.to_thread(lambda: supabase.table("sources").select("id, filename").in_("id", source_ids).execute())
-                filename_map = {item["id"]: item["filename"] for item in src_res.data}
+                # An item's deadline runs from when it gets its turn
+                compute = lambda flight: _answer(question, source_ids_str, flight, deadline_ms, query_embedding, known_filenames)
+                async with chat_cache.flight(question, source_ids_str, compute, deadline_ms) as flight:
+                    response = await _flight_answer(flight, time.perf_counter(), deadline_ms)
+                return key, response, None
             except Exception as e:
-                print(f"Error fetching filenames: {e}")
-
-        final_sources = []
-        for m in reranked_candidates:
-            final_sources.append(Source(
-                source_id=m["source_id"],
-                filename=filename_map.get(m["source_id"], "Unknown"),
-                chunk_index=m["chunk_index"],
-                similarity=m["similarity"],
-                chunk_text=m["content"]
-            ))
-            
-        chat_response = ChatResponse(
-            answer=answer,
-            sources=final_sources
-        )
+                log.exception("chat.batch_item_failed", question=question, error=str(e))
+                return key, None, str(e)
 
-    t_gen_end = time.perf_counter()
-    t_gen_ms = (t_gen_end - t_gen_start) * 1000
-    t_total = (t_gen_end - t0) * 1000
-    
-    # 7. Set Cache
-    if reranked_candidates:
-        chat_cache.set(request.question, chat_response, source_ids_str)
-        
-    # Final Config/Timing Log
-    print(f"\n[TIMING] Total: {t_total:.2f}ms | Retrieval: {t_retrieval_ms:.2f}ms | Rerank: {t_rerank_ms:.2f}ms | Gen: {t_gen_ms:.2f}ms")
-    print(f"[STATS] Cache Hits: {chat_cache.hits} | Misses: {chat_cache.misses}")
-    
-    return chat_response
+    tasks = [asyncio.create_task(answer(key, embedding)) for key, embedding in zip(misses, embeddings)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, response, error = await next_done
+            yield groups[key], response, error, False
+    finally:
+        # Client gone: stop answering
+        for task in tasks:
+            task.cancel()
+    log.info("chat.batch_done", items=len(requests), unique=len(unique), answered=len(misses), total_ms=round((time.perf_counter() - t0) * 1000, 2))
+
+def _check_batch_size(request: ChatBatchRequest):
+    if len(request.items) > Config.CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {Config.CHAT_BATCH_MAX_ITEMS} questions per batch")
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch(request: ChatBatchRequest):
+    _check_batch_size(request)
+    t0 = time.perf_counter()
+    results: List[Optional[ChatBatchResult]] = [None] * len(request.items)
+    all_cached = True
+    async for indexes, response, error, cached in _chat_batch(request.items):
+        all_cached = all_cached and cached
+        for index in indexes:
+            results[index] = ChatBatchResult(index=index, response=response, error=error, cached=cached)
+    CHAT_REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint="chat_batch", cache="hit" if all_cached else "miss")
+    return ChatBatchResponse(results=results)
+
+async def _chat_batch_events(request: ChatBatchRequest) -> AsyncIterator[str]:
+    """Event stream for /chat/batch/stream: one `result` per input item as it is answered, then `done`."""
+    t0 = time.perf_counter()
+    answered = cached_items = failed = 0
+    async for indexes, response, error, cached in _chat_batch(request.items):
+        for index in indexes:
+            result = ChatBatchResult(index=index, response=response, error=error, cached=cached)
+            yield _sse("result", result.model_dump(mode="json"))
+        answered += len(indexes)
+        cached_items += len(indexes) if cached else 0
+        failed += len(indexes) if error else 0
+    CHAT_REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint="chat_batch_stream", cache="hit" if cached_items == answered else "miss")
+    yield _sse("done", {"items": answered, "cached": cached_items, "failed": failed})
+
+@app.post("/chat/batch/stream")
+async def chat_batch_stream(request: ChatBatchRequest):
+    _check_batch_size(request)
+    return StreamingResponse(_chat_batch_events(request), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
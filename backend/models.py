@@ -9,10 +9,12 @@ class SourceResponse(BaseModel):
     status: str
     created_at: datetime
     error: Optional[str] = None
+    job_id: Optional[int] = None
 
 class ChatRequest(BaseModel):
     question: str
     source_ids: Optional[List[uuid.UUID]] = None
+    deadline_ms: Optional[int] = None  # Overrides CHAT_DEADLINE_MS; 0 = no deadline
 
 class Source(BaseModel):
     source_id: uuid.UUID
@@ -24,3 +26,16 @@ class Source(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: List[Source]
+    degradations: List[str] = []
+
+class ChatBatchRequest(BaseModel):
+    items: List[ChatRequest]
+
+class ChatBatchResult(BaseModel):
+    index: int  # Position in ChatBatchRequest.items
+    response: Optional[ChatResponse] = None
+    error: Optional[str] = None
+    cached: bool = False
+
+class ChatBatchResponse(BaseModel):
+    results: List[ChatBatchResult]  # In input order
@@ -1,22 +1,398 @@
+import os
 import time
 import json
+import zlib
+import socket
+import asyncio
 import hashlib
-from typing import List, Optional, Dict, Any, Tuple
+import sqlite3
+import threading
+from urllib.parse import urlparse
+from array import array
+import numpy as np
+from typing import List, Optional, Dict, Any, Tuple, Iterable, Callable, Awaitable, AsyncIterator
 from collections import OrderedDict
+from contextlib import asynccontextmanager
 from backend.config import Config
+from backend.models import ChatResponse
+from backend.services.jobs import job_queue
+from backend.services.logs import get_logger
+from backend.services.metrics import CHAT_CACHE_HITS, CHAT_CACHE_MISSES, CHAT_CACHE_EVICTIONS, CHAT_COALESCED
+
+log = get_logger("cache")
 
 class CacheEntry:
-    def __init__(self, value: Any, expires_at: float):
+    def __init__(self, value: Any, expires_at: float, deps: Optional[Iterable[str]] = None, unfiltered: bool = False, seq: int = 0):
         self.value = value
         self.expires_at = expires_at
+        # Sources the answer depends on: sources used + sources in the filter
+        self.deps = set(deps or ())
+        # "All sources" entry, also invalidated by any newly indexed source
+        self.unfiltered = unfiltered
+        # Source event log position the answer was computed at
+        self.seq = seq
 
-class ChatCache:
+class SemanticIndex:
+    """
+    Query embeddings of cached answers kept as rows of a preallocated, L2-normalized float32
+    matrix. Each row belongs to one cache key and one filter group (source filter + config
+    signature); lookups are a single masked matrix-vector product.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._matrix: Optional[np.ndarray] = None  # Allocated on first add, once the dimension is known
+        self._groups = np.full(capacity, -1, dtype=np.int64)  # -1 marks a free row
+        self._keys: List[Optional[str]] = [None] * capacity
+        self._row_of: Dict[str, int] = {}
+        self._free = list(range(capacity - 1, -1, -1))
+
+    @staticmethod
+    def group_id(signature: str) -> int:
+        return int(hashlib.md5(signature.encode()).hexdigest()[:15], 16)
+
+    def add(self, key: str, group: int, vector: List[float]):
+        q = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return
+        if self._matrix is None:
+            self._matrix = np.zeros((self.capacity, q.shape[0]), dtype=np.float32)
+        elif q.shape[0] != self._matrix.shape[1]:
+            return  # Embedding model changed dimension; skip rather than mix spaces
+        self.remove(key)
+        if not self._free:
+            return
+        row = self._free.pop()
+        self._matrix[row] = q / norm
+        self._groups[row] = group
+        self._keys[row] = key
+        self._row_of[key] = row
+
+    def remove(self, key: str):
+        row = self._row_of.pop(key, None)
+        if row is None:
+            return
+        self._groups[row] = -1
+        self._keys[row] = None
+        self._free.append(row)
+
+    def search(self, group: int, vector: List[float], threshold: float) -> Optional[str]:
+        """Returns the key of the most similar cached question in the group if above threshold."""
+        if self._matrix is None or not self._row_of:
+            return None
+        q = np.asarray(vector, dtype=np.float32)
+        if q.shape[0] != self._matrix.shape[1]:
+            return None
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return None
+        rows = np.flatnonzero(self._groups == group)
+        if rows.size == 0:
+            return None
+        sims = self._matrix[rows] @ (q / norm)
+        best = int(np.argmax(sims))
+        if sims[best] < threshold:
+            return None
+        return self._keys[rows[best]]
+
+class ChatCacheStore:
+    """
+    Shared L2 tier of the chat cache: opaque bytes by key with a TTL.
+    Implementations must be safe to call from worker threads (ChatCache runs them via to_thread).
+    """
+    name = "none"
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, data: bytes, ttl: float):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+class SqliteChatStore(ChatCacheStore):
+    """Host-local L2 in a SQLite file, shared by all uvicorn workers on the host and kept across restarts."""
+    name = "sqlite"
+
+    def __init__(self, db_path: str, max_items: int = 100000):
+        self.db_path = db_path
+        self.max_items = max_items
+        self._writes_since_prune = 0
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("create table if not exists chat_cache (key text primary key, value blob not null, expires_at real not null)")
+            conn.execute("create index if not exists idx_chat_cache_expires_at on chat_cache (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._connect() as conn:
+            row = conn.execute("select value from chat_cache where key = ? and expires_at > ?", (key, time.time())).fetchone()
+            return row[0] if row else None
+
+    def set(self, key: str, data: bytes, ttl: float):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("insert or replace into chat_cache (key, value, expires_at) values (?, ?, ?)", (key, data, now + ttl))
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= 100:
+                self._writes_since_prune = 0
+                conn.execute("delete from chat_cache where expires_at <= ?", (now,))
+                conn.execute(
+                    "delete from chat_cache where key in (select key from chat_cache order by expires_at desc limit -1 offset ?)",
+                    (self.max_items,)
+                )
+
+    def delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute("delete from chat_cache where key = ?", (key,))
+
+class RedisChatStore(ChatCacheStore):
+    """
+    L2 on any Redis-protocol server (Redis, Valkey, KeyDB or scripts/fake_redis.py), shared by the
+    worker processes of one host. Entries are validated against the host's source event log
+    (JOB_DB_PATH), which other hosts do not see, so ChatCache namespaces keys by the log's id:
+    hosts sharing a server never read each other's answers, they only share the server.
+    Speaks the few RESP commands it needs itself, one connection per thread.
+    """
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "chat:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=2)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", str(self.db))
+        return conn
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            return [self._read_reply(reader) for _ in range(int(rest))]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _command(self, *args):
+        sock, reader = self._conn()
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        try:
+            sock.sendall(b"".join(parts))
+            return self._read_reply(reader)
+        except (OSError, ConnectionError):
+            # Drop the broken connection, the next call reconnects
+            self._local.conn = None
+            sock.close()
+            raise
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command("GET", self.prefix + key)
+
+    def set(self, key: str, data: bytes, ttl: float):
+        self._command("SET", self.prefix + key, data, "PX", int(ttl * 1000))
+
+    def delete(self, key: str):
+        self._command("DEL", self.prefix + key)
+
+def build_chat_store(url: str) -> Optional[ChatCacheStore]:
+    """CHAT_CACHE_L2_URL: empty (L1 only), sqlite:///path/to/file.db or redis://host:port/db."""
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SqliteChatStore(url[len("sqlite:///"):], Config.CHAT_CACHE_L2_MAX_ITEMS)
+    if url.startswith("redis://"):
+        return RedisChatStore(url)
+    raise ValueError(f"Unsupported CHAT_CACHE_L2_URL: {url}")
+
+class Flight:
+    """
+    One computation shared by concurrent identical requests. It runs as its own task, so a
+    caller that disconnects does not fail the others; it is cancelled only once every caller
+    has left. Items passed to emit() (e.g. streamed tokens) are replayed to every subscriber,
+    including ones that join late.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.items: List[Any] = []
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+        self._wakeup = loop.create_future()
+
+    def _notify(self, *_):
+        if not self._wakeup.done():
+            self._wakeup.set_result(None)
+        self._wakeup = self.loop.create_future()
+
+    def emit(self, item: Any):
+        self.items.append(item)
+        self._notify()
+
+    async def stream(self, timeout: Optional[float] = None) -> AsyncIterator[Any]:
+        """Yields emitted items in order until the computation finishes, or timeout seconds passed."""
+        end = None if timeout is None else self.loop.time() + timeout
+        i = 0
+        while True:
+            wakeup = self._wakeup
+            while i < len(self.items):
+                yield self.items[i]
+                i += 1
+            if self.task.done():
+                return
+            remaining = None if end is None else end - self.loop.time()
+            if remaining is not None and remaining <= 0:
+                return
+            # asyncio.wait never cancels the shared future when this subscriber is cancelled
+            await asyncio.wait([wakeup], timeout=remaining)
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits up to timeout seconds for the computation. Returns whether it finished."""
+        done, _ = await asyncio.wait([self.task], timeout=timeout)
+        return bool(done)
+
+    async def result(self) -> Any:
+        await asyncio.wait([self.task])
+        return self.task.result()
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations with the same key: the first caller starts it,
+    duplicates arriving while it runs share its result or error instead of recomputing.
+    Flights belong to the event loop they were started on; the registry is thread-safe.
+    """
     def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Tuple[int, str], Flight] = {}
+        self.coalesced = 0
+
+    def _finish(self, slot: Tuple[int, str], flight: Flight):
+        with self._lock:
+            if self._flights.get(slot) is flight:
+                del self._flights[slot]
+        if not flight.task.cancelled():
+            flight.task.exception()  # Marks the error retrieved when nobody is left to await it
+        flight._notify()
+
+    @asynccontextmanager
+    async def join(self, key: Optional[str], compute: Callable[[Flight], Awaitable[Any]]) -> AsyncIterator[Flight]:
+        """key=None starts a private flight that nobody else can join."""
+        loop = asyncio.get_running_loop()
+        slot = (id(loop), key)
+        with self._lock:
+            flight = self._flights.get(slot) if key is not None else None
+            if flight is None:
+                flight = Flight(loop)
+                if key is not None:
+                    self._flights[slot] = flight
+                flight.task = loop.create_task(compute(flight))
+                flight.task.add_done_callback(lambda _: self._finish(slot, flight))
+            else:
+                self.coalesced += 1
+                CHAT_COALESCED.inc()
+                log.info("chat.coalesced", callers=flight.subscribers + 1)
+            flight.subscribers += 1
+        try:
+            yield flight
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+                abandoned = flight.subscribers == 0
+            if abandoned and not flight.task.done():
+                flight.task.cancel()
+
+class ChatCache:
+    """
+    Two-tier answer cache with source-aware invalidation.
+    L1 is the in-process LRU + TTL (with the semantic index); L2 is an optional shared
+    ChatCacheStore, so all worker processes see each other's answers and restarts keep them.
+    Semantic lookups only consult L1; an exact L2 hit is promoted to L1.
+    Concurrent misses for the same key and deadline are coalesced into one computation (flight).
+    L1 state is guarded by a lock, so the cache can be used from the event loop and threads.
+
+    Every entry records the sources it depends on (sources its answer used plus, for filtered
+    questions, the sources in the filter) and the position in the source event log it was
+    computed at. Event log positions are global to the log (the SQLite job database of the host),
+    so the same check works for entries written by other processes of the host; L2 keys are
+    prefixed with the log's id, so entries checked against another log are never read:
+      - A deleted source invalidates only the entries that depend on it.
+      - An indexed / re-indexed source invalidates entries that depend on it plus all
+        "all sources" entries, since new chunks may now rank for any unfiltered question.
+    """
+    def __init__(self, store: Optional[ChatCacheStore] = None, value_model: Optional[type] = None, namespace: str = ""):
         self.max_items = Config.CACHE_MAX_ITEMS
         self.ttl = Config.CACHE_TTL_SECONDS
+        self.store = store
+        self.value_model = value_model  # Pydantic model of cached values, needed to decode L2 entries
+        self.namespace = namespace  # Prefix of L2 keys: the id of the source event log entries are checked against
         self._cache: OrderedDict[str, CacheEntry] = OrderedDict()
-        self.hits = 0
+        self._semantic = SemanticIndex(self.max_items)
+        self._event_seq = 0  # Last applied source event
+        self._source_seq: Dict[str, int] = {}  # Source ID -> seq of its last event
+        self._corpus_seq = 0  # Seq of the last indexing event of any source
+        self._dependents: Dict[str, set] = {}  # Source ID -> keys of entries depending on it
+        self._unfiltered: set = set()  # Keys of "all sources" entries
+        self._lock = threading.RLock()
+        self._flights = SingleFlight()
+        self.l1_hits = 0
+        self.l2_hits = 0
         self.misses = 0
+        self.semantic_hits = 0
+        self.l2_errors = 0
+        self.invalidations = 0
+
+    @property
+    def hits(self) -> int:
+        return self.l1_hits + self.l2_hits
+
+    def _filter_signature(self, source_ids: List[str]) -> str:
+        """Everything besides the question that determines an answer: source filter and config."""
+        # Normalize Source IDs
+        norm_sources = ",".join(sorted(source_ids)) if source_ids else "all"
+        
+        # Config Dependencies (if these change, cache should be invalid): retrieval, reranking, context packing, index
+        config_sig = ":".join(str(value) for value in (
+            Config.RETRIEVAL_TOP_K, Config.RETRIEVAL_BACKEND, Config.HYBRID_SEARCH_RPC,
+            Config.EMBEDDING_DIMENSIONS, Config.VECTOR_COARSE_DIMENSIONS, Config.VECTOR_COARSE_QUANTIZATION, Config.VECTOR_RESCORE_FACTOR,
+            Config.RERANK_ENABLED, Config.RERANK_MODE, Config.RERANK_LOCAL_BM25_WEIGHT, Config.RERANK_TOP_N,
+            Config.CONTEXT_MAX_TOKENS,
+            Config.INDEX_VERSION
+        ))
+        
+        return f"{norm_sources}|{config_sig}"
 
     def _generate_key(self, question: str, source_ids: List[str]) -> str:
         """
@@ -25,52 +401,499 @@ class ChatCache:
         # 1. Normalize question
         norm_q = question.strip().lower()
         
-        # 2. Normalize Source IDs
-        norm_sources = ",".join(sorted(source_ids)) if source_ids else "all"
+        # 2. Source filter and config signature
+        raw_key = f"{norm_q}|{self._filter_signature(source_ids)}"
+        return hashlib.md5(raw_key.encode()).hexdigest()
+
+    def key(self, question: str, source_ids: Optional[List[str]] = None) -> str:
+        """Cache key of a question: equal keys get the same answer (used to deduplicate batches)."""
+        return self._generate_key(question, source_ids or [])
+
+    def _evict(self, key: str):
+        # Keeps the semantic index and dependency indexes in sync with the LRU (caller holds the lock)
+        entry = self._cache.pop(key, None)
+        self._semantic.remove(key)
+        if entry is None:
+            return
+        for source_id in entry.deps:
+            keys = self._dependents.get(source_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[source_id]
+        self._unfiltered.discard(key)
+
+    def _is_current(self, entry: CacheEntry) -> bool:
+        if entry.unfiltered and self._corpus_seq > entry.seq:
+            return False
+        return all(self._source_seq.get(source_id, 0) <= entry.seq for source_id in entry.deps)
+
+    def _get_entry(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            
+            # Check TTL and source events
+            if time.time() > entry.expires_at:
+                self._evict(key)
+                CHAT_CACHE_EVICTIONS.inc(reason="expired")
+                return None
+            if not self._is_current(entry):
+                self._evict(key)
+                CHAT_CACHE_EVICTIONS.inc(reason="invalidated")
+                return None
+                
+            # Move to end (LRU)
+            self._cache.move_to_end(key)
+            return entry.value
+
+    def _put_entry(self, key: str, entry: CacheEntry, query_embedding: Optional[List[float]] = None, source_ids: List[str] = None):
+        with self._lock:
+            self._put_entry_locked(key, entry, query_embedding, source_ids)
+
+    def _put_entry_locked(self, key: str, entry: CacheEntry, query_embedding: Optional[List[float]], source_ids: Optional[List[str]]):
+        if key in self._cache:
+            self._evict(key)
         
-        # 3. Config Dependencies (if these change, cache should be invalid)
-        config_sig = f"{Config.RETRIEVAL_TOP_K}:{Config.RERANK_ENABLED}:{Config.RERANK_TOP_N}:{Config.INDEX_VERSION}"
+        # Evict if full
+        if len(self._cache) >= self.max_items:
+            # Least recently used is at the beginning (move_to_end on access)
+            oldest_key = next(iter(self._cache))
+            self._evict(oldest_key)
+            CHAT_CACHE_EVICTIONS.inc(reason="capacity")
+            
+        self._cache[key] = entry
+        for source_id in entry.deps:
+            self._dependents.setdefault(source_id, set()).add(key)
+        if entry.unfiltered:
+            self._unfiltered.add(key)
         
-        raw_key = f"{norm_q}|{norm_sources}|{config_sig}"
-        return hashlib.md5(raw_key.encode()).hexdigest()
+        if Config.SEMANTIC_CACHE_ENABLED and query_embedding is not None:
+            group = SemanticIndex.group_id(self._filter_signature(source_ids or []))
+            self._semantic.add(key, group, query_embedding)
+
+    def _encode(self, entry: CacheEntry) -> bytes:
+        # Compact JSON, zlib-compressed: answers and chunk texts compress well
+        payload = {
+            "v": entry.value.model_dump(mode="json"),
+            "e": entry.expires_at,
+            "d": sorted(entry.deps),
+            "u": entry.unfiltered,
+            "s": entry.seq
+        }
+        return zlib.compress(json.dumps(payload, separators=(",", ":")).encode())
+
+    def _decode(self, data: bytes) -> CacheEntry:
+        payload = json.loads(zlib.decompress(data))
+        return CacheEntry(self.value_model.model_validate(payload["v"]), payload["e"], payload["d"], payload["u"], payload["s"])
+
+    def _l2_read(self, key: str) -> Optional[bytes]:
+        try:
+            return self.store.get(f"{self.namespace}:{key}")
+        except Exception as e:
+            self._count("l2_errors")
+            log.warning("chat_cache.l2_read_failed", error=str(e))
+            return None
+
+    def _l2_write(self, key: str, data: bytes, ttl: float):
+        try:
+            self.store.set(f"{self.namespace}:{key}", data, ttl)
+        except Exception as e:
+            self._count("l2_errors")
+            log.warning("chat_cache.l2_write_failed", error=str(e))
+
+    def _promote(self, key: str, data: Optional[bytes]) -> Optional[Any]:
+        """Validates an L2 entry against the source events seen by this process and copies it to L1."""
+        if data is None:
+            return None
+        entry = self._decode(data)
+        with self._lock:
+            if time.time() > entry.expires_at or not self._is_current(entry):
+                return None
+            self._put_entry_locked(key, entry, None, None)
+        return entry.value
+
+    def _uses_l2(self) -> bool:
+        return self.store is not None and self.value_model is not None
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        if counter == "misses":
+            CHAT_CACHE_MISSES.inc()
+        elif counter.endswith("_hits"):
+            CHAT_CACHE_HITS.inc(tier=counter[:-len("_hits")])
 
     def get(self, question: str, source_ids: List[str] = None) -> Optional[Any]:
         if not Config.CACHE_ENABLED:
             return None
             
         key = self._generate_key(question, source_ids or [])
-        
-        if key not in self._cache:
-            self.misses += 1
+        value = self._get_entry(key)
+        if value is not None:
+            self._count("l1_hits")
+            return value
+        if self._uses_l2():
+            value = self._promote(key, self._l2_read(key))
+            if value is not None:
+                self._count("l2_hits")
+                return value
+        self._count("misses")
+        return None
+
+    async def get_async(self, question: str, source_ids: List[str] = None) -> Optional[Any]:
+        """get() with the L2 round trip off the event loop."""
+        if not Config.CACHE_ENABLED:
             return None
-            
-        entry = self._cache[key]
-        
-        # Check TTL
-        if time.time() > entry.expires_at:
-            del self._cache[key]
-            self.misses += 1
+
+        key = self._generate_key(question, source_ids or [])
+        value = self._get_entry(key)
+        if value is not None:
+            self._count("l1_hits")
+            return value
+        if self._uses_l2():
+            value = self._promote(key, await asyncio.to_thread(self._l2_read, key))
+            if value is not None:
+                self._count("l2_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def get_semantic(self, query_embedding: List[float], source_ids: List[str] = None) -> Optional[Any]:
+        """
+        Looks up an answer to a near-duplicate question: cosine similarity of the query
+        embedding to a cached question above SEMANTIC_CACHE_THRESHOLD, same filter and config.
+        """
+        if not (Config.CACHE_ENABLED and Config.SEMANTIC_CACHE_ENABLED):
             return None
-            
-        # Move to end (LRU)
-        self._cache.move_to_end(key)
-        self.hits += 1
-        return entry.value
 
-    def set(self, question: str, value: Any, source_ids: List[str] = None):
+        group = SemanticIndex.group_id(self._filter_signature(source_ids or []))
+        with self._lock:
+            key = self._semantic.search(group, query_embedding, Config.SEMANTIC_CACHE_THRESHOLD)
+            if key is None:
+                return None
+            value = self._get_entry(key)
+            if value is not None:
+                self.semantic_hits += 1
+                CHAT_CACHE_HITS.inc(tier="semantic")
+            return value
+
+    def _flight_key(self, question: str, source_ids: Optional[List[str]], deadline_ms: int) -> Optional[str]:
+        # A flight runs under the deadline of the request that started it: only equal deadlines share one
+        if not Config.CHAT_COALESCE_ENABLED:
+            return None
+        return f"{self._generate_key(question, source_ids or [])}|deadline={deadline_ms}"
+
+    def flight(self, question: str, source_ids: Optional[List[str]], compute: Callable[[Flight], Awaitable[Any]], deadline_ms: int = 0):
+        """
+        Async context manager yielding the Flight computing this question: a new one running
+        compute(flight), or the one already in flight for the same cache key and deadline.
+        """
+        return self._flights.join(self._flight_key(question, source_ids, deadline_ms), compute)
+
+    def snapshot(self) -> int:
+        """
+        Taken before computing an answer and passed to set(): an answer computed while a
+        source changed may mix old and new chunks, so it is not cached.
+        """
+        return self._event_seq
+
+    def _store_l1(self, question: str, value: Any, source_ids: List[str], query_embedding: Optional[List[float]],
+                  used_source_ids: Optional[List[str]], snapshot: Optional[int]) -> Optional[Tuple[str, CacheEntry]]:
         if not Config.CACHE_ENABLED:
-            return
+            return None
 
         key = self._generate_key(question, source_ids or [])
-        
-        # Evict if full
-        if len(self._cache) >= self.max_items:
-            # OrderedDict pops from 'last=False' for FIFO behaviour if we append to end?
-            # Creating LRU: move_to_end on access. So least recently used is at the beginning.
-            self._cache.popitem(last=False)
-            
-        expires_at = time.time() + self.ttl
-        self._cache[key] = CacheEntry(value, expires_at)
+        deps = set(used_source_ids or []) | set(source_ids or [])
+        with self._lock:
+            if snapshot is not None and snapshot != self._event_seq:
+                return None
+            entry = CacheEntry(value, time.time() + self.ttl, deps, not source_ids, self._event_seq)
+            self._put_entry_locked(key, entry, query_embedding, source_ids)
+        return key, entry
+
+    def set(self, question: str, value: Any, source_ids: List[str] = None, query_embedding: Optional[List[float]] = None,
+            used_source_ids: Optional[List[str]] = None, snapshot: Optional[int] = None):
+        stored = self._store_l1(question, value, source_ids, query_embedding, used_source_ids, snapshot)
+        if stored and self._uses_l2():
+            key, entry = stored
+            self._l2_write(key, self._encode(entry), self.ttl)
+
+    async def set_async(self, question: str, value: Any, source_ids: List[str] = None, query_embedding: Optional[List[float]] = None,
+                        used_source_ids: Optional[List[str]] = None, snapshot: Optional[int] = None):
+        """set() with the L2 write off the event loop."""
+        stored = self._store_l1(question, value, source_ids, query_embedding, used_source_ids, snapshot)
+        if stored and self._uses_l2():
+            key, entry = stored
+            await asyncio.to_thread(self._l2_write, key, self._encode(entry), self.ttl)
+
+    def _apply_event(self, source_id: str, seq: Optional[int]) -> int:
+        # Caller holds the lock
+        self._event_seq = seq if seq is not None else self._event_seq + 1
+        self._source_seq[source_id] = self._event_seq
+        for key in list(self._dependents.get(source_id, ())):
+            self._evict(key)
+            self.invalidations += 1
+            CHAT_CACHE_EVICTIONS.inc(reason="invalidated")
+        return self._event_seq
+
+    def on_source_deleted(self, source_id: str, seq: Optional[int] = None):
+        """Evicts entries whose answer used the source or whose filter contains it."""
+        with self._lock:
+            self._apply_event(source_id, seq)
+
+    def on_source_indexed(self, source_id: str, seq: Optional[int] = None):
+        """Evicts entries depending on the source and every "all sources" entry."""
+        with self._lock:
+            self._corpus_seq = self._apply_event(source_id, seq)
+            for key in list(self._unfiltered):
+                self._evict(key)
+                self.invalidations += 1
+                CHAT_CACHE_EVICTIONS.inc(reason="invalidated")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.l1_hits + self.l2_hits + self.misses
+            return {
+                "l1_hits": self.l1_hits,
+                "l2_hits": self.l2_hits,
+                "semantic_hits": self.semantic_hits,
+                "coalesced": self._flights.coalesced,
+                "misses": self.misses,
+                "hit_rate": (self.l1_hits + self.l2_hits) / lookups if lookups else 0.0,
+                "l1_items": len(self._cache),
+                "l2": self.store.name if self.store else "none",
+                "l2_errors": self.l2_errors,
+                "invalidations": self.invalidations
+            }
+
+# Global Instance
+chat_cache = ChatCache(build_chat_store(Config.CHAT_CACHE_L2_URL), ChatResponse, job_queue.event_log_id)
+
+class RerankCache:
+    """
+    LRU + TTL cache of reranker output: the ranked candidate indices for a normalized
+    question, an ordered candidate set ((source_id, chunk_index) pairs) and the ranking
+    function. Entries are dropped when any source in their candidate set changes.
+    """
+    def __init__(self, max_items: int, ttl: float):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._cache: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._dependents: Dict[str, set] = {}  # Source ID -> keys of entries ranking its chunks
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(question: str, candidate_ids: List[Tuple[str, int]], ranker_id: str, top_n: int) -> str:
+        norm_q = " ".join(question.lower().split())
+        ids = ";".join(f"{source_id}:{chunk_index}" for source_id, chunk_index in candidate_ids)
+        return hashlib.sha256(f"{norm_q}|{ranker_id}|{top_n}|{ids}".encode()).hexdigest()
+
+    def _evict(self, key: str):
+        # Caller holds the lock
+        entry = self._cache.pop(key, None)
+        if entry is None:
+            return
+        for source_id in entry.deps:
+            keys = self._dependents.get(source_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[source_id]
+
+    def get(self, question: str, candidate_ids: List[Tuple[str, int]], ranker_id: str, top_n: int) -> Optional[List[int]]:
+        if not Config.RERANK_CACHE_ENABLED:
+            return None
+        key = self._key(question, candidate_ids, ranker_id, top_n)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and time.time() > entry.expires_at:
+                self._evict(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def set(self, question: str, candidate_ids: List[Tuple[str, int]], ranker_id: str, top_n: int, ranked: List[int]):
+        if not Config.RERANK_CACHE_ENABLED:
+            return
+        key = self._key(question, candidate_ids, ranker_id, top_n)
+        entry = CacheEntry(list(ranked), time.time() + self.ttl, {source_id for source_id, _ in candidate_ids})
+        with self._lock:
+            self._evict(key)
+            while len(self._cache) >= self.max_items:
+                self._evict(next(iter(self._cache)))
+            self._cache[key] = entry
+            for source_id in entry.deps:
+                self._dependents.setdefault(source_id, set()).add(key)
+
+    def on_source_changed(self, source_id: str):
+        """Drops rankings that include chunks of a re-indexed or deleted source."""
+        with self._lock:
+            for key in list(self._dependents.get(source_id, ())):
+                self._evict(key)
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "items": len(self._cache),
+                "invalidations": self.invalidations
+            }
+
+# Global Instance
+rerank_cache = RerankCache(Config.RERANK_CACHE_MAX_ITEMS, Config.RERANK_CACHE_TTL_SECONDS)
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for embeddings keyed by (model, normalized text).
+    L1 is an in-memory LRU bounded in bytes; L2 is an optional SQLite file (EMBED_CACHE_DB_PATH)
+    that survives restarts and is shared by the API and the indexing workers.
+    Vectors are stored as packed float32 in both tiers, which is the precision the embeddings
+    API returns. Ingestion passes l1=False, so chunk vectors of a large document go to L2 only
+    and do not evict the query embeddings L1 exists for.
+    """
+    def __init__(self, max_bytes: int, db_path: Optional[str] = None, disk_max_items: int = 0):
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.disk_max_items = disk_max_items
+        self._lru: OrderedDict[str, bytes] = OrderedDict()
+        self._l1_bytes = 0
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        if db_path:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("create table if not exists embeddings (key text primary key, vector blob not null, created_at real not null)")
+                conn.execute("create index if not exists idx_embeddings_created_at on embeddings (created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Whitespace-normalized text; this is also what gets sent to the embeddings API."""
+        return " ".join(text.split())
+
+    @staticmethod
+    def _key(model: str, norm_text: str) -> str:
+        return hashlib.sha256(f"{model}\0{norm_text}".encode()).hexdigest()
+
+    def _l1_put(self, key: str, blob: bytes):
+        # Caller holds the lock
+        previous = self._lru.pop(key, None)
+        if previous is not None:
+            self._l1_bytes -= len(previous)
+        self._lru[key] = blob
+        self._l1_bytes += len(blob)
+        while self._l1_bytes > self.max_bytes and self._lru:
+            _, evicted = self._lru.popitem(last=False)
+            self._l1_bytes -= len(evicted)
+
+    def get_many(self, model: str, norm_texts: List[str], l1: bool = True) -> List[Optional[List[float]]]:
+        """Returns cached vectors in input order, None for misses. With l1=False, L2 hits are not copied to L1."""
+        if not Config.EMBED_CACHE_ENABLED:
+            return [None] * len(norm_texts)
+
+        keys = [self._key(model, t) for t in norm_texts]
+        blobs: List[Optional[bytes]] = [None] * len(keys)
+        l2_needed = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                blob = self._lru.get(key)
+                if blob is not None:
+                    self._lru.move_to_end(key)
+                    self.l1_hits += 1
+                    blobs[i] = blob
+                else:
+                    l2_needed.append(i)
+
+        if l2_needed and self.db_path:
+            wanted = list({keys[i] for i in l2_needed})
+            found = {}
+            with self._connect() as conn:
+                for j in range(0, len(wanted), 500):
+                    batch = wanted[j:j+500]
+                    placeholders = ",".join("?" * len(batch))
+                    for key, blob in conn.execute(f"select key, vector from embeddings where key in ({placeholders})", batch):
+                        found[key] = blob
+            with self._lock:
+                for i in l2_needed:
+                    blob = found.get(keys[i])
+                    if blob is not None:
+                        blobs[i] = blob
+                        if l1:
+                            self._l1_put(keys[i], blob)
+                        self.l2_hits += 1
+
+        with self._lock:
+            self.misses += sum(1 for b in blobs if b is None)
+        return [array("f", blob).tolist() if blob is not None else None for blob in blobs]
+
+    def set_many(self, model: str, norm_texts: List[str], vectors: List[List[float]], l1: bool = True):
+        """Stores vectors in L2 and, unless l1=False (ingestion), in L1."""
+        if not Config.EMBED_CACHE_ENABLED or not norm_texts:
+            return
+
+        keys = [self._key(model, t) for t in norm_texts]
+        blobs = [array("f", vector).tobytes() for vector in vectors]
+        if l1:
+            with self._lock:
+                for key, blob in zip(keys, blobs):
+                    self._l1_put(key, blob)
+
+        if self.db_path:
+            now = time.time()
+            rows = [(key, blob, now) for key, blob in zip(keys, blobs)]
+            with self._connect() as conn:
+                conn.executemany("insert or replace into embeddings (key, vector, created_at) values (?, ?, ?)", rows)
+                self._writes_since_prune += len(rows)
+                # Keep the disk tier bounded, checking only every few hundred writes
+                if self.disk_max_items and self._writes_since_prune >= 500:
+                    self._writes_since_prune = 0
+                    conn.execute(
+                        "delete from embeddings where key in (select key from embeddings order by created_at desc limit -1 offset ?)",
+                        (self.disk_max_items,)
+                    )
+
+    def get(self, model: str, norm_text: str) -> Optional[List[float]]:
+        return self.get_many(model, [norm_text])[0]
+
+    def set(self, model: str, norm_text: str, vector: List[float]):
+        self.set_many(model, [norm_text], [vector])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.l1_hits + self.l2_hits + self.misses
+        return {
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "hit_rate": (self.l1_hits + self.l2_hits) / lookups if lookups else 0.0,
+            "l1_items": len(self._lru),
+            "l1_bytes": self._l1_bytes
+        }
 
 # Global Instance
-chat_cache = ChatCache()
+embedding_cache = EmbeddingCache(
+    max_bytes=Config.EMBED_CACHE_MAX_BYTES,
+    db_path=Config.EMBED_CACHE_DB_PATH or None,
+    disk_max_items=Config.EMBED_CACHE_DISK_MAX_ITEMS
+)
@@ -0,0 +1,108 @@
+from typing import Dict, List, Optional, Tuple
+from backend.services.llm import estimate_tokens
+
+OVERLAP_PROBE = 64  # Characters of a chunk's head searched for in its predecessor's tail
+
+class ContextSpan:
+    """Consecutive chunks of one source merged into a single passage."""
+    def __init__(self, source_id: str, chunk_index: int, text: str, rank: int):
+        self.source_id = source_id
+        self.start_index = chunk_index
+        self.end_index = chunk_index
+        self.text = text
+        self.rank = rank  # Best (lowest) rank of the merged chunks
+        self._last_chunk = text
+
+    def extend(self, chunk_index: int, text: str, rank: int):
+        overlap = _overlap(self._last_chunk, text)
+        if overlap:
+            self.text += text[overlap:]
+        else:
+            self.text += "\n" + text
+        self.end_index = chunk_index
+        self.rank = min(self.rank, rank)
+        self._last_chunk = text
+
+class PackedContext:
+    """Prompt passages in rank order and the candidates whose text they contain."""
+    def __init__(self, texts: List[str], candidates: List[Dict], tokens: int, input_tokens: int, duplicates: int, truncated: bool):
+        self.texts = texts
+        self.candidates = candidates
+        self.tokens = tokens
+        self.input_tokens = input_tokens  # Estimate for sending every candidate verbatim
+        self.duplicates = duplicates
+        self.truncated = truncated
+
+def _overlap(previous: str, text: str) -> int:
+    """Length of the longest prefix of text that is a suffix of previous (all of text if contained)."""
+    if not text or text in previous:
+        return len(text)
+    probe = text[:OVERLAP_PROBE]
+    pos = previous.find(probe, max(0, len(previous) - len(text)))
+    while pos != -1:
+        # Earliest match is the longest overlap
+        if text.startswith(previous[pos:]):
+            return len(previous) - pos
+        pos = previous.find(probe, pos + 1)
+    return 0
+
+def _build_spans(selected: List[Tuple[int, Dict]]) -> List[ContextSpan]:
+    by_source: Dict[str, List[Tuple[int, Dict]]] = {}
+    for rank, candidate in selected:
+        by_source.setdefault(str(candidate.get("source_id")), []).append((rank, candidate))
+
+    spans = []
+    for source_id, items in by_source.items():
+        span: Optional[ContextSpan] = None
+        for rank, candidate in sorted(items, key=lambda item: item[1].get("chunk_index", 0)):
+            chunk_index = candidate.get("chunk_index", 0)
+            if span is not None and chunk_index == span.end_index + 1:
+                span.extend(chunk_index, candidate["content"], rank)
+            else:
+                span = ContextSpan(source_id, chunk_index, candidate["content"], rank)
+                spans.append(span)
+    return sorted(spans, key=lambda s: s.rank)
+
+def pack_context(candidates: List[Dict], max_tokens: int) -> PackedContext:
+    """
+    Assembles the generation context from reranked candidates (best first):
+    - drops chunks whose text repeats an earlier one (e.g. identical chunks of two sources),
+    - merges adjacent chunks of one source into one span, removing their chunking overlap,
+    - adds candidates by rank while the estimated size fits max_tokens (0 = no limit);
+      a first candidate larger than the budget is truncated rather than dropped.
+    Spans are ordered by their best-ranked chunk.
+    """
+    selected: List[Tuple[int, Dict]] = []
+    seen = set()
+    duplicates = 0
+    spans: List[ContextSpan] = []
+    for rank, candidate in enumerate(candidates):
+        text = candidate.get("content") or ""
+        normalized = " ".join(text.split())
+        if not normalized:
+            continue
+        if normalized in seen:
+            duplicates += 1
+            continue
+        trial = selected + [(rank, candidate)]
+        trial_spans = _build_spans(trial)
+        if max_tokens and selected and sum(estimate_tokens(s.text) for s in trial_spans) > max_tokens:
+            continue
+        selected, spans = trial, trial_spans
+        seen.add(normalized)
+
+    texts = [s.text for s in spans]
+    truncated = False
+    if max_tokens and texts and sum(estimate_tokens(t) for t in texts) > max_tokens:
+        # Only possible when the first candidate alone exceeds the budget
+        texts = [texts[0][:max_tokens * 4]]
+        truncated = True
+
+    return PackedContext(
+        texts=texts,
+        candidates=[candidate for _, candidate in sorted(selected, key=lambda item: item[0])],
+        tokens=sum(estimate_tokens(t) for t in texts),
+        input_tokens=sum(estimate_tokens(c.get("content") or "") for c in candidates),
+        duplicates=duplicates,
+        truncated=truncated
+    )
@@ -0,0 +1,43 @@
+import codecs
+from typing import Iterator
+from pypdf import PdfReader
+
+# This module only depends on pypdf so it stays cheap to import in worker processes.
+
+READ_BLOCK_SIZE = 1024 * 1024  # Bytes read at a time from spooled uploads
+
+def is_pdf(filename: str) -> bool:
+    return filename.lower().endswith(".pdf")
+
+def count_pages(file_path: str) -> int:
+    """Returns the number of pages of a PDF file."""
+    with open(file_path, "rb") as f:
+        return len(PdfReader(f).pages)
+
+def extract_page_range(file_path: str, start: int, end: int) -> str:
+    """Extracts text of PDF pages [start, end). Runs inside a worker process."""
+    with open(file_path, "rb") as f:
+        reader = PdfReader(f)
+        return "".join(reader.pages[i].extract_text() + "\n" for i in range(start, end))
+
+def iter_pages(file_path: str, filename: str) -> Iterator[str]:
+    """Lazily yields text from a spooled TXT or PDF file, one page (or block) at a time."""
+    if is_pdf(filename):
+        with open(file_path, "rb") as f:
+            reader = PdfReader(f)
+            for page in reader.pages:
+                yield page.extract_text() + "\n"
+    else:
+        # Assume text-based, decode incrementally so multi-byte characters can span blocks
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        with open(file_path, "rb") as f:
+            while True:
+                block = f.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                text = decoder.decode(block)
+                if text:
+                    yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
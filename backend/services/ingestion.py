@@ -1,71 +1,261 @@
-import io
+import os
+import time
+import threading
+import multiprocessing
 import uuid
-from typing import List
-from pypdf import PdfReader
-from backend.services.llm import get_embedding
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from typing import Dict, List, Iterable, Iterator, Optional, Tuple
+from backend.config import Config
+from backend.services.extraction import is_pdf, count_pages, extract_page_range, iter_pages
+from backend.services.llm import get_embeddings, embedding_stats, EMBEDDING_CACHE_KEY
 from backend.services.storage import get_supabase_client
+from backend.services.retrieval import get_retrieval_backend
+from backend.services.jobs import CANCEL_DELETED, Job, LeaseLostError, job_queue
+from backend.services.logs import get_logger
+from backend.services.metrics import INGEST_CHUNKS, INGEST_SECONDS
+
+log = get_logger("ingestion")
 
 CHUNK_SIZE = 1000  # Characters
 OVERLAP = 200
 
-def extract_text(file_content: bytes, filename: str) -> str:
-    """Extracts text from TXT or PDF files."""
-    if filename.lower().endswith(".pdf"):
-        reader = PdfReader(io.BytesIO(file_content))
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    else:
-        # Assume text-based
-        return file_content.decode("utf-8")
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Returns the shared extraction process pool, or None when INGEST_PROCESS_WORKERS is 0."""
+    global _process_pool
+    if Config.INGEST_PROCESS_WORKERS <= 0:
+        return None
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: the API process is multi-threaded, forking it is unsafe
+            _process_pool = ProcessPoolExecutor(
+                max_workers=Config.INGEST_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+def shutdown_process_pool():
+    """Stops the extraction processes (API shutdown, worker stop); the next get_process_pool() starts a new pool."""
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def iter_text(file_path: str, filename: str) -> Iterator[str]:
+    """
+    Yields document text in order. PDF pages are extracted in the process pool,
+    split into ranges of INGEST_PAGES_PER_TASK pages so large PDFs use several workers.
+    The number of ranges in flight is bounded to keep memory flat.
+    """
+    pool = get_process_pool()
+    if pool is None or not is_pdf(filename):
+        yield from iter_pages(file_path, filename)
+        return
+
+    page_count = count_pages(file_path)
+    per_task = max(1, Config.INGEST_PAGES_PER_TASK)
+    max_in_flight = max(1, Config.INGEST_PROCESS_WORKERS) * 2
+
+    pending = deque()
+    try:
+        for start in range(0, page_count, per_task):
+            pending.append(pool.submit(extract_page_range, file_path, start, min(start + per_task, page_count)))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def iter_chunks(texts: Iterable[str], chunk_size: int = CHUNK_SIZE, overlap: int = OVERLAP) -> Iterator[str]:
+    """
+    Splits a stream of text into overlapping chunks as the text arrives.
+    Produces exactly the same chunks as chunk_text on the concatenated stream.
+    """
+    step = chunk_size - overlap
+    buffer = ""
+    start = 0  # Offset of the next chunk; the consumed prefix is dropped once per incoming block
+    for text in texts:
+        buffer = buffer[start:] + text
+        start = 0
+        while len(buffer) - start >= chunk_size:
+            yield buffer[start:start + chunk_size]
+            start += step
+    while start < len(buffer):
+        yield buffer[start:start + chunk_size]
+        start += step
 
 def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = OVERLAP) -> List[str]:
     """Splits text into overlapping chunks."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += (chunk_size - overlap)
-    return chunks
-
-async def process_document(source_id: str, file_content: bytes, filename: str):
-    """Background task to process document: extract -> chunk -> embed -> store."""
+    return list(iter_chunks([text], chunk_size, overlap))
+
+def iter_windows(chunks: Iterable[str], window_size: int) -> Iterator[List[str]]:
+    """Groups a chunk stream into lists of at most window_size chunks."""
+    window = []
+    for chunk in chunks:
+        window.append(chunk)
+        if len(window) >= window_size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+def hash_text(text: str) -> str:
+    # Keyed by embedding model and dimensions: vectors of another model are never reused
+    return hashlib.sha256(f"{EMBEDDING_CACHE_KEY}\0{text}".encode("utf-8")).hexdigest()
+
+def _lookup_embeddings(hashes: List[str]) -> Dict[str, List[float]]:
+    """Finds stored embeddings for chunk content hashes (across all sources)."""
+    return get_retrieval_backend().lookup_embeddings(hashes)
+
+def embed_window(chunks: List[str]) -> Tuple[List[str], List[List[float]], int]:
+    """
+    Embeds a window of chunks, reusing stored vectors for chunks whose text is already indexed.
+    Returns (content hashes, embeddings, number of reused vectors).
+    """
+    hashes = [hash_text(chunk) for chunk in chunks]
+    known = _lookup_embeddings(hashes)
+
+    # First position of every hash that has no stored vector (identical chunks are embedded once)
+    missing = {}
+    for i, h in enumerate(hashes):
+        if h not in known and h not in missing:
+            missing[h] = i
+    # Bulk traffic: queued behind interactive /chat calls for the OpenAI rate limit
+    fresh = get_embeddings([chunks[i] for i in missing.values()], priority="ingest")
+    known.update(zip(missing.keys(), fresh))
+
+    embeddings = [known[h] for h in hashes]
+    return hashes, embeddings, len(chunks) - len(missing)
+
+def _record_stage(stage: str, chunks: int, seconds: float):
+    INGEST_CHUNKS.inc(chunks, stage=stage)
+    INGEST_SECONDS.inc(seconds, stage=stage)
+
+def _insert_window(job: Job, source_id: str, filename: str, start_index: int, chunks: List[str], hashes: List[str], embeddings: List[List[float]]):
+    """
+    Upserts one embedded window of chunks, keyed by (source_id, chunk_index), fenced by the job's
+    lease: deleting the source cancels the job (JobQueue.cancel_source) before deleting its chunks,
+    so a window stored after that delete is found by the check that follows it and removed again.
+    A replaced source keeps its chunks: the replacement job only starts once this one stopped
+    (JobQueue.claim) and overwrites them.
+    """
+    if not job_queue.heartbeat(job):
+        raise LeaseLostError(f"Job {job.id} is no longer leased to {job.worker}")
+    t0 = time.perf_counter()
+    records = [
+        {
+            "source_id": source_id,
+            "chunk_index": start_index + i,
+            "content": chunk,
+            "content_hash": content_hash,
+            "embedding": embedding
+        }
+        for i, (chunk, content_hash, embedding) in enumerate(zip(chunks, hashes, embeddings))
+    ]
+    get_retrieval_backend().upsert_chunks(records, filename)
+    _record_stage("store", len(records), time.perf_counter() - t0)
+    if not job_queue.heartbeat(job):
+        if job_queue.cancel_reason(job) == CANCEL_DELETED:
+            get_retrieval_backend().delete_source(source_id)
+            log.info("ingest.cancelled", source_id=source_id, job_id=job.id)
+        raise LeaseLostError(f"Job {job.id} is no longer leased to {job.worker}")
+
+def process_document(job: Job):
+    """
+    Job handler for "index_document" jobs: extract -> chunk -> embed -> store (in the
+    RETRIEVAL_BACKEND; source status updates go to the sources table).
+    Runs as a pipeline over windows of INGEST_WINDOW_CHUNKS chunks: while one window is
+    being inserted the next one is embedded, so peak memory is bounded by the window size
+    and not by the document size. Errors are re-raised so the queue can retry the job;
+    the spooled file is removed after success or the last attempt.
+    """
+    source_id = job.payload["source_id"]
+    file_path = job.payload["file_path"]
+    filename = job.payload["filename"]
     supabase = get_supabase_client()
-    
+
     try:
         # Update status to indexing
-        supabase.table("sources").update({"status": "indexing"}).eq("id", source_id).execute()
-        
-        # 1. Extract
-        text = extract_text(file_content, filename)
-        
-        # 2. Chunk
-        text_chunks = chunk_text(text)
-        
-        # 3. Embed & Store
-        # We can batch this if needed, but for simplicity loop or small batches
-        records = []
-        for i, chunk in enumerate(text_chunks):
-            embedding = get_embedding(chunk)
-            records.append({
-                "source_id": source_id,
-                "chunk_index": i,
-                "content": chunk,
-                "embedding": embedding
-            })
-            
-        # Bulk insert chunks
-        # Supabase/Postgres limits might apply to payload size, doing in batches of 50 is safer ideally
-        batch_size = 50
-        for i in range(0, len(records), batch_size):
-            supabase.table("chunks").insert(records[i:i+batch_size]).execute()
-            
+        supabase.table("sources").update({"status": "indexing", "error": None}).eq("id", source_id).execute()
+        job_queue.publish_source_event(source_id, "indexing")
+
+        # 1. Extract & 2. Chunk (lazily)
+        chunks = iter_chunks(iter_text(file_path, filename))
+
+        # 3. Embed & Store, pipelined per window
+        t_start = time.perf_counter()
+        indexed = 0
+        reused = 0
+        pending_insert: Optional[Future] = None
+        windows = iter_windows(chunks, max(1, Config.INGEST_WINDOW_CHUNKS))
+        with ThreadPoolExecutor(max_workers=1) as insert_executor:
+            while True:
+                # Extraction and chunking run lazily, as the next window is pulled
+                t_stage = time.perf_counter()
+                window = next(windows, None)
+                if window is None:
+                    break
+                _record_stage("extract", len(window), time.perf_counter() - t_stage)
+
+                t_stage = time.perf_counter()
+                hashes, embeddings, window_reused = embed_window(window)
+                _record_stage("embed", len(window), time.perf_counter() - t_stage)
+                reused += window_reused
+
+                # At most one window is in flight to the database
+                if pending_insert is not None:
+                    pending_insert.result()
+                    progress = f"indexing ({indexed} chunks)"
+                    supabase.table("sources").update({"status": progress}).eq("id", source_id).execute()
+                    job_queue.update_progress(job, progress)
+                pending_insert = insert_executor.submit(_insert_window, job, source_id, filename, indexed, window, hashes, embeddings)
+                indexed += len(window)
+
+            if pending_insert is not None:
+                pending_insert.result()
+
+        # Drop chunks beyond the new end (document got shorter, or leftovers of an earlier attempt)
+        if not job_queue.heartbeat(job):
+            raise LeaseLostError(f"Job {job.id} is no longer leased to {job.worker}")
+        get_retrieval_backend().delete_chunks(source_id, indexed)
+
+        t_total = time.perf_counter() - t_start
+        if indexed:
+            log.info("ingest.embedded", filename=filename, chunks=indexed, seconds=round(t_total, 2),
+                     chunks_per_sec=round(indexed / max(t_total, 1e-9), 1), lifetime_chunks_per_sec=round(embedding_stats.chunks_per_sec, 1), reused=reused)
+
         # Update status to indexed
         supabase.table("sources").update({"status": "indexed"}).eq("id", source_id).execute()
-        print(f"Successfully indexed {filename} ({source_id})")
+        job_queue.update_progress(job, f"indexed ({indexed} chunks)")
+        job_queue.publish_source_event(source_id, "indexed")
+        log.info("ingest.indexed", filename=filename, source_id=source_id)
+        _remove_spool(file_path)
 
+    except LeaseLostError:
+        # Another worker runs this job now and owns the source status and the spooled file,
+        # or the source was deleted and the spooled file is ours to remove
+        if job_queue.is_cancelled(job):
+            _remove_spool(file_path)
+        raise
     except Exception as e:
-        print(f"Error indexing {filename}: {e}")
-        supabase.table("sources").update({"status": "failed", "error": str(e)}).eq("id", source_id).execute()
+        log.error("ingest.failed", filename=filename, source_id=source_id, attempt=job.attempts, max_attempts=job.max_attempts, error=str(e))
+        if job.is_last_attempt:
+            supabase.table("sources").update({"status": "failed", "error": str(e)}).eq("id", source_id).execute()
+            _remove_spool(file_path)
+            job_queue.publish_source_event(source_id, "failed")
+        else:
+            supabase.table("sources").update({"status": f"retrying ({job.attempts}/{job.max_attempts})", "error": str(e)}).eq("id", source_id).execute()
+        raise
+
+def _remove_spool(file_path: str):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
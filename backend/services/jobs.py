@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from backend.config import Config
+
+SOURCE_EVENT_RETENTION_SECONDS = 24 * 3600
+# Matches a job only while the claim that produced it still holds the lease (id, worker, attempts)
+OWNED_JOB = "id = ? and status = 'running' and worker = ? and attempts = ?"
+# Cancellation reasons, stored in the job's error
+CANCEL_DELETED = "source deleted"
+CANCEL_REPLACED = "source replaced"
+
+class QueueFullError(Exception):
+    """Raised when the admission limit of pending jobs is reached."""
+
+class LeaseLostError(Exception):
+    """Raised when a worker updates a job whose lease expired and was taken over by another worker."""
+
+class Job:
+    def __init__(self, row: sqlite3.Row):
+        self.id = row["id"]
+        self.kind = row["kind"]
+        self.payload: Dict[str, Any] = json.loads(row["payload"])
+        self.status = row["status"]
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+        self.progress = row["progress"]
+        self.error = row["error"]
+        self.worker = row["worker"]
+        self.created_at = row["created_at"]
+        self.updated_at = row["updated_at"]
+
+    @property
+    def is_last_attempt(self) -> bool:
+        return self.attempts >= self.max_attempts
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "progress": self.progress,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+class JobQueue:
+    """
+    Durable job queue stored in a local SQLite database.
+    Jobs survive restarts; a claimed job holds a lease that the worker extends with heartbeats
+    and progress updates, so jobs of a crashed worker are picked up again once the lease expires.
+    Updates only apply while the caller still owns the lease (same worker and attempt), so a
+    worker that lost its job cannot overwrite the state of the one that took it over.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                create table if not exists jobs (
+                    id integer primary key autoincrement,
+                    kind text not null,
+                    payload text not null,
+                    status text not null default 'queued', -- queued, running, done, failed, cancelled
+                    attempts integer not null default 0,
+                    max_attempts integer not null,
+                    progress text,
+                    error text,
+                    worker text,
+                    run_after real not null,
+                    locked_until real,
+                    created_at real not null,
+                    updated_at real not null
+                )
+            """)
+            conn.execute("create index if not exists idx_jobs_status_run_after on jobs (status, run_after)")
+            # Source change log read by every API process to invalidate its chat cache
+            conn.execute("""
+                create table if not exists source_events (
+                    seq integer primary key autoincrement,
+                    source_id text not null,
+                    kind text not null, -- indexing, indexed, failed, deleted
+                    created_at real not null
+                )
+            """)
+            conn.execute("create index if not exists idx_source_events_source on source_events (source_id, seq)")
+            # Identity of this event log: seq numbers are only comparable within one log (one host)
+            conn.execute("create table if not exists meta (key text primary key, value text not null)")
+            conn.execute("insert or ignore into meta (key, value) values ('event_log_id', ?)", (uuid.uuid4().hex,))
+            self.event_log_id = conn.execute("select value from meta where key = 'event_log_id'").fetchone()[0]
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation keeps the queue safe across threads and processes
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def pending_count(self) -> int:
+        with self._connect() as conn:
+            row = conn.execute("select count(*) from jobs where status in ('queued', 'running')").fetchone()
+            return row[0]
+
+    def _insert(self, conn: sqlite3.Connection, kind: str, payload: Dict[str, Any], max_attempts: Optional[int], now: float) -> int:
+        pending = conn.execute("select count(*) from jobs where status in ('queued', 'running')").fetchone()[0]
+        if pending >= Config.JOB_MAX_PENDING:
+            raise QueueFullError(f"Job queue is full ({pending} pending jobs)")
+        cursor = conn.execute(
+            "insert into jobs (kind, payload, max_attempts, run_after, created_at, updated_at) values (?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), max_attempts or Config.JOB_MAX_ATTEMPTS, now, now, now)
+        )
+        return cursor.lastrowid
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], max_attempts: Optional[int] = None) -> int:
+        """Adds a job, enforcing the JOB_MAX_PENDING admission limit. Returns the job id."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("begin immediate")
+            try:
+                job_id = self._insert(conn, kind, payload, max_attempts, now)
+                conn.execute("commit")
+                return job_id
+            except Exception:
+                conn.execute("rollback")
+                raise
+
+    def enqueue_replacing(self, kind: str, payload: Dict[str, Any], max_attempts: Optional[int] = None) -> Tuple[int, List[Job]]:
+        """
+        Cancels the queued and running jobs of payload["source_id"] and adds the new job in one
+        transaction, so a rejected enqueue (QueueFullError) leaves the earlier jobs running.
+        Returns the new job id and the cancelled jobs as they were.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("begin immediate")
+            try:
+                rows = self._cancel_source_jobs(conn, payload["source_id"], CANCEL_REPLACED, now)
+                job_id = self._insert(conn, kind, payload, max_attempts, now)
+                conn.execute("commit")
+                return job_id, [Job(row) for row in rows]
+            except Exception:
+                conn.execute("rollback")
+                raise
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """
+        Atomically takes the oldest runnable job (or one whose lease expired) and leases it to worker.
+        Jobs of a source whose cancelled job may still be writing (lease not yet released or expired)
+        wait, so a replacement never stores chunks side by side with the job it replaced.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("begin immediate")
+            try:
+                row = conn.execute("""
+                    select id from jobs j
+                    where ((status = 'queued' and run_after <= ?)
+                        or (status = 'running' and locked_until < ?))
+                      and not exists (
+                        select 1 from jobs c
+                        where c.status = 'cancelled' and c.locked_until >= ?
+                          and json_extract(c.payload, '$.source_id') = json_extract(j.payload, '$.source_id')
+                      )
+                    order by run_after, id
+                    limit 1
+                """, (now, now, now)).fetchone()
+                if row is None:
+                    conn.execute("commit")
+                    return None
+                conn.execute("""
+                    update jobs
+                    set status = 'running', attempts = attempts + 1, worker = ?, locked_until = ?, updated_at = ?
+                    where id = ?
+                """, (worker, now + Config.JOB_LEASE_SECONDS, now, row["id"]))
+                job_row = conn.execute("select * from jobs where id = ?", (row["id"],)).fetchone()
+                conn.execute("commit")
+                return Job(job_row)
+            except Exception:
+                conn.execute("rollback")
+                raise
+
+    def heartbeat(self, job: Job) -> bool:
+        """Extends the lease of a running job. Returns False when the lease was lost."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"update jobs set locked_until = ? where {OWNED_JOB}",
+                (now + Config.JOB_LEASE_SECONDS, job.id, job.worker, job.attempts)
+            )
+            return cursor.rowcount == 1
+
+    def update_progress(self, job: Job, progress: str):
+        """Records progress and extends the lease of a running job; raises LeaseLostError if it is no longer ours."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"update jobs set progress = ?, locked_until = ?, updated_at = ? where {OWNED_JOB}",
+                (progress, now + Config.JOB_LEASE_SECONDS, now, job.id, job.worker, job.attempts)
+            )
+        if cursor.rowcount != 1:
+            raise LeaseLostError(f"Job {job.id} is no longer leased to {job.worker}")
+
+    def complete(self, job: Job) -> bool:
+        """Marks the job done. Returns False (and changes nothing) when the lease was lost."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"update jobs set status = 'done', error = null, locked_until = null, updated_at = ? where {OWNED_JOB}",
+                (now, job.id, job.worker, job.attempts)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job: Job, error: str) -> bool:
+        """
+        Schedules a retry with exponential backoff, or marks the job failed after its last attempt.
+        Returns False (and changes nothing) when the lease was lost.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            if job.is_last_attempt:
+                cursor = conn.execute(
+                    f"update jobs set status = 'failed', error = ?, locked_until = null, updated_at = ? where {OWNED_JOB}",
+                    (error, now, job.id, job.worker, job.attempts)
+                )
+            else:
+                delay = Config.JOB_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1))
+                cursor = conn.execute(
+                    f"update jobs set status = 'queued', error = ?, run_after = ?, locked_until = null, updated_at = ? where {OWNED_JOB}",
+                    (error, now + delay, now, job.id, job.worker, job.attempts)
+                )
+            return cursor.rowcount == 1
+
+    def _cancel_source_jobs(self, conn: sqlite3.Connection, source_id: str, reason: str, now: float) -> List[sqlite3.Row]:
+        # A running job keeps locked_until until its worker releases it (release_cancelled), see claim
+        rows = conn.execute(
+            "select * from jobs where status in ('queued', 'running') and json_extract(payload, '$.source_id') = ?",
+            (str(source_id),)
+        ).fetchall()
+        conn.executemany(
+            "update jobs set status = 'cancelled', error = ?, updated_at = ? where id = ?",
+            [(reason, now, row["id"]) for row in rows]
+        )
+        return rows
+
+    def cancel_source(self, source_id: str, reason: str = CANCEL_DELETED) -> List[Job]:
+        """
+        Cancels the queued and running indexing jobs of a source. A running job loses its lease,
+        so its worker stops at the next heartbeat or store. Returns the jobs as they were.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("begin immediate")
+            try:
+                rows = self._cancel_source_jobs(conn, source_id, reason, now)
+                conn.execute("commit")
+                return [Job(row) for row in rows]
+            except Exception:
+                conn.execute("rollback")
+                raise
+
+    def release_cancelled(self, job: Job):
+        """Called by the worker once the handler of a job returned: a cancelled job no longer holds back its source."""
+        with self._connect() as conn:
+            conn.execute(
+                "update jobs set locked_until = null where id = ? and status = 'cancelled' and worker = ? and attempts = ?",
+                (job.id, job.worker, job.attempts)
+            )
+
+    def cancel_reason(self, job: Job) -> Optional[str]:
+        """Why the job was cancelled (CANCEL_DELETED or CANCEL_REPLACED), None while it is not."""
+        with self._connect() as conn:
+            row = conn.execute("select status, error from jobs where id = ?", (job.id,)).fetchone()
+            return row["error"] if row is not None and row["status"] == "cancelled" else None
+
+    def is_cancelled(self, job: Job) -> bool:
+        return self.cancel_reason(job) is not None
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._connect() as conn:
+            row = conn.execute("select * from jobs where id = ?", (job_id,)).fetchone()
+            return Job(row) if row else None
+
+    def publish_source_event(self, source_id: str, kind: str):
+        """
+        Appends a source change. Events are pruned after SOURCE_EVENT_RETENTION_SECONDS, except the
+        last one of each source, which is kept as long as a cached answer may predate it
+        (CACHE_TTL_SECONDS): a process replaying the log later still rejects those answers.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("insert into source_events (source_id, kind, created_at) values (?, ?, ?)", (str(source_id), kind, now))
+            conn.execute("""
+                delete from source_events
+                where created_at < ?
+                  and (created_at < ? or seq not in (select max(seq) from source_events group by source_id))
+            """, (now - SOURCE_EVENT_RETENTION_SECONDS, now - max(SOURCE_EVENT_RETENTION_SECONDS, Config.CACHE_TTL_SECONDS)))
+
+    def source_events_since(self, seq: int) -> List[Tuple[int, str, str]]:
+        """Returns (seq, source_id, kind) of events after seq, oldest first."""
+        with self._connect() as conn:
+            rows = conn.execute("select seq, source_id, kind from source_events where seq > ? order by seq", (seq,)).fetchall()
+            return [(row["seq"], row["source_id"], row["kind"]) for row in rows]
+
+# Global Instance
+job_queue = JobQueue(Config.JOB_DB_PATH)
@@ -1,26 +1,250 @@
 import os
-from typing import List, Dict, Any
-from openai import OpenAI
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, AsyncIterator
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
 from dotenv import load_dotenv
+from backend.config import Config
+from backend.services.cache import embedding_cache
+from backend.services.logs import get_logger
+from backend.services.metrics import OPENAI_TOKENS
+from backend.services.ratelimit import rate_limiter, request_priority
+
+log = get_logger("llm")
 
 load_dotenv()
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Retries are left to the rate-limit scheduler, which requeues calls by priority
+client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+
+# Shared async client for the request path: one pooled keep-alive connection set per process
+async_client = AsyncOpenAI(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=Config.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.OPENAI_MAX_KEEPALIVE_CONNECTIONS
+        )
+    )
+)
 
 EMBEDDING_MODEL = os.environ.get("EMBEDDINGS_MODEL", "text-embedding-3-small")
+# Shortened embeddings are other vectors: they get their own embedding cache entries
+EMBEDDING_CACHE_KEY = f"{EMBEDDING_MODEL}@{Config.EMBEDDING_DIMENSIONS}" if Config.EMBEDDING_DIMENSIONS else EMBEDDING_MODEL
 LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-5")
 
+def _embedding_args() -> Dict[str, Any]:
+    """Model (and dimensions, with EMBEDDING_DIMENSIONS) of every embeddings request."""
+    if Config.EMBEDDING_DIMENSIONS:
+        return {"model": EMBEDDING_MODEL, "dimensions": Config.EMBEDDING_DIMENSIONS}
+    return {"model": EMBEDDING_MODEL}
+
+def record_usage(model: str, operation: str, usage: Any):
+    """Counts the tokens an API response reports (usage may be missing, e.g. from proxies)."""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    if prompt_tokens:
+        OPENAI_TOKENS.inc(prompt_tokens, model=model, operation=operation, kind="prompt")
+    if completion_tokens:
+        OPENAI_TOKENS.inc(completion_tokens, model=model, operation=operation, kind="completion")
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return max(1, len(text) // 4)
+
+def estimate_completion_tokens(messages: List[Dict[str, str]]) -> int:
+    """Tokens a chat completion is admitted with: its prompt plus the expected completion."""
+    return sum(estimate_tokens(m["content"]) for m in messages) + Config.OPENAI_COMPLETION_TOKENS_ESTIMATE
+
 def get_embedding(text: str) -> List[float]:
-    """Generates embedding for a single string."""
-    text = text.replace("\n", " ")
-    return client.embeddings.create(input=[text], model=EMBEDDING_MODEL).data[0].embedding
+    """Generates embedding for a single string, served from the embedding cache when possible."""
+    text = embedding_cache.normalize(text)
+    cached = embedding_cache.get(EMBEDDING_CACHE_KEY, text)
+    if cached is not None:
+        return cached
+    response = rate_limiter.call(
+        EMBEDDING_MODEL, request_priority.get(), estimate_tokens(text),
+        lambda: client.embeddings.with_raw_response.create(input=[text], **_embedding_args())
+    )
+    record_usage(EMBEDDING_MODEL, "embed_query", response.usage)
+    embedding = response.data[0].embedding
+    embedding_cache.set(EMBEDDING_CACHE_KEY, text, embedding)
+    return embedding
 
-def generate_answer(question: str, context_chunks: List[str]) -> str:
-    """Generates an answer using LLM based on context."""
-    
+async def get_embedding_async(text: str) -> List[float]:
+    """Async variant of get_embedding, never blocks the event loop."""
+    text = embedding_cache.normalize(text)
+    # The disk tier does SQLite I/O, keep it off the loop
+    if embedding_cache.db_path:
+        cached = await asyncio.to_thread(embedding_cache.get, EMBEDDING_CACHE_KEY, text)
+    else:
+        cached = embedding_cache.get(EMBEDDING_CACHE_KEY, text)
+    if cached is not None:
+        return cached
+    response = await rate_limiter.call_async(
+        EMBEDDING_MODEL, request_priority.get(), estimate_tokens(text),
+        lambda: async_client.embeddings.with_raw_response.create(input=[text], **_embedding_args())
+    )
+    record_usage(EMBEDDING_MODEL, "embed_query", response.usage)
+    embedding = response.data[0].embedding
+    if embedding_cache.db_path:
+        await asyncio.to_thread(embedding_cache.set, EMBEDDING_CACHE_KEY, text, embedding)
+    else:
+        embedding_cache.set(EMBEDDING_CACHE_KEY, text, embedding)
+    return embedding
+
+class EmbeddingStats:
+    """Thread-safe throughput counter for the batched embedding engine."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    def record(self, chunks: int, batches: int, seconds: float):
+        with self._lock:
+            self.chunks += chunks
+            self.batches += batches
+            self.seconds += seconds
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks / self.seconds if self.seconds > 0 else 0.0
+
+# Global Instance
+embedding_stats = EmbeddingStats()
+
+def pack_batches(texts: List[str], max_tokens: int, max_items: int) -> List[List[int]]:
+    """
+    Groups text indices into consecutive batches bounded by estimated tokens and item count.
+    A single text larger than max_tokens gets a batch of its own.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _embed_batch(texts: List[str], priority: str) -> List[List[float]]:
+    """
+    Embeds one batch. The rate-limit scheduler retries 429s, connection errors and 5xx;
+    anything else fails the batch (and the indexing job, which the job queue retries).
+    """
+    response = rate_limiter.call(
+        EMBEDDING_MODEL, priority, sum(estimate_tokens(t) for t in texts),
+        lambda: client.embeddings.with_raw_response.create(input=texts, **_embedding_args())
+    )
+    record_usage(EMBEDDING_MODEL, "embed_ingest", response.usage)
+    # The API returns one item per input with its position in `index`
+    ordered = sorted(response.data, key=lambda d: d.index)
+    return [d.embedding for d in ordered]
+
+def get_embeddings(texts: List[str], priority: str = "ingest") -> List[List[float]]:
+    """
+    Generates embeddings for many strings.
+    Cached texts are served from the embedding cache; the rest are packed into token-bounded
+    batches that run concurrently on a bounded thread pool. Results are returned in input order.
+    Batches queue for the rate limit in the given priority class.
+    """
+    if not texts:
+        return []
+
+    t0 = time.perf_counter()
+    normalized = [embedding_cache.normalize(t) for t in texts]
+    # Chunk vectors skip the in-memory tier, which holds query embeddings
+    l1 = priority != "ingest"
+    results: List[List[float]] = embedding_cache.get_many(EMBEDDING_CACHE_KEY, normalized, l1=l1)
+
+    # Only texts missing from the cache go to the API (each distinct text once)
+    pending = {}
+    for i, text in enumerate(normalized):
+        if results[i] is None:
+            pending.setdefault(text, []).append(i)
+    cleaned = list(pending.keys())
+    batches = pack_batches(cleaned, Config.EMBED_BATCH_MAX_TOKENS, Config.EMBED_BATCH_MAX_ITEMS)
+
+    fresh: List[List[float]] = [None] * len(cleaned)
+    with ThreadPoolExecutor(max_workers=max(1, Config.EMBED_CONCURRENCY)) as executor:
+        futures = [(batch, executor.submit(_embed_batch, [cleaned[i] for i in batch], priority)) for batch in batches]
+        for batch, future in futures:
+            embeddings = future.result()
+            for i, embedding in zip(batch, embeddings):
+                fresh[i] = embedding
+
+    embedding_cache.set_many(EMBEDDING_CACHE_KEY, cleaned, fresh, l1=l1)
+    for text, embedding in zip(cleaned, fresh):
+        for i in pending[text]:
+            results[i] = embedding
+
+    embedding_stats.record(len(texts), len(batches), time.perf_counter() - t0)
+    return results
+
+async def get_embeddings_async(texts: List[str], priority: str = "batch") -> List[List[float]]:
+    """
+    Async variant of get_embeddings for the request path (/chat/batch): cache misses go out
+    in as few token-bounded requests as possible, sent concurrently. Results are in input order.
+    """
+    if not texts:
+        return []
+
+    normalized = [embedding_cache.normalize(t) for t in texts]
+    if embedding_cache.db_path:
+        results = await asyncio.to_thread(embedding_cache.get_many, EMBEDDING_CACHE_KEY, normalized)
+    else:
+        results = embedding_cache.get_many(EMBEDDING_CACHE_KEY, normalized)
+
+    pending = {}
+    for i, text in enumerate(normalized):
+        if results[i] is None:
+            pending.setdefault(text, []).append(i)
+    if not pending:
+        return results
+    cleaned = list(pending.keys())
+
+    async def embed_batch(batch: List[int]) -> List[List[float]]:
+        inputs = [cleaned[i] for i in batch]
+        response = await rate_limiter.call_async(
+            EMBEDDING_MODEL, priority, sum(estimate_tokens(t) for t in inputs),
+            lambda: async_client.embeddings.with_raw_response.create(input=inputs, **_embedding_args())
+        )
+        record_usage(EMBEDDING_MODEL, "embed_query", response.usage)
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+    batches = pack_batches(cleaned, Config.EMBED_BATCH_MAX_TOKENS, Config.EMBED_BATCH_MAX_ITEMS)
+    fresh: List[List[float]] = [None] * len(cleaned)
+    for batch, embeddings in zip(batches, await asyncio.gather(*(embed_batch(batch) for batch in batches))):
+        for i, embedding in zip(batch, embeddings):
+            fresh[i] = embedding
+
+    if embedding_cache.db_path:
+        await asyncio.to_thread(embedding_cache.set_many, EMBEDDING_CACHE_KEY, cleaned, fresh)
+    else:
+        embedding_cache.set_many(EMBEDDING_CACHE_KEY, cleaned, fresh)
+    for text, embedding in zip(cleaned, fresh):
+        for i in pending[text]:
+            results[i] = embedding
+    return results
+
+def build_answer_messages(question: str, context_chunks: List[str]) -> List[Dict[str, str]]:
+    """Builds the chat messages for answer generation from the context chunks."""
     context_text = "\n\n".join(context_chunks)
     
-    messages = [
+    return [
         {
             "role": "system",
             "content": (
@@ -37,9 +261,33 @@ def generate_answer(question: str, context_chunks: List[str]) -> str:
         }
     ]
 
-    response = client.chat.completions.create(
-        model=LLM_MODEL,
-        messages=messages
+async def generate_answer_stream(question: str, context_chunks: List[str]) -> AsyncIterator[str]:
+    """Streams the answer token by token (content deltas) as the model produces it."""
+    messages = build_answer_messages(question, context_chunks)
+    reserved = estimate_completion_tokens(messages)
+    stream = await rate_limiter.call_async(
+        LLM_MODEL, request_priority.get(), reserved,
+        lambda: async_client.chat.completions.with_raw_response.create(
+            model=LLM_MODEL,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}  # Usage arrives in a last chunk without choices
+        )
     )
-    
-    return response.choices[0].message.content
+    settled = False
+    generated: List[str] = []
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                record_usage(LLM_MODEL, "generate", chunk.usage)
+                rate_limiter.settle(LLM_MODEL, reserved, chunk.usage.total_tokens)
+                settled = True
+            if chunk.choices and chunk.choices[0].delta.content:
+                generated.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    finally:
+        if not settled:
+            # Client gone (or stream failed) before the usage chunk: settle on the prompt and what was generated
+            used = reserved - Config.OPENAI_COMPLETION_TOKENS_ESTIMATE + estimate_tokens("".join(generated))
+            rate_limiter.settle(LLM_MODEL, reserved, used)
+            await stream.close()
@@ -0,0 +1,79 @@
+import sys
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict
+from backend.config import Config
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event and the event's fields."""
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage()
+        }
+        payload.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable variant for local runs: time level logger event key=value ..."""
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{key}={json.dumps(value, default=str, ensure_ascii=False)}" for key, value in getattr(record, "fields", {}).items())
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + fields
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class EventLogger:
+    """Logs named events with keyword fields: log.info("chat.cache_hit", key=..., total_ms=...)."""
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+
+    def _log(self, level: int, event: str, exc_info: bool = False, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, **fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, **fields)
+
+    def exception(self, event: str, **fields):
+        """error() with the current exception's traceback."""
+        self._log(logging.ERROR, event, exc_info=True, **fields)
+
+_configure_lock = threading.Lock()
+_configured = False
+
+def _configure():
+    # One handler on the "rag" parent logger, independent of uvicorn's logging setup
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter() if Config.LOG_FORMAT == "json" else TextFormatter())
+        root = logging.getLogger("rag")
+        root.addHandler(handler)
+        root.setLevel(Config.LOG_LEVEL.upper())
+        root.propagate = False
+        _configured = True
+
+def get_logger(name: str) -> EventLogger:
+    """Logger for a component, e.g. get_logger("chat") logs as "rag.chat"."""
+    _configure()
+    return EventLogger(logging.getLogger(f"rag.{name}"))
@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from backend.config import Config
+from backend.services.logs import get_logger
+
+log = get_logger("metrics")
+
+# Latency buckets in seconds, from cache hits to long generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Metric:
+    """Base of Counter and Histogram: one value per combination of label values."""
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Any]:
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+class Gauge(Metric):
+    """Current value (e.g. a queue depth); summed across live processes only."""
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+class Histogram(Metric):
+    """Per label set: observation counts per bucket (the last one is +Inf) and their sum."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def snapshot(self) -> Dict[Tuple[str, ...], list]:
+        with self._lock:
+            return {key: [list(counts), total] for key, (counts, total) in self._values.items()}
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Running under another user
+    return True
+
+class MetricsRegistry:
+    """
+    Process-wide metrics, rendered in the Prometheus text format.
+
+    Recording only touches the metric's own lock. With a directory set, every process
+    (API workers, python -m backend.worker) periodically writes a snapshot of its values to
+    metrics_<pid>_<start>.json there, and render() sums the snapshots of all processes, so any
+    worker can answer a scrape. Snapshots of exited processes are kept, so counters do not
+    go backwards when a worker restarts (the start time keeps a reused pid from overwriting
+    them), but their gauges are skipped; clear the directory when redeploying from scratch.
+    """
+    def __init__(self, directory: str = "", flush_seconds: float = 5.0):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._started_ms = int(time.time() * 1000)
+        self.metrics: Dict[str, Metric] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def _local(self) -> Dict[str, Dict[Tuple[str, ...], Any]]:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"metrics_{os.getpid()}_{self._started_ms}.json")
+
+    def flush(self):
+        """Writes this process's snapshot atomically (no-op without a directory)."""
+        if not self.directory:
+            return
+        payload = {name: [[list(key), value] for key, value in values.items()] for name, values in self._local().items()}
+        path = self._path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except OSError as e:
+                log.warning("metrics.flush_failed", error=str(e))
+
+    def start(self):
+        """Starts periodic snapshots for multi-process aggregation (idempotent)."""
+        if not self.directory:
+            return
+        with self._start_lock:
+            if self._flusher is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _merge(self, merged: Dict[str, Dict[Tuple[str, ...], Any]], name: str, key: Tuple[str, ...], value: Any, alive: bool = True):
+        metric = self.metrics.get(name)
+        if metric is None or (metric.kind == "gauge" and not alive):
+            return
+        values = merged.setdefault(name, {})
+        if metric.kind in ("counter", "gauge"):
+            values[key] = values.get(key, 0.0) + value
+        else:
+            counts, total = value
+            if len(counts) != len(metric.buckets) + 1:
+                return  # Written with other buckets
+            state = values.setdefault(key, [[0] * len(counts), 0.0])
+            state[0] = [a + b for a, b in zip(state[0], counts)]
+            state[1] += total
+
+    def collect(self) -> Dict[str, Dict[Tuple[str, ...], Any]]:
+        """Values of this process plus the latest snapshots of all other processes."""
+        merged: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+        for name, values in self._local().items():
+            for key, value in values.items():
+                self._merge(merged, name, key, value)
+        if not self.directory or not os.path.isdir(self.directory):
+            return merged
+
+        own = os.path.basename(self._path())
+        snapshots: List[Tuple[int, int, str]] = []
+        for filename in os.listdir(self.directory):
+            if filename == own or not (filename.startswith("metrics_") and filename.endswith(".json")):
+                continue
+            try:
+                # metrics_<pid>_<start>.json; metrics_<pid>.json from older versions counts as start 0
+                pid, _, started = filename[len("metrics_"):-len(".json")].partition("_")
+                snapshots.append((int(pid), int(started or 0), filename))
+            except ValueError:
+                continue
+
+        # Only the newest snapshot of a running pid can belong to a live process
+        latest: Dict[int, int] = {}
+        for pid, started, _ in snapshots:
+            latest[pid] = max(latest.get(pid, started), started)
+        for pid, started, filename in snapshots:
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                continue  # Removed or being replaced
+            alive = started == latest[pid] and _pid_alive(pid)
+            for name, items in payload.items():
+                for key, value in items:
+                    self._merge(merged, name, tuple(key), value, alive)
+        return merged
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        merged = self.collect()
+        lines: List[str] = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(merged.get(name, {}).items()):
+                if metric.kind in ("counter", "gauge"):
+                    lines.append(f"{name}{_format_labels(metric.labels, key)} {_format_number(value)}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(list(metric.buckets) + [None], counts):
+                    cumulative += count
+                    le = "+Inf" if bound is None else _format_number(bound)
+                    lines.append(f"{name}_bucket{_format_labels(metric.labels, key, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(metric.labels, key)} {_format_number(total)}")
+                lines.append(f"{name}_count{_format_labels(metric.labels, key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+# Global Instance
+metrics = MetricsRegistry(Config.METRICS_DIR, Config.METRICS_FLUSH_SECONDS)
+
+# Chat request path
+CHAT_STAGE_SECONDS = metrics.histogram("rag_chat_stage_seconds", "Duration of /chat pipeline stages on cache misses; stage=\"total\" is the whole pipeline.", ["stage"])
+CHAT_REQUEST_SECONDS = metrics.histogram("rag_chat_request_seconds", "End-to-end /chat and /chat/stream latency.", ["endpoint", "cache"])
+CHAT_DEGRADATIONS = metrics.counter("rag_chat_degradations_total", "Answers degraded to meet the deadline, by degradation.", ["kind"])
+CHAT_CACHE_HITS = metrics.counter("rag_chat_cache_hits_total", "Chat cache hits by tier (l1, l2, semantic).", ["tier"])
+CHAT_CACHE_MISSES = metrics.counter("rag_chat_cache_misses_total", "Chat cache misses (exact lookup).")
+CHAT_CACHE_EVICTIONS = metrics.counter("rag_chat_cache_evictions_total", "Chat cache L1 evictions by reason (capacity, expired, invalidated).", ["reason"])
+CHAT_COALESCED = metrics.counter("rag_chat_coalesced_total", "Requests that joined an identical question already in flight.")
+
+# OpenAI
+OPENAI_TOKENS = metrics.counter("rag_openai_tokens_total", "Tokens reported by the OpenAI API, by model, operation and kind (prompt, completion).", ["model", "operation", "kind"])
+OPENAI_REQUESTS = metrics.counter("rag_openai_requests_total", "OpenAI calls by model, priority class and outcome (ok, error).", ["model", "priority", "outcome"])
+OPENAI_RATE_LIMITED = metrics.counter("rag_openai_rate_limited_total", "429 responses from the OpenAI API (each pauses the model).", ["model", "priority"])
+OPENAI_QUEUE_DEPTH = metrics.gauge("rag_openai_queue_depth", "OpenAI calls waiting for rate-limit admission.", ["model", "priority"])
+OPENAI_QUEUE_WAIT = metrics.histogram("rag_openai_queue_wait_seconds", "Time OpenAI calls waited for rate-limit admission.", ["model", "priority"])
+
+# Ingestion: chunks/sec of a stage = rate(chunks) / rate(seconds)
+INGEST_CHUNKS = metrics.counter("rag_ingest_chunks_total", "Chunks processed by ingestion stage (extract, embed, store).", ["stage"])
+INGEST_SECONDS = metrics.counter("rag_ingest_stage_seconds_total", "Time spent in ingestion stages.", ["stage"])
@@ -0,0 +1,157 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+from backend.services.logs import get_logger
+
+log = get_logger("pipeline")
+
+class StopPipeline(Exception):
+    """Raised by a stage to finish the whole pipeline early with a result (e.g. a cache hit)."""
+    def __init__(self, result: Any):
+        super().__init__("pipeline stopped early")
+        self.result = result
+
+class Stage:
+    """
+    One step of a Pipeline. run(ctx) starts as soon as every stage in deps has finished and
+    reads their outputs from ctx.results. It is limited by timeout (seconds from its start) and
+    deadline (an absolute time.perf_counter() value), whichever comes first. On error or
+    timeout, fallback(ctx, error) supplies the output instead, if given; otherwise the pipeline fails.
+    """
+    def __init__(self, name: str, run: Callable[["PipelineRun"], Awaitable[Any]], deps: Sequence[str] = (),
+                 timeout: Optional[float] = None, fallback: Optional[Callable[["PipelineRun", Exception], Any]] = None,
+                 deadline: Optional[float] = None):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.timeout = timeout or None  # 0 = no timeout
+        self.fallback = fallback
+        self.deadline = deadline
+
+    def time_left(self) -> Optional[float]:
+        """Seconds this stage may run if started now (None = unlimited)."""
+        if self.deadline is None:
+            return self.timeout
+        remaining = self.deadline - time.perf_counter()
+        return remaining if self.timeout is None else min(self.timeout, remaining)
+
+class PipelineRun:
+    """State of one execution: stage outputs, per-stage start/duration and status."""
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.results: Dict[str, Any] = {}
+        self.started: Dict[str, float] = {}  # ms since pipeline start
+        self.durations: Dict[str, float] = {}  # ms
+        self.status: Dict[str, str] = {}  # ok, fallback, timeout
+        self.stopped: Optional[StopPipeline] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def result(self, name: str) -> Any:
+        """Waits for a stage that is not a declared dependency (a soft ordering constraint)."""
+        await asyncio.shield(self._tasks[name])
+        return self.results[name]
+
+    def finished_at(self, name: str) -> float:
+        return self.started.get(name, 0.0) + self.durations.get(name, 0.0)
+
+    def critical_path(self, stages: Dict[str, Stage]) -> List[str]:
+        """Chain of stages that determined the total time: from the last one to finish, back through its latest dependency."""
+        done = [name for name in self.durations]
+        if not done:
+            return []
+        path = [max(done, key=self.finished_at)]
+        while True:
+            deps = [d for d in stages[path[-1]].deps if d in self.durations]
+            if not deps:
+                break
+            path.append(max(deps, key=self.finished_at))
+        return list(reversed(path))
+
+class Pipeline:
+    """
+    Runs a DAG of stages with maximal overlap: every stage is a task that waits only for its
+    own dependencies, so independent stages run concurrently.
+    """
+    def __init__(self, stages: List[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        order, visiting, visited = [], set(), set()
+
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a cycle through stage '{name}'")
+            if name not in self.stages:
+                raise ValueError(f"Unknown pipeline stage '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    async def _run_stage(self, run: PipelineRun, stage: Stage):
+        if stage.deps:
+            await asyncio.gather(*(run._tasks[dep] for dep in stage.deps))
+        start = time.perf_counter()
+        run.started[stage.name] = (start - run.t0) * 1000
+        timeout = stage.time_left()
+        try:
+            if timeout is not None and timeout <= 0:
+                # Deadline already passed while waiting for dependencies
+                raise asyncio.TimeoutError()
+            if timeout is not None:
+                value = await asyncio.wait_for(stage.run(run), timeout)
+            else:
+                value = await stage.run(run)
+            run.status[stage.name] = "ok"
+        except StopPipeline:
+            run.durations[stage.name] = (time.perf_counter() - start) * 1000
+            run.status[stage.name] = "stopped"
+            raise
+        except Exception as e:
+            if stage.fallback is None:
+                raise
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            if not timed_out:
+                log.warning("pipeline.stage_failed", stage=stage.name, error=str(e), fallback=True)
+            elif timeout <= 0:
+                log.warning("pipeline.stage_skipped", stage=stage.name, reason="out_of_time_budget", fallback=True)
+            else:
+                log.warning("pipeline.stage_timeout", stage=stage.name, timeout_s=round(timeout, 3), fallback=True)
+            value = stage.fallback(run, e)
+            run.status[stage.name] = "timeout" if timed_out else "fallback"
+        run.durations[stage.name] = (time.perf_counter() - start) * 1000
+        run.results[stage.name] = value
+        return value
+
+    async def run(self) -> PipelineRun:
+        run = PipelineRun()
+        for name in self.order:
+            run._tasks[name] = asyncio.create_task(self._run_stage(run, self.stages[name]))
+        try:
+            await asyncio.gather(*run._tasks.values())
+        except StopPipeline as stop:
+            run.stopped = stop
+        finally:
+            # Early stop, failure or cancellation: nothing keeps running in the background
+            pending = [task for task in run._tasks.values() if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*run._tasks.values(), return_exceptions=True)
+        return run
+
+    def report(self, run: PipelineRun, **fields):
+        """Logs the per-stage timeline and the critical path as one event."""
+        stages = [
+            {"stage": name, "start_ms": round(run.started[name], 2), "ms": round(run.durations.get(name, 0.0), 2), "status": run.status.get(name, "cancelled")}
+            for name in sorted(run.started, key=run.started.get)
+        ]
+        log.info("pipeline.timeline", stages=stages, critical_path=run.critical_path(self.stages), **fields)
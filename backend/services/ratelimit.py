@@ -0,0 +1,364 @@
+import re
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+import openai
+from backend.config import Config
+from backend.services.logs import get_logger
+from backend.services.metrics import OPENAI_QUEUE_DEPTH, OPENAI_QUEUE_WAIT, OPENAI_REQUESTS, OPENAI_RATE_LIMITED
+
+log = get_logger("ratelimit")
+
+# Lower is served first; interactive calls may also use the reserved share of every bucket
+PRIORITIES = {"interactive": 0, "batch": 1, "ingest": 2}
+RETRY_BASE_SECONDS = 0.5  # Backoff of connection errors and 5xx: base * 2^attempt
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# Priority class of the /chat call sites (question embedding, rerank, generation); /chat/batch sets "batch"
+request_priority: ContextVar[str] = ContextVar("openai_request_priority", default="interactive")
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """ "model=rpm:tpm,..." -> {model: (rpm, tpm)}; 0 leaves a limit to be learned from response headers."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, values = item.partition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[model.strip()] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds of an OpenAI reset header ("1s", "6m0s", "250ms") or of a plain number."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Per-minute budget refilled continuously; settling actual usage may take the level below zero."""
+    def __init__(self, limit: int = 0):
+        self.limit = limit  # 0 = unknown, never waits
+        self.level = float(limit)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.limit:
+            self.level = min(float(self.limit), self.level + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    def wait_time(self, cost: float, reserve: float) -> float:
+        """Seconds until cost fits above the reserved share (a cost larger than the bucket waits for a full one)."""
+        if not self.limit:
+            return 0.0
+        floor = reserve * self.limit
+        needed = min(cost, self.limit - floor) + floor - self.level
+        return max(0.0, needed * 60 / self.limit)
+
+    def set_limit(self, limit: int):
+        if limit != self.limit:
+            self.level = float(limit) if not self.limit else min(self.level, float(limit))
+            self.limit = limit
+
+class _Waiter:
+    """One queued call, woken through a threading.Event or a future of its event loop."""
+    __slots__ = ("priority", "rank", "seq", "tokens", "granted", "cancelled", "enqueued", "_event", "_loop", "_future")
+
+    def __init__(self, priority: str, seq: int, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.rank = PRIORITIES[priority]
+        self.seq = seq
+        self.tokens = tokens
+        self.granted = False
+        self.cancelled = False
+        self.enqueued = time.monotonic()
+        self._loop = loop
+        self._future = loop.create_future() if loop else None
+        self._event = None if loop else threading.Event()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+    def grant(self):
+        self.granted = True
+        if self._future is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._resolve)
+            except RuntimeError:
+                pass  # Loop closed, nobody is waiting any more
+        else:
+            self._event.set()
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self):
+        self._event.wait()
+
+    async def wait_async(self):
+        await self._future
+
+class _ModelState:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.configured = (rpm, tpm)
+        self.paused_until = 0.0
+        self.waiters: List[_Waiter] = []
+
+    def wait_time(self, waiter: _Waiter, now: float, reserve: float) -> float:
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        if waiter.rank == 0:
+            reserve = 0.0
+        return max(self.paused_until - now, self.requests.wait_time(1, reserve), self.tokens.wait_time(waiter.tokens, reserve))
+
+    def take(self, waiter: _Waiter):
+        self.requests.level -= 1
+        self.tokens.level -= waiter.tokens
+
+class RateLimitScheduler:
+    """
+    Admission control for every OpenAI call of the process, per model: a requests and a tokens
+    bucket (RPM / TPM), and a queue served by priority class (interactive, batch, ingest) then
+    arrival. Interactive calls go first and may use the last `reserve` share of each bucket, so
+    batches and bulk ingestion never drain the quota that /chat needs. Calls are admitted with
+    an estimate of their tokens and settled with the reported usage; an attempt that gets no
+    response (error, retry, cancellation) gives its estimate back.
+
+    Limits come from OPENAI_RATE_LIMITS, or are learned from the x-ratelimit-limit-* headers.
+    The x-ratelimit-remaining-* headers (account-wide) clamp the buckets, which keeps several
+    processes sharing one key in step; a 429 pauses the model until its reset time and the
+    call is queued again. Connection errors and 5xx are retried with exponential backoff.
+    """
+    def __init__(self, limits: Dict[str, Tuple[int, int]], reserve: float = 0.2, max_retries: int = 3):
+        self.limits = limits
+        self.reserve = min(max(reserve, 0.0), 0.9)
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._models: Dict[str, _ModelState] = {}
+        self._seq = itertools.count()
+        self._dispatcher: Optional[threading.Thread] = None
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelState(*self.limits.get(model, (0, 0)))
+        return state
+
+    def _grant_ready(self, model: str, state: _ModelState, now: float) -> Optional[float]:
+        """Grants queue heads that fit; returns seconds until the next head may fit (None if empty)."""
+        while state.waiters:
+            head = state.waiters[0]
+            if head.cancelled:
+                heapq.heappop(state.waiters)
+                continue
+            wait = state.wait_time(head, now, self.reserve)
+            if wait > 0:
+                return wait
+            heapq.heappop(state.waiters)
+            state.take(head)
+            head.grant()
+            OPENAI_QUEUE_DEPTH.dec(model=model, priority=head.priority)
+            OPENAI_QUEUE_WAIT.observe(now - head.enqueued, model=model, priority=head.priority)
+        return None
+
+    def _dispatch_loop(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                timeouts = [self._grant_ready(model, state, now) for model, state in self._models.items()]
+                pending = [t for t in timeouts if t is not None]
+                # Wakes up when the earliest head can fit, or when a call is queued or settled
+                self._cond.wait(min(pending) if pending else None)
+
+    def _enqueue(self, model: str, priority: str, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None) -> _Waiter:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}, expected one of {', '.join(PRIORITIES)}")
+        with self._cond:
+            state = self._state(model)
+            waiter = _Waiter(priority, next(self._seq), max(0, tokens), loop)
+            heapq.heappush(state.waiters, waiter)
+            OPENAI_QUEUE_DEPTH.inc(model=model, priority=priority)
+            # Fast path: granted right here when nothing is ahead and the buckets allow it
+            self._grant_ready(model, state, time.monotonic())
+            if not waiter.granted:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(target=self._dispatch_loop, name="openai-ratelimit", daemon=True)
+                    self._dispatcher.start()
+                self._cond.notify()
+        return waiter
+
+    def _cancel(self, model: str, priority: str, waiter: _Waiter):
+        """Drops a waiter whose caller gave up (e.g. a /chat stage timeout); unused capacity is returned."""
+        with self._cond:
+            state = self._state(model)
+            if waiter.granted:
+                state.requests.level += 1
+                state.tokens.level += waiter.tokens
+                self._cond.notify()
+            elif not waiter.cancelled:
+                waiter.cancelled = True
+                OPENAI_QUEUE_DEPTH.dec(model=model, priority=priority)
+
+    def acquire(self, model: str, priority: str, tokens: int):
+        """Blocks until a call of about `tokens` tokens may be sent."""
+        self._enqueue(model, priority, tokens).wait()
+
+    async def acquire_async(self, model: str, priority: str, tokens: int):
+        """Async variant of acquire; cancellation leaves the queue."""
+        waiter = self._enqueue(model, priority, tokens, asyncio.get_running_loop())
+        try:
+            await waiter.wait_async()
+        except asyncio.CancelledError:
+            self._cancel(model, priority, waiter)
+            raise
+
+    def settle(self, model: str, reserved: int, used: Optional[int]):
+        """Corrects the tokens bucket once the actual usage of an admitted call is known."""
+        if used is None or used == reserved:
+            return
+        with self._cond:
+            self._state(model).tokens.level += reserved - used
+            self._cond.notify()
+
+    def _refund(self, model: str, reserved: int):
+        """Returns the tokens reserved for an attempt that got no response (error, cancellation)."""
+        self.settle(model, reserved, 0)
+
+    def observe(self, model: str, headers: Mapping[str, str]):
+        """Applies the x-ratelimit-* headers of a response: learns unconfigured limits, clamps to the account's remaining quota."""
+        limit_requests = _header_int(headers, "x-ratelimit-limit-requests")
+        limit_tokens = _header_int(headers, "x-ratelimit-limit-tokens")
+        remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+        if limit_requests is None and remaining_requests is None and remaining_tokens is None:
+            return
+        with self._cond:
+            state = self._state(model)
+            now = time.monotonic()
+            state.requests.refill(now)
+            state.tokens.refill(now)
+            configured_rpm, configured_tpm = state.configured
+            if limit_requests and not configured_rpm:
+                state.requests.set_limit(limit_requests)
+            if limit_tokens and not configured_tpm:
+                state.tokens.set_limit(limit_tokens)
+            if remaining_requests is not None and state.requests.limit:
+                state.requests.level = min(state.requests.level, float(remaining_requests))
+            if remaining_tokens is not None and state.tokens.limit:
+                state.tokens.level = min(state.tokens.level, float(remaining_tokens))
+
+    def pause(self, model: str, headers: Mapping[str, str], attempt: int) -> float:
+        """Stops admitting calls to model after a 429, for as long as the headers ask (else backoff)."""
+        delay = parse_duration(headers.get("retry-after-ms"))
+        if delay is not None:
+            delay /= 1000
+        else:
+            delay = parse_duration(headers.get("retry-after"))
+        if delay is None:
+            resets = [parse_duration(headers.get(name)) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+            resets = [r for r in resets if r is not None]
+            delay = max(resets) if resets else None
+        if delay is None:
+            delay = RETRY_BASE_SECONDS * 2 ** attempt
+        delay = min(delay, 60.0)
+        with self._cond:
+            state = self._state(model)
+            state.paused_until = max(state.paused_until, time.monotonic() + delay)
+            self._cond.notify()
+        return delay
+
+    def _on_error(self, model: str, priority: str, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying error, or None when it must be raised."""
+        if attempt >= self.max_retries:
+            OPENAI_REQUESTS.inc(model=model, priority=priority, outcome="error")
+            return None
+        if isinstance(error, openai.RateLimitError) and error.code != "insufficient_quota":
+            OPENAI_RATE_LIMITED.inc(model=model, priority=priority)
+            # remaining = 0 empties the bucket, the pause holds every queued call to the model;
+            # this one only has to queue again
+            self.observe(model, error.response.headers)
+            delay = self.pause(model, error.response.headers, attempt)
+            log.warning("openai.rate_limited", model=model, priority=priority, attempt=attempt + 1, pause_s=round(delay, 3))
+            return 0.0
+        if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+            delay = RETRY_BASE_SECONDS * 2 ** attempt
+            log.warning("openai.retry", model=model, priority=priority, attempt=attempt + 1, delay_s=delay, error=str(error))
+            return delay
+        OPENAI_REQUESTS.inc(model=model, priority=priority, outcome="error")
+        return None
+
+    def _finish(self, model: str, priority: str, tokens: int, raw: Any) -> Any:
+        self.observe(model, raw.headers)
+        parsed = raw.parse()
+        usage = getattr(parsed, "usage", None)
+        self.settle(model, tokens, getattr(usage, "total_tokens", None) if usage is not None else None)
+        OPENAI_REQUESTS.inc(model=model, priority=priority, outcome="ok")
+        return parsed
+
+    def call(self, model: str, priority: str, tokens: int, request: Callable[[], Any]) -> Any:
+        """
+        Runs request() once admitted and returns the parsed response. request must return a raw
+        response (client.<resource>.with_raw_response.create(...)) so the headers can be read.
+        """
+        attempt = 0
+        while True:
+            self.acquire(model, priority, tokens)
+            try:
+                raw = request()
+            except BaseException as e:
+                # Each attempt reserves again; refunded before a 429's headers clamp the bucket
+                self._refund(model, tokens)
+                if not isinstance(e, Exception):
+                    raise
+                delay = self._on_error(model, priority, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            return self._finish(model, priority, tokens, raw)
+
+    async def call_async(self, model: str, priority: str, tokens: int, request: Callable[[], Awaitable[Any]]) -> Any:
+        """Async variant of call."""
+        attempt = 0
+        while True:
+            await self.acquire_async(model, priority, tokens)
+            try:
+                raw = await request()
+            except BaseException as e:
+                # Also on cancellation (a /chat stage timeout), which is not an Exception
+                self._refund(model, tokens)
+                if not isinstance(e, Exception):
+                    raise
+                delay = self._on_error(model, priority, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            return self._finish(model, priority, tokens, raw)
+
+# Global Instance
+rate_limiter = RateLimitScheduler(
+    parse_limits(Config.OPENAI_RATE_LIMITS),
+    reserve=Config.OPENAI_INTERACTIVE_RESERVE,
+    max_retries=Config.OPENAI_MAX_RETRIES
+)
@@ -1,86 +1,239 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
+import re
 import json
-from openai import OpenAI
+import time
+import asyncio
+import numpy as np
 from backend.config import Config
+from backend.services.llm import async_client, EMBEDDING_CACHE_KEY, record_usage, estimate_completion_tokens
+from backend.services.ratelimit import rate_limiter, request_priority
+from backend.services.cache import embedding_cache, rerank_cache
+from backend.services.retrieval import get_retrieval_backend
+from backend.services.logs import get_logger
 
-client = OpenAI(api_key=Config.OPENAI_API_KEY)
+log = get_logger("rerank")
 
-def rerank(question: str, candidates: List[Dict], top_n: int = 5) -> List[Dict]:
-    """
-    Reranks a list of candidate chunks based on relevance to the question using an LLM.
-    
-    Args:
-        question: The user's query.
-        candidates: List of candidate dictionaries (must contain 'content').
-        top_n: Number of top results to return.
-        
-    Returns:
-        List[Dict]: Top N reranked candidates.
-    """
-    if not Config.RERANK_ENABLED:
-        return candidates[:top_n]
-        
-    if not candidates:
-        return []
-
-    print(f"[Rerank] Reranking {len(candidates)} candidates for question: '{question}'")
+RERANK_MODEL = "gpt-4o-mini" # Use a faster/cheaper model for reranking if possible, or Config.LLM_MODEL
 
+def _build_rerank_messages(question: str, candidates: List[Dict]) -> List[Dict[str, str]]:
     # Format candidates for LLM
     candidate_texts = []
     for i, c in enumerate(candidates):
-        # Taking first 300 chars for preview to save tokens if needed, 
+        # Taking first 300 chars for preview to save tokens if needed,
         # but for accuracy full content is better. Let's send full content but truncated reasonably if huge.
-        content_preview = c.get("content", "")[:1000] 
+        content_preview = c.get("content", "")[:1000]
         candidate_texts.append(f"ID: {i}\nContent: {content_preview}\n")
-    
+
     candidates_block = "\n---\n".join(candidate_texts)
-    
+
     prompt = f"""
     You are a relevance ranker. You will be given a QUESTION and a list of PASSAGES.
     Your task is to rank the passages based on how relevant they are to answering the question.
-    
+
     Return a JSON object with a list of indices sorted by relevance (most relevant first).
     Format: {{ "ranked_indices": [2, 0, 1, ...] }}
-    
+
     Only include indices of passages that are somewhat relevant. If a passage is completely irrelevant, exclude it.
-    
+
     QUESTION: {question}
-    
+
     PASSAGES:
     {candidates_block}
     """
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", # Use a faster/cheaper model for reranking if possible, or Config.LLM_MODEL
-            messages=[
-                {"role": "system", "content": "You are a helpful relevance ranking assistant. Output valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0
+
+    return [
+        {"role": "system", "content": "You are a helpful relevance ranking assistant. Output valid JSON."},
+        {"role": "user", "content": prompt}
+    ]
+
+def _parse_ranking(result_text: str, count: int) -> List[int]:
+    """Valid candidate indices from the model output, in ranked order."""
+    result_json = json.loads(result_text)
+    ranked_indices = result_json.get("ranked_indices", [])
+    return [idx for idx in ranked_indices if isinstance(idx, int) and 0 <= idx < count]
+
+class Reranker:
+    """Orders retrieval candidates by relevance to the question."""
+    name = "none"
+
+    @property
+    def cache_id(self) -> str:
+        """Identifies the ranking function (mode, model, weights) in rerank cache keys."""
+        return self.name
+
+    async def rank(self, question: str, candidates: List[Dict], top_n: int, query_embedding: Optional[List[float]] = None) -> List[int]:
+        """Indices of the top N candidates, most relevant first. Raises on failure."""
+        raise NotImplementedError
+
+    async def rerank(self, question: str, candidates: List[Dict], top_n: int, query_embedding: Optional[List[float]] = None) -> List[Dict]:
+        return [candidates[i] for i in await self.rank(question, candidates, top_n, query_embedding)]
+
+class LLMReranker(Reranker):
+    """Asks RERANK_MODEL for an ordering of the passages (one chat completion per call)."""
+    name = "llm"
+
+    @property
+    def cache_id(self) -> str:
+        return f"llm:{RERANK_MODEL}"
+
+    async def rank(self, question: str, candidates: List[Dict], top_n: int, query_embedding: Optional[List[float]] = None) -> List[int]:
+        messages = _build_rerank_messages(question, candidates)
+        response = await rate_limiter.call_async(
+            RERANK_MODEL, request_priority.get(), estimate_completion_tokens(messages),
+            lambda: async_client.chat.completions.with_raw_response.create(
+                model=RERANK_MODEL,
+                messages=messages,
+                response_format={"type": "json_object"},
+                temperature=0
+            )
         )
-        
-        result_text = response.choices[0].message.content
-        result_json = json.loads(result_text)
-        ranked_indices = result_json.get("ranked_indices", [])
-        
-        # Reconstruct result list
-        reranked_results = []
-        for idx in ranked_indices:
-            if 0 <= idx < len(candidates):
-                item = candidates[idx]
-                # We can add a flag or score if we want
-                reranked_results.append(item)
-                
-        # Fill with remaining if we don't have enough (optional fallback)? 
-        # The requirement says "graceful fallback: return candidates as is". 
-        # But if LLM returns partial list, we probably trust it. 
-        # Let's stick to the top N from the ranked list.
-        
-        print(f"[Rerank] Success. Returned {len(reranked_results[:top_n])} items.")
-        return reranked_results[:top_n]
-        
-    except Exception as e:
-        print(f"[Rerank] Error: {e}. Fallback to original order.")
+        record_usage(RERANK_MODEL, "rerank", response.usage)
+        ranked = _parse_ranking(response.choices[0].message.content, len(candidates))[:top_n]
+        log.info("rerank.done", mode=self.name, returned=len(ranked))
+        return ranked
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def _tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    spread = values.max() - values.min()
+    if spread <= 0:
+        return np.zeros_like(values)
+    return (values - values.min()) / spread
+
+class LocalReranker(Reranker):
+    """
+    In-process reranker: BM25 of the question terms over the candidate set plus cosine
+    similarity of each chunk embedding to the already computed query embedding, both
+    min-max normalized and mixed by RERANK_LOCAL_BM25_WEIGHT. No LLM call.
+    Chunk embeddings come from the embedding cache, missing ones from the retrieval backend.
+    """
+    name = "local"
+
+    @property
+    def cache_id(self) -> str:
+        return f"local:{self.bm25_weight}:{self.k1}:{self.b}"
+
+    def __init__(self, bm25_weight: float, k1: float = 1.2, b: float = 0.75):
+        self.bm25_weight = bm25_weight
+        self.k1 = k1
+        self.b = b
+
+    def bm25_scores(self, question: str, texts: List[str]) -> np.ndarray:
+        """Okapi BM25 with document frequencies taken from the candidate set itself."""
+        terms = list(dict.fromkeys(_tokenize(question)))
+        if not terms or not texts:
+            return np.zeros(len(texts), dtype=np.float32)
+        column = {term: i for i, term in enumerate(terms)}
+        tf = np.zeros((len(texts), len(terms)), dtype=np.float32)
+        lengths = np.empty(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _tokenize(text)
+            lengths[row] = len(tokens)
+            for token in tokens:
+                col = column.get(token)
+                if col is not None:
+                    tf[row, col] += 1
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((len(texts) - df + 0.5) / (df + 0.5))
+        avg_length = max(float(lengths.mean()), 1.0)
+        saturation = tf + self.k1 * (1 - self.b + self.b * lengths[:, None] / avg_length)
+        return (idf * tf * (self.k1 + 1) / saturation).sum(axis=1)
+
+    @staticmethod
+    def cosine_scores(query_embedding: List[float], embeddings: List[Optional[List[float]]]) -> Optional[np.ndarray]:
+        """Cosine per candidate; candidates without an embedding get the median of the others."""
+        present = [i for i, e in enumerate(embeddings) if e is not None]
+        if not present:
+            return None
+        matrix = np.asarray([embeddings[i] for i in present], dtype=np.float32)
+        q = np.asarray(query_embedding, dtype=np.float32)
+        if matrix.shape[1] != q.shape[0]:
+            return None
+        norms = np.linalg.norm(matrix, axis=1) * max(float(np.linalg.norm(q)), 1e-12)
+        sims = (matrix @ q) / np.maximum(norms, 1e-12)
+        scores = np.full(len(embeddings), float(np.median(sims)), dtype=np.float32)
+        scores[present] = sims
+        return scores
+
+    async def chunk_embeddings(self, candidates: List[Dict]) -> List[Optional[List[float]]]:
+        # Ingestion cached every chunk vector under its normalized text
+        texts = [embedding_cache.normalize(c.get("content", "")) for c in candidates]
+        if embedding_cache.db_path:
+            results = await asyncio.to_thread(embedding_cache.get_many, EMBEDDING_CACHE_KEY, texts)
+        else:
+            results = embedding_cache.get_many(EMBEDDING_CACHE_KEY, texts)
+
+        missing = {c["id"]: i for i, c in enumerate(candidates) if results[i] is None and c.get("id")}
+        if missing:
+            try:
+                found = await get_retrieval_backend().chunk_embeddings(list(missing))
+                for chunk_id, embedding in found.items():
+                    if chunk_id in missing:
+                        results[missing[chunk_id]] = embedding
+            except Exception as e:
+                log.warning("rerank.chunk_embeddings_failed", error=str(e), fallback="bm25_only")
+        return results
+
+    def score(self, question: str, candidates: List[Dict], query_embedding: Optional[List[float]], embeddings: List[Optional[List[float]]]) -> np.ndarray:
+        bm25 = _min_max(self.bm25_scores(question, [c.get("content", "") for c in candidates]))
+        cosine = self.cosine_scores(query_embedding, embeddings) if query_embedding is not None else None
+        if cosine is None:
+            return bm25
+        return self.bm25_weight * bm25 + (1 - self.bm25_weight) * _min_max(cosine)
+
+    async def rank(self, question: str, candidates: List[Dict], top_n: int, query_embedding: Optional[List[float]] = None) -> List[int]:
+        t0 = time.perf_counter()
+        embeddings = await self.chunk_embeddings(candidates) if query_embedding is not None else [None] * len(candidates)
+        scores = self.score(question, candidates, query_embedding, embeddings)
+        # Stable sort keeps the retrieval order for ties
+        order = np.argsort(-scores, kind="stable")[:top_n]
+        log.info("rerank.done", mode=self.name, candidates=len(candidates), ms=round((time.perf_counter() - t0) * 1000, 2))
+        return [int(i) for i in order]
+
+RERANKERS = {
+    "llm": lambda: LLMReranker(),
+    "local": lambda: LocalReranker(Config.RERANK_LOCAL_BM25_WEIGHT)
+}
+
+_rerankers: Dict[str, Reranker] = {}
+
+def get_reranker(mode: Optional[str] = None) -> Reranker:
+    """Reranker for mode (default RERANK_MODE): "llm" or "local"."""
+    mode = mode or Config.RERANK_MODE
+    if mode not in RERANKERS:
+        raise ValueError(f"Unknown RERANK_MODE: {mode}")
+    if mode not in _rerankers:
+        _rerankers[mode] = RERANKERS[mode]()
+    return _rerankers[mode]
+
+async def rerank_async(question: str, candidates: List[Dict], top_n: int = 5, query_embedding: Optional[List[float]] = None) -> List[Dict]:
+    """
+    Async rerank through the configured reranker (RERANK_MODE). Rankings are cached per
+    question and ordered candidate set. Reranker errors are re-raised, so the caller can fall
+    back to the retrieval order and report the answer as degraded (see rerank_fallback in main).
+    """
+    if not Config.RERANK_ENABLED:
         return candidates[:top_n]
+
+    if not candidates:
+        return []
+
+    reranker = get_reranker()
+    candidate_ids = [(str(c.get("source_id")), c.get("chunk_index")) for c in candidates]
+    ranked = rerank_cache.get(question, candidate_ids, reranker.cache_id, top_n)
+    if ranked is not None:
+        log.info("rerank.cache_hit", mode=reranker.name, candidates=len(candidates))
+        return [candidates[i] for i in ranked]
+
+    log.info("rerank.start", mode=reranker.name, candidates=len(candidates), question=question)
+    try:
+        ranked = await reranker.rank(question, candidates, top_n, query_embedding)
+    except Exception as e:
+        log.warning("rerank.failed", mode=reranker.name, error=str(e))
+        raise
+
+    rerank_cache.set(question, candidate_ids, reranker.cache_id, top_n, ranked)
+    return [candidates[i] for i in ranked]
@@ -0,0 +1,203 @@
+import asyncio
+from typing import Dict, List, Optional, Sequence
+from backend.config import Config
+from backend.services.storage import get_supabase_client, parse_vector
+from backend.services.vector_store import LocalVectorStore
+from backend.services.quantization import CoarseCodec
+
+MATCH_THRESHOLD = 0.3  # Minimum cosine similarity of semantic matches
+INSERT_BATCH_SIZE = 50  # Rows per insert, keeps PostgREST payloads small
+LOOKUP_BATCH_SIZE = 50  # Hashes per lookup, keeps PostgREST URLs short
+LOCAL_INLINE_ROWS = 2000  # Up to about a millisecond of search runs on the event loop, larger stores in a thread
+SUPABASE_COARSE_DIMENSIONS = 256  # Hard-coded in the index and match_chunks_coarse of sql/06
+
+class RetrievalBackend:
+    """
+    Where chunks are stored and how they are searched. Search results are dicts with id,
+    source_id, chunk_index, content and similarity (optionally filename). The /chat calls
+    are async; the ingestion calls block, they run in the indexing worker threads.
+    """
+    name = "none"
+    has_hybrid_search = False  # Offers hybrid_search (both legs and RRF in one call)
+
+    async def semantic_search(self, query_embedding: List[float], source_ids: Optional[List[str]], match_count: int,
+                              match_threshold: float = MATCH_THRESHOLD) -> List[Dict]:
+        raise NotImplementedError
+
+    async def keyword_search(self, query_text: str, source_ids: Optional[List[str]], match_count: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def hybrid_search(self, query_text: str, query_embedding: List[float], source_ids: Optional[List[str]], match_count: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def chunk_embeddings(self, chunk_ids: List[str]) -> Dict[str, List[float]]:
+        """Stored embeddings by chunk id (missing ids are left out)."""
+        raise NotImplementedError
+
+    def lookup_embeddings(self, content_hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """Stored embeddings by chunk content hash, across all sources."""
+        raise NotImplementedError
+
+    def upsert_chunks(self, records: List[Dict], filename: Optional[str] = None):
+        """Stores chunk records (source_id, chunk_index, content, content_hash, embedding), keyed by (source_id, chunk_index)."""
+        raise NotImplementedError
+
+    def delete_chunks(self, source_id: str, from_index: int = 0):
+        """Deletes the chunks of a source with chunk_index >= from_index."""
+        raise NotImplementedError
+
+    def delete_source(self, source_id: str):
+        """Called after a source was deleted from the sources table."""
+        raise NotImplementedError
+
+class SupabaseBackend(RetrievalBackend):
+    """The chunks table and the search RPCs of sql/ (one network round trip per call)."""
+    name = "supabase"
+    has_hybrid_search = True
+
+    def __init__(self):
+        codec = _coarse_codec()
+        if not codec.enabled:
+            return
+        # sql/06 only implements halfvec over the leading 256 dimensions; anything else would silently search that instead
+        if codec.quantization != "halfvec" or codec.dimensions != SUPABASE_COARSE_DIMENSIONS:
+            raise ValueError(
+                f"Coarse search {codec} is not supported by the supabase backend: set VECTOR_COARSE_DIMENSIONS="
+                f"{SUPABASE_COARSE_DIMENSIONS} and VECTOR_COARSE_QUANTIZATION=halfvec (see sql/06), or use RETRIEVAL_BACKEND=local"
+            )
+        # The hybrid_search RPC (sql/04) runs its own full-precision semantic leg, coarse search would be skipped
+        if Config.HYBRID_SEARCH_RPC:
+            raise ValueError("Coarse search is not supported with HYBRID_SEARCH_RPC=true: disable one of them")
+
+    async def semantic_search(self, query_embedding: List[float], source_ids: Optional[List[str]], match_count: int,
+                              match_threshold: float = MATCH_THRESHOLD) -> List[Dict]:
+        supabase = get_supabase_client()
+        params = {
+            "query_embedding": query_embedding,
+            "match_threshold": match_threshold,
+            "match_count": match_count,
+            "filter_source_ids": source_ids or None
+        }
+        if Config.VECTOR_EF_SEARCH:
+            params["ef_search"] = Config.VECTOR_EF_SEARCH
+        function = "match_chunks"
+        if _coarse_codec().enabled:
+            # sql/06: halfvec shortlist on the leading dimensions, rescored with the full vectors
+            function = "match_chunks_coarse"
+            params["candidate_count"] = match_count * max(1, Config.VECTOR_RESCORE_FACTOR)
+        res = await asyncio.to_thread(lambda: supabase.rpc(function, params).execute())
+        return res.data or []
+
+    async def keyword_search(self, query_text: str, source_ids: Optional[List[str]], match_count: int) -> List[Dict]:
+        supabase = get_supabase_client()
+        params = {
+            "query_text": query_text,
+            "match_count": match_count,
+            "filter_source_ids": source_ids or None
+        }
+        res = await asyncio.to_thread(lambda: supabase.rpc("match_chunks_keyword", params).execute())
+        return res.data or []
+
+    async def hybrid_search(self, query_text: str, query_embedding: List[float], source_ids: Optional[List[str]], match_count: int) -> List[Dict]:
+        """Single round trip: sql/04_hybrid_search_rpc.sql, results already carry `filename`."""
+        supabase = get_supabase_client()
+        params = {
+            "query_embedding": query_embedding,
+            "query_text": query_text,
+            "match_count": match_count,
+            "candidate_count": match_count * 2, # Same per-leg depth as the two-RPC path
+            "match_threshold": MATCH_THRESHOLD,
+            "rrf_k": Config.RRF_K,
+            "filter_source_ids": source_ids or None
+        }
+        if Config.VECTOR_EF_SEARCH:
+            params["ef_search"] = Config.VECTOR_EF_SEARCH
+        res = await asyncio.to_thread(lambda: supabase.rpc("hybrid_search", params).execute())
+        return res.data or []
+
+    async def chunk_embeddings(self, chunk_ids: List[str]) -> Dict[str, List[float]]:
+        supabase = get_supabase_client()
+        res = await asyncio.to_thread(lambda: supabase.table("chunks").select("id, embedding").in_("id", chunk_ids).execute())
+        return {row["id"]: parse_vector(row["embedding"]) for row in res.data or [] if row.get("embedding") is not None}
+
+    def lookup_embeddings(self, content_hashes: Sequence[str]) -> Dict[str, List[float]]:
+        supabase = get_supabase_client()
+        unique = list(dict.fromkeys(content_hashes))
+        found = {}
+        for i in range(0, len(unique), LOOKUP_BATCH_SIZE):
+            res = supabase.table("chunks").select("content_hash, embedding").in_("content_hash", unique[i:i+LOOKUP_BATCH_SIZE]).execute()
+            for row in res.data or []:
+                if row.get("embedding") is not None:
+                    found.setdefault(row["content_hash"], parse_vector(row["embedding"]))
+        return found
+
+    def upsert_chunks(self, records: List[Dict], filename: Optional[str] = None):
+        # Filenames come from the sources table
+        supabase = get_supabase_client()
+        for i in range(0, len(records), INSERT_BATCH_SIZE):
+            supabase.table("chunks").upsert(records[i:i+INSERT_BATCH_SIZE], on_conflict="source_id,chunk_index").execute()
+
+    def delete_chunks(self, source_id: str, from_index: int = 0):
+        supabase = get_supabase_client()
+        supabase.table("chunks").delete().eq("source_id", source_id).gte("chunk_index", from_index).execute()
+
+    def delete_source(self, source_id: str):
+        pass  # Chunks go with the source row (on delete cascade)
+
+class LocalBackend(RetrievalBackend):
+    """
+    LocalVectorStore in RETRIEVAL_LOCAL_DIR: no network hop per search. Results carry the
+    filename, so /chat needs no sources lookup either.
+    """
+    name = "local"
+
+    def __init__(self, store: LocalVectorStore):
+        self.store = store
+
+    async def _run(self, fn, *args):
+        # Sub-millisecond on small stores: cheaper than a thread hop
+        if self.store.rows <= LOCAL_INLINE_ROWS:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def semantic_search(self, query_embedding: List[float], source_ids: Optional[List[str]], match_count: int,
+                              match_threshold: float = MATCH_THRESHOLD) -> List[Dict]:
+        return await self._run(self.store.search, query_embedding, source_ids, match_count, match_threshold)
+
+    async def keyword_search(self, query_text: str, source_ids: Optional[List[str]], match_count: int) -> List[Dict]:
+        return await self._run(self.store.keyword_search, query_text, source_ids, match_count)
+
+    async def chunk_embeddings(self, chunk_ids: List[str]) -> Dict[str, List[float]]:
+        return self.store.embeddings_by_id(chunk_ids)
+
+    def lookup_embeddings(self, content_hashes: Sequence[str]) -> Dict[str, List[float]]:
+        return self.store.embeddings_by_hash(content_hashes)
+
+    def upsert_chunks(self, records: List[Dict], filename: Optional[str] = None):
+        self.store.upsert(records, {str(r["source_id"]): filename for r in records})
+
+    def delete_chunks(self, source_id: str, from_index: int = 0):
+        self.store.delete(source_id, from_index)
+
+    def delete_source(self, source_id: str):
+        self.store.delete(source_id)
+
+def _coarse_codec() -> CoarseCodec:
+    return CoarseCodec(Config.VECTOR_COARSE_DIMENSIONS, Config.VECTOR_COARSE_QUANTIZATION)
+
+RETRIEVAL_BACKENDS = {
+    "supabase": lambda: SupabaseBackend(),
+    "local": lambda: LocalBackend(LocalVectorStore(Config.RETRIEVAL_LOCAL_DIR, Config.RETRIEVAL_LOCAL_MAX_SEGMENTS,
+                                                   _coarse_codec(), Config.VECTOR_RESCORE_FACTOR))
+}
+
+_backends: Dict[str, RetrievalBackend] = {}
+
+def get_retrieval_backend(name: Optional[str] = None) -> RetrievalBackend:
+    """Retrieval backend for name (default RETRIEVAL_BACKEND): "supabase" or "local"."""
+    name = name or Config.RETRIEVAL_BACKEND
+    if name not in RETRIEVAL_BACKENDS:
+        raise ValueError(f"Unknown RETRIEVAL_BACKEND: {name}")
+    if name not in _backends:
+        _backends[name] = RETRIEVAL_BACKENDS[name]()
+    return _backends[name]
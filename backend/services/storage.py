@@ -1,4 +1,6 @@
 import os
+import json
+from typing import List
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -14,3 +16,7 @@ supabase: Client = create_client(url, key)
 
 def get_supabase_client() -> Client:
     return supabase
+
+def parse_vector(value) -> List[float]:
+    # PostgREST returns pgvector columns as their text form "[0.1,0.2,...]"
+    return json.loads(value) if isinstance(value, str) else value
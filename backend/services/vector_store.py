@@ -0,0 +1,456 @@
+import os
+import re
+import json
+import uuid
+import fcntl
+import shutil
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from backend.services.quantization import CoarseCodec
+from backend.services.logs import get_logger
+
+log = get_logger("vector_store")
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Left out of keyword queries, like the english text search configuration does in Postgres
+STOPWORDS = frozenset(
+    "a an and are as at be but by can did do does for from had has have how i if in into is it its "
+    "me my no not of on or our so than that the their them then there these they this to was we "
+    "were what when where which who why will with would you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+class Segment:
+    """
+    One immutable batch of chunks on disk: vectors.npy (float32, unit length, memory-mapped)
+    and rows.json (ids, sources, chunk indexes, content hashes, texts, filenames). Rows are
+    sorted by (source_id, chunk_index), so every source is one contiguous row range.
+    With a coarse codec, coarse.npy (and coarse_scales.npy for int8) hold the first-pass codes.
+    """
+    def __init__(self, path: str, seq: int):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.seq = seq
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        with open(os.path.join(path, "rows.json")) as f:
+            rows = json.load(f)
+        self.ids: List[str] = rows["ids"]
+        self.source_ids: List[str] = rows["source_ids"]
+        self.chunk_index = np.asarray(rows["chunk_index"], dtype=np.int64)
+        self.hashes: List[Optional[str]] = rows["content_hashes"]
+        self.contents: List[str] = rows["contents"]
+        self.filenames: Dict[str, Optional[str]] = rows["filenames"]
+        self.ranges: Dict[str, Tuple[int, int]] = {source_id: (start, end) for source_id, start, end in rows["ranges"]}
+        self.coarse_spec: Optional[Dict[str, Any]] = rows.get("coarse")
+        self.coarse: Optional[np.ndarray] = None
+        self.coarse_scales: Optional[np.ndarray] = None
+        if self.coarse_spec:
+            self.coarse = np.load(os.path.join(path, "coarse.npy"), mmap_mode="r")
+            if os.path.exists(os.path.join(path, "coarse_scales.npy")):
+                self.coarse_scales = np.load(os.path.join(path, "coarse_scales.npy"))
+        self._lock = threading.Lock()
+        self._keyword_index: Optional[Tuple[Dict[str, Tuple[np.ndarray, np.ndarray]], np.ndarray]] = None
+        self._rows_by_id: Optional[Dict[str, int]] = None
+        self._rows_by_hash: Optional[Dict[str, List[int]]] = None
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def write(path: str, records: List[Dict[str, Any]], filenames: Dict[str, Optional[str]], codec: Optional[CoarseCodec] = None) -> int:
+        """Writes records (source_id, chunk_index, content, content_hash, embedding, optional id) as a segment. Returns the row count."""
+        records = sorted(records, key=lambda r: (str(r["source_id"]), int(r["chunk_index"])))
+        vectors = np.asarray([r["embedding"] for r in records], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        ranges = []
+        for i, record in enumerate(records):
+            source_id = str(record["source_id"])
+            if ranges and ranges[-1][0] == source_id:
+                ranges[-1][2] = i + 1
+            else:
+                ranges.append([source_id, i, i + 1])
+        rows = {
+            "ids": [str(r.get("id") or uuid.uuid4()) for r in records],
+            "source_ids": [str(r["source_id"]) for r in records],
+            "chunk_index": [int(r["chunk_index"]) for r in records],
+            "content_hashes": [r.get("content_hash") for r in records],
+            "contents": [r.get("content", "") for r in records],
+            "filenames": {source_id: filenames.get(source_id) for source_id, _, _ in ranges},
+            "ranges": ranges,
+            "coarse": codec.spec if codec and codec.enabled else None
+        }
+        os.makedirs(path)
+        np.save(os.path.join(path, "vectors.npy"), vectors)
+        if rows["coarse"]:
+            codes, scales = codec.encode(vectors)
+            np.save(os.path.join(path, "coarse.npy"), codes)
+            if scales is not None:
+                np.save(os.path.join(path, "coarse_scales.npy"), scales)
+        with open(os.path.join(path, "rows.json"), "w") as f:
+            json.dump(rows, f)
+        return len(records)
+
+    def row_ranges(self, source_ids: Optional[Sequence[str]]) -> List[Tuple[int, int]]:
+        """Row ranges to search: everything, or the ranges of the filtered sources."""
+        if not source_ids:
+            return [(0, self.count)] if self.count else []
+        return [self.ranges[s] for s in source_ids if s in self.ranges]
+
+    def row(self, row: int, similarity: float) -> Dict[str, Any]:
+        source_id = self.source_ids[row]
+        return {
+            "id": self.ids[row],
+            "source_id": source_id,
+            "chunk_index": int(self.chunk_index[row]),
+            "content": self.contents[row],
+            "similarity": similarity,
+            "filename": self.filenames.get(source_id)
+        }
+
+    def keyword_index(self) -> Tuple[Dict[str, Tuple[np.ndarray, np.ndarray]], np.ndarray]:
+        """Inverted index (term -> sorted rows, term frequencies) and token counts per row, built on first use."""
+        with self._lock:
+            if self._keyword_index is None:
+                postings = defaultdict(lambda: ([], []))
+                lengths = np.empty(self.count, dtype=np.float32)
+                for row, content in enumerate(self.contents):
+                    tokens = tokenize(content)
+                    lengths[row] = len(tokens)
+                    for term, tf in Counter(tokens).items():
+                        rows, tfs = postings[term]
+                        rows.append(row)
+                        tfs.append(tf)
+                index = {term: (np.asarray(rows, dtype=np.int64), np.asarray(tfs, dtype=np.float32)) for term, (rows, tfs) in postings.items()}
+                self._keyword_index = (index, lengths)
+            return self._keyword_index
+
+    def rows_by_id(self) -> Dict[str, int]:
+        with self._lock:
+            if self._rows_by_id is None:
+                self._rows_by_id = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+            return self._rows_by_id
+
+    def rows_by_hash(self) -> Dict[str, List[int]]:
+        with self._lock:
+            if self._rows_by_hash is None:
+                rows = defaultdict(list)
+                for row, content_hash in enumerate(self.hashes):
+                    if content_hash:
+                        rows[content_hash].append(row)
+                self._rows_by_hash = dict(rows)
+            return self._rows_by_hash
+
+class StoreState:
+    """Immutable view used by one search: the segments (oldest first) and which of their rows are live."""
+    def __init__(self, segments: List[Segment], live: Dict[str, np.ndarray]):
+        self.segments = segments
+        self.live = live
+        self._keyword_stats: Optional[Tuple[int, float]] = None
+
+    def keyword_stats(self) -> Tuple[int, float]:
+        """Live row count and average token count, for BM25."""
+        if self._keyword_stats is None:
+            rows, tokens = 0, 0.0
+            for segment in self.segments:
+                live = self.live[segment.name]
+                rows += int(live.sum())
+                tokens += float(segment.keyword_index()[1][live].sum())
+            self._keyword_stats = (rows, tokens / rows if rows else 0.0)
+        return self._keyword_stats
+
+def _live_masks(segments: List[Segment], tombstones: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    A row is dead when a newer segment has the same (source_id, chunk_index), or a tombstone
+    written after its segment covers it (same source, chunk_index >= from_index).
+    """
+    live = {segment.name: np.ones(segment.count, dtype=bool) for segment in segments}
+    by_source = defaultdict(list)
+    for segment in segments:
+        for source_id, (start, end) in segment.ranges.items():
+            by_source[source_id].append((segment, start, end))
+
+    for parts in by_source.values():
+        if len(parts) < 2:
+            continue
+        newer = np.empty(0, dtype=np.int64)
+        for segment, start, end in reversed(parts):
+            indexes = segment.chunk_index[start:end]
+            if newer.size:
+                live[segment.name][start:end] &= ~np.isin(indexes, newer)
+            newer = np.union1d(newer, indexes)
+
+    for tombstone in tombstones:
+        for segment, start, end in by_source.get(tombstone["source_id"], []):
+            if segment.seq <= tombstone["seq"]:
+                live[segment.name][start:end] &= segment.chunk_index[start:end] < tombstone["from_index"]
+    return live
+
+class LocalVectorStore:
+    """
+    In-process chunk store for small and medium corpora, shared through a directory by every
+    API and worker process on the host.
+
+    Writes append an immutable segment (one per ingestion window) and never touch existing
+    ones: a re-indexed chunk supersedes its older copy, deletes add a tombstone. manifest.json
+    lists the live segments and tombstones and is replaced atomically under an flock, so
+    readers only stat it per search and reload when it changed. Above max_segments the two
+    smallest neighbouring segments are merged, dropping dead rows.
+
+    Semantic search is a NumPy dot product over the memory-mapped unit vectors of each
+    segment (restricted to the row ranges of the filtered sources), keyword search is BM25
+    over an inverted index requiring all query terms, like websearch_to_tsquery does.
+    With an enabled codec, semantic search scans the smaller coarse codes for
+    match_count * rescore_factor candidates and rescores only those at full precision;
+    segments written with another codec (until they are merged) are searched exactly.
+    """
+    def __init__(self, directory: str, max_segments: int = 16, codec: Optional[CoarseCodec] = None, rescore_factor: int = 4):
+        self.directory = directory
+        self.max_segments = max(1, max_segments)
+        self.codec = codec or CoarseCodec()
+        self.rescore_factor = max(1, rescore_factor)
+        os.makedirs(directory, exist_ok=True)
+        self._manifest_path = os.path.join(directory, "manifest.json")
+        self._lock_path = os.path.join(directory, "lock")
+        self._refresh_lock = threading.Lock()
+        self._version: Optional[Tuple[int, int, int]] = None
+        self._segments: Dict[str, Segment] = {}
+        self._state = StoreState([], {})
+
+    @contextmanager
+    def _write_lock(self):
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"next_seq": 1, "segments": [], "tombstones": []}
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _manifest_version(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self._manifest_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def refresh(self, force: bool = False) -> StoreState:
+        """Current state, reloaded when another process (or this one) changed the manifest."""
+        version = self._manifest_version()
+        if version == self._version and not force:
+            return self._state
+        with self._refresh_lock:
+            for _ in range(3):
+                version = self._manifest_version()
+                if version == self._version and not force:
+                    return self._state
+                manifest = self._read_manifest()
+                try:
+                    segments = [
+                        self._segments.get(entry["name"]) or Segment(os.path.join(self.directory, entry["name"]), entry["seq"])
+                        for entry in manifest["segments"]
+                    ]
+                except FileNotFoundError:
+                    continue  # Merged away since the manifest was read
+                self._segments = {segment.name: segment for segment in segments}
+                self._state = StoreState(segments, _live_masks(segments, manifest["tombstones"]))
+                self._version = version
+                break
+            return self._state
+
+    # --- Writes (ingestion worker threads and processes) ---
+
+    def upsert(self, records: List[Dict[str, Any]], filenames: Optional[Dict[str, Optional[str]]] = None):
+        """Adds records as a new segment; existing (source_id, chunk_index) rows are superseded."""
+        # Last record wins within the batch, like consecutive upserts
+        records = list({(str(r["source_id"]), int(r["chunk_index"])): r for r in records}.values())
+        if not records:
+            return
+        with self._write_lock():
+            manifest = self._read_manifest()
+            seq = manifest["next_seq"]
+            name = f"seg_{seq:010d}"
+            rows = Segment.write(os.path.join(self.directory, name), records, filenames or {}, self.codec)
+            manifest["segments"].append({"seq": seq, "name": name, "rows": rows})
+            manifest["next_seq"] = seq + 1
+            self._write_manifest(manifest)
+            self._compact(manifest)
+        self.refresh(force=True)
+
+    def delete(self, source_id: str, from_index: int = 0):
+        """Deletes the chunks of a source with chunk_index >= from_index."""
+        with self._write_lock():
+            state = self.refresh(force=True)
+            if not any(
+                source_id in segment.ranges and segment.chunk_index[segment.ranges[source_id][1] - 1] >= from_index
+                for segment in state.segments
+            ):
+                return  # Nothing stored at or beyond from_index
+            manifest = self._read_manifest()
+            manifest["tombstones"].append({"source_id": source_id, "from_index": from_index, "seq": manifest["next_seq"] - 1})
+            self._write_manifest(manifest)
+        self.refresh(force=True)
+
+    def _compact(self, manifest: Dict[str, Any]):
+        """Merges the smallest neighbouring pair of segments until at most max_segments are left (write lock held)."""
+        removed = []
+        while len(manifest["segments"]) > self.max_segments:
+            # Forced: the manifest signature (inode, mtime, size) can repeat within one timestamp tick
+            state = self.refresh(force=True)
+            segments = {segment.name: segment for segment in state.segments}
+            entries = manifest["segments"]
+            i = min(range(len(entries) - 1), key=lambda i: entries[i]["rows"] + entries[i + 1]["rows"])
+            older, newer = segments[entries[i]["name"]], segments[entries[i + 1]["name"]]
+
+            records, filenames = [], {}
+            for segment in (older, newer):
+                for row in np.flatnonzero(state.live[segment.name]):
+                    record = segment.row(int(row), 0.0)
+                    record["content_hash"] = segment.hashes[row]
+                    record["embedding"] = segment.vectors[row]
+                    records.append(record)
+                    filenames[record["source_id"]] = record["filename"]
+
+            # The merged segment takes the newer sequence number: rows of the older one that
+            # tombstones in between would have hidden were dropped above
+            merged = []
+            if records:
+                name = f"seg_{newer.seq:010d}_{manifest['next_seq']}"
+                manifest["next_seq"] += 1
+                rows = Segment.write(os.path.join(self.directory, name), records, filenames, self.codec)
+                merged = [{"seq": newer.seq, "name": name, "rows": rows}]
+            manifest["segments"] = entries[:i] + merged + entries[i + 2:]
+            # Tombstones older than every segment cannot hide anything anymore
+            oldest = min((entry["seq"] for entry in manifest["segments"]), default=manifest["next_seq"])
+            manifest["tombstones"] = [t for t in manifest["tombstones"] if t["seq"] >= oldest]
+            self._write_manifest(manifest)
+            removed += [older.path, newer.path]
+            log.info("vector_store.merged", segments=[older.name, newer.name], rows=len(records), total_segments=len(manifest["segments"]))
+        for path in removed:
+            # Readers that still map these files keep them until they refresh
+            shutil.rmtree(path, ignore_errors=True)
+
+    # --- Reads ---
+
+    @property
+    def rows(self) -> int:
+        return sum(segment.count for segment in self.refresh().segments)
+
+    def search(self, query_embedding: Sequence[float], source_ids: Optional[Sequence[str]], match_count: int, match_threshold: float) -> List[Dict[str, Any]]:
+        """Top match_count live chunks by cosine similarity, at least match_threshold."""
+        state = self.refresh()
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+        q_coarse = self.codec.truncate(q)
+        hits = []
+        for segment in state.segments:
+            if segment.vectors.shape[1] != q.shape[0]:
+                raise ValueError(f"Query embedding has {q.shape[0]} dimensions, {segment.name} has {segment.vectors.shape[1]}")
+            live = state.live[segment.name]
+            two_stage = self.codec.enabled and segment.coarse_spec == self.codec.spec
+            for start, end in segment.row_ranges(source_ids):
+                if two_stage:
+                    scales = segment.coarse_scales[start:end] if segment.coarse_scales is not None else None
+                    rows = start + self.codec.shortlist(segment.coarse[start:end], scales, q_coarse, match_count * self.rescore_factor, live[start:end])
+                    sims = segment.vectors[rows] @ q
+                else:
+                    rows = np.arange(start, end)
+                    sims = segment.vectors[start:end] @ q
+                    sims[~live[start:end]] = -np.inf
+                k = min(match_count, rows.size)
+                if k <= 0:
+                    continue
+                top = np.argpartition(-sims, k - 1)[:k]
+                hits += [(float(sims[i]), segment, int(rows[i])) for i in top if sims[i] >= match_threshold]
+        hits.sort(key=lambda hit: -hit[0])
+        return [segment.row(row, score) for score, segment, row in hits[:match_count]]
+
+    def keyword_search(self, query_text: str, source_ids: Optional[Sequence[str]], match_count: int, k1: float = 1.2, b: float = 0.75) -> List[Dict[str, Any]]:
+        """Top match_count live chunks containing every query term, by BM25."""
+        terms = [t for t in dict.fromkeys(tokenize(query_text)) if t not in STOPWORDS]
+        state = self.refresh()
+        if not terms or not state.segments:
+            return []
+        total_rows, avg_length = state.keyword_stats()
+
+        df = np.zeros(len(terms), dtype=np.float64)
+        for segment in state.segments:
+            index, _ = segment.keyword_index()
+            live = state.live[segment.name]
+            for i, term in enumerate(terms):
+                if term in index:
+                    df[i] += live[index[term][0]].sum()
+        if not df.all():
+            return []
+        idf = np.log1p((total_rows - df + 0.5) / (df + 0.5))
+
+        hits = []
+        for segment in state.segments:
+            index, lengths = segment.keyword_index()
+            postings = [index.get(term) for term in terms]
+            if any(p is None for p in postings):
+                continue
+            rows = postings[0][0]
+            for p_rows, _ in sorted(postings[1:], key=lambda p: len(p[0])):
+                rows = np.intersect1d(rows, p_rows, assume_unique=True)
+            rows = rows[state.live[segment.name][rows]]
+            if source_ids:
+                allowed = np.zeros(segment.count, dtype=bool)
+                for start, end in segment.row_ranges(source_ids):
+                    allowed[start:end] = True
+                rows = rows[allowed[rows]]
+            if not rows.size:
+                continue
+            norm = k1 * (1 - b + b * lengths[rows] / max(avg_length, 1.0))
+            scores = np.zeros(rows.size, dtype=np.float64)
+            for weight, (p_rows, p_tfs) in zip(idf, postings):
+                tf = p_tfs[np.searchsorted(p_rows, rows)]
+                scores += weight * tf * (k1 + 1) / (tf + norm)
+            k = min(match_count, rows.size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            hits += [(float(scores[i]), segment, int(rows[i])) for i in top]
+        hits.sort(key=lambda hit: -hit[0])
+        return [segment.row(row, score) for score, segment, row in hits[:match_count]]
+
+    def embeddings_by_id(self, chunk_ids: Sequence[str]) -> Dict[str, List[float]]:
+        state = self.refresh()
+        found = {}
+        for segment in state.segments:
+            rows = segment.rows_by_id()
+            for chunk_id in chunk_ids:
+                row = rows.get(chunk_id)
+                if row is not None and state.live[segment.name][row]:
+                    found[chunk_id] = segment.vectors[row].tolist()
+        return found
+
+    def embeddings_by_hash(self, content_hashes: Sequence[str]) -> Dict[str, List[float]]:
+        state = self.refresh()
+        found = {}
+        for segment in state.segments:
+            rows = segment.rows_by_hash()
+            live = state.live[segment.name]
+            for content_hash in content_hashes:
+                if content_hash in found:
+                    continue
+                for row in rows.get(content_hash, ()):
+                    if live[row]:
+                        found[content_hash] = segment.vectors[row].tolist()
+                        break
+        return found
@@ -0,0 +1,127 @@
+import os
+import signal
+import socket
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+from backend.config import Config
+from backend.services.jobs import Job, LeaseLostError, job_queue
+from backend.services.ingestion import process_document, shutdown_process_pool
+from backend.services.logs import get_logger
+from backend.services.metrics import metrics
+
+log = get_logger("worker")
+
+# Job kind -> handler. Handlers raise to request a retry.
+HANDLERS: Dict[str, Callable[[Job], None]] = {
+    "index_document": process_document,
+}
+
+class JobWorker:
+    """
+    Pool of threads that claim jobs from the SQLite queue and run their handlers. While a handler
+    runs, a heartbeat thread extends the job's lease every third of JOB_LEASE_SECONDS, so a slow
+    step (a long PDF page range, embeddings queued behind chat traffic) does not let another
+    worker claim the same job.
+    """
+    def __init__(self, concurrency: int = 1):
+        self.concurrency = max(1, concurrency)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @contextmanager
+    def _heartbeat(self, job: Job):
+        done = threading.Event()
+
+        def beat():
+            while not done.wait(max(1.0, Config.JOB_LEASE_SECONDS / 3)):
+                try:
+                    if not job_queue.heartbeat(job):
+                        log.warning("worker.lease_lost", worker=job.worker, job_id=job.id)
+                        return
+                except Exception as e:
+                    log.error("worker.heartbeat_failed", worker=job.worker, job_id=job.id, error=str(e))
+
+        thread = threading.Thread(target=beat, name=f"heartbeat-{job.id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def _run(self, name: str):
+        while not self._stop.is_set():
+            try:
+                job = job_queue.claim(name)
+            except Exception as e:
+                log.error("worker.claim_failed", worker=name, error=str(e))
+                self._stop.wait(Config.JOB_POLL_SECONDS)
+                continue
+
+            if job is None:
+                self._stop.wait(Config.JOB_POLL_SECONDS)
+                continue
+
+            handler = HANDLERS.get(job.kind)
+            log.info("worker.job_started", worker=name, job_id=job.id, kind=job.kind, attempt=job.attempts, max_attempts=job.max_attempts)
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler registered for job kind '{job.kind}'")
+                with self._heartbeat(job):
+                    handler(job)
+                if job_queue.complete(job):
+                    log.info("worker.job_done", worker=name, job_id=job.id)
+                else:
+                    log.warning("worker.lease_lost", worker=name, job_id=job.id, stage="complete")
+            except LeaseLostError:
+                log.warning("worker.lease_lost", worker=name, job_id=job.id, stage="progress")
+            except Exception as e:
+                log.exception("worker.job_failed", worker=name, job_id=job.id, error=str(e))
+                if not job_queue.fail(job, str(e)):
+                    log.warning("worker.lease_lost", worker=name, job_id=job.id, stage="fail")
+            finally:
+                # The handler stopped writing: a replacement of a cancelled job may start now
+                try:
+                    job_queue.release_cancelled(job)
+                except Exception as e:
+                    log.error("worker.release_failed", worker=name, job_id=job.id, error=str(e))
+
+    def start(self):
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, args=(f"{prefix}:{i}",), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        shutdown_process_pool()
+
+    def run_forever(self):
+        self.start()
+        # Process managers stop with SIGTERM: shut down like on Ctrl+C, so the extraction processes exit too.
+        # A job still running after the timeout is taken over by another worker when its lease expires.
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._stop.set())
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        log.info("worker.stopping")
+        self.stop(timeout=5)
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexing job worker")
+    parser.add_argument("--concurrency", type=int, default=Config.JOB_WORKER_CONCURRENCY, help="Jobs processed in parallel")
+    args = parser.parse_args()
+
+    log.info("worker.started", concurrency=args.concurrency, queue=Config.JOB_DB_PATH)
+    metrics.start()
+    JobWorker(args.concurrency).run_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import json
 import os
 
 # Backend API URL
@@ -87,15 +88,18 @@ if st.button("Clear Chat"):
     st.session_state.messages = []
     st.rerun()
 
+def render_sources(sources):
+    with st.expander("View Sources"):
+        for src in sources:
+            st.markdown(f"**{src['filename']}** (Similarity: {src['similarity']:.2f})")
+            st.text(src['chunk_text'])
+
 # Display Chat
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
         if "sources" in message:
-            with st.expander("View Sources"):
-                for src in message["sources"]:
-                    st.markdown(f"**{src['filename']}** (Similarity: {src['similarity']:.2f})")
-                    st.text(src['chunk_text'])
+            render_sources(message["sources"])
 
 # Chat Input
 if prompt := st.chat_input("Ask a question based on your documents..."):
@@ -104,33 +108,58 @@ if prompt := st.chat_input("Ask a question based on your documents..."):
         st.markdown(prompt)
         
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            try:
-                payload = {
-                    "question": prompt,
-                    "source_ids": selected_source_ids if selected_source_ids else None
-                }
-                
-                res = requests.post(f"{API_URL}/chat", json=payload)
-                
-                if res.status_code == 200:
-                    data = res.json()
-                    answer = data["answer"]
-                    sources = data["sources"]
-                    
-                    st.markdown(answer)
-                    with st.expander("View Sources"):
-                            for src in sources:
-                                st.markdown(f"**{src['filename']}** (Similarity: {src['similarity']:.2f})")
-                                st.text(src['chunk_text'])
-                    
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": answer,
-                        "sources": sources
-                    })
-                else:
-                    st.error(f"Error: {res.text}")
-            except Exception as e:
-                st.error(f"Connection error: {e}")
-
+        try:
+            payload = {
+                "question": prompt,
+                "source_ids": selected_source_ids if selected_source_ids else None
+            }
+            
+            stream_state = {"sources": [], "error": None}
+            # The answer streams above the sources, which are shown as soon as they arrive
+            answer_slot = st.container()
+            sources_slot = st.empty()
+            
+            def answer_tokens():
+                """Yields answer tokens from the /chat/stream Server-Sent Events."""
+                with requests.post(f"{API_URL}/chat/stream", json=payload, stream=True) as res:
+                    if res.status_code != 200:
+                        stream_state["error"] = res.text
+                        return
+                    event = None
+                    for line in res.iter_lines(decode_unicode=True):
+                        if line.startswith("event: "):
+                            event = line[len("event: "):]
+                        elif line.startswith("data: "):
+                            data = json.loads(line[len("data: "):])
+                            if event == "sources":
+                                stream_state["sources"] = data
+                                with sources_slot.container():
+                                    render_sources(data)
+                            elif event == "token":
+                                yield data["text"]
+                            elif event == "error":
+                                stream_state["error"] = data["detail"]
+            
+            with st.spinner("Searching documents..."):
+                tokens = answer_tokens()
+                first_token = next(tokens, None)
+            
+            def with_first_token():
+                if first_token is not None:
+                    yield first_token
+                yield from tokens
+            
+            answer = answer_slot.write_stream(with_first_token())
+            sources = stream_state["sources"]
+            
+            if stream_state["error"]:
+                sources_slot.empty()
+                st.error(f"Error: {stream_state['error']}")
+            else:
+                st.session_state.messages.append({
+                    "role": "assistant", 
+                    "content": answer,
+                    "sources": sources
+                })
+        except Exception as e:
+            st.error(f"Connection error: {e}")
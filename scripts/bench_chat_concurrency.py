@@ -0,0 +1,49 @@
+"""
+Concurrency benchmark for /chat against local fake OpenAI and Supabase servers.
+With a fully async request path, throughput should grow near-linearly with the
+number of concurrent chats until the connection pool or CPU saturates.
+
+    python scripts/bench_chat_concurrency.py --levels 1,2,4,8,16,32 --openai-latency-ms 200
+"""
+import argparse
+import asyncio
+import time
+import httpx
+from bench_stack import start_stack, stop_stack
+
+async def run_level(api_url: str, concurrency: int, requests_per_client: int) -> float:
+    """Runs `concurrency` clients issuing chats back to back. Returns requests/sec."""
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=api_url, timeout=120, limits=limits) as client:
+        async def worker(worker_id: int):
+            for i in range(requests_per_client):
+                resp = await client.post("/chat", json={"question": f"How does reranking work? ({worker_id}-{i})"})
+                resp.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        return concurrency * requests_per_client / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="/chat concurrency benchmark")
+    parser.add_argument("--levels", default="1,2,4,8,16,32")
+    parser.add_argument("--requests-per-client", type=int, default=5)
+    parser.add_argument("--openai-latency-ms", default="200", help="Latency spec, see scripts/fake_latency.py")
+    parser.add_argument("--supabase-latency-ms", default="20", help="Latency spec, see scripts/fake_latency.py")
+    args = parser.parse_args()
+
+    api_url, procs = start_stack(args.openai_latency_ms, args.supabase_latency_ms)
+    try:
+        asyncio.run(run_level(api_url, 1, 1))  # Warm up connections
+        baseline = None
+        print(f"{'concurrency':>11} | {'req/s':>8} | {'speedup':>7} | {'efficiency':>10}")
+        for level in [int(x) for x in args.levels.split(",")]:
+            rps = asyncio.run(run_level(api_url, level, args.requests_per_client))
+            baseline = baseline or rps / level
+            speedup = rps / baseline
+            print(f"{level:>11} | {rps:>8.2f} | {speedup:>7.2f} | {speedup / level:>9.0%}")
+    finally:
+        stop_stack(procs)
+
+if __name__ == "__main__":
+    main()
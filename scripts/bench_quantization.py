@@ -0,0 +1,151 @@
+"""
+Two-stage search benchmark: coarse first pass (truncated and/or halfvec/int8-quantized vectors,
+see backend/services/quantization.py) plus full-precision rescoring, against exact float32
+search. Reports first-pass memory per million chunks, latency and recall@K, in NumPy, as the
+local retrieval backend searches (the sql/06 path trades the same way inside Postgres).
+
+    python scripts/bench_quantization.py --rows 200000
+    python scripts/bench_quantization.py --configs int8@full,halfvec@256,none@512 --rescore-factors 2,4,10
+    python scripts/bench_quantization.py --store data/vectors     # real embeddings of the local backend
+    python scripts/bench_quantization.py --vectors embeddings.npy  # any (rows, dims) float32 matrix
+
+Synthetic vectors are clustered with per-dimension variance decaying by --decay, which mimics
+how Matryoshka-trained embeddings (text-embedding-3) front-load information; truncation recall
+on them is only indicative, measure on real embeddings before choosing dimensions.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.services.quantization import CoarseCodec
+
+DEFAULT_CONFIGS = "none@512,none@256,halfvec@full,int8@full,halfvec@256,int8@256,int8@512"
+
+def synthetic_vectors(rng: np.random.Generator, rows: int, dims: int, clusters: int, decay: float) -> np.ndarray:
+    """Clustered unit vectors whose variance falls off along the dimensions."""
+    scale = (np.arange(1, dims + 1, dtype=np.float32) ** -decay)
+    centers = rng.standard_normal((clusters, dims), dtype=np.float32) * scale
+    labels = rng.integers(0, clusters, size=rows)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((rows, dims), dtype=np.float32) * scale
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def store_vectors(directory: str) -> np.ndarray:
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    parts = [np.load(os.path.join(directory, entry["name"], "vectors.npy")) for entry in manifest["segments"]]
+    if not parts:
+        raise SystemExit(f"No segments in {directory}")
+    return np.concatenate(parts)
+
+def parse_config(spec: str) -> CoarseCodec:
+    quantization, _, dims = spec.partition("@")
+    return CoarseCodec(0 if dims in ("", "full") else int(dims), quantization)
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    return len(set(found.tolist()) & set(truth.tolist())) / len(truth)
+
+def summarize(latencies_ms):
+    ordered = sorted(latencies_ms)
+    return {
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 3),
+        "mean_ms": round(statistics.fmean(ordered), 3)
+    }
+
+def mb_per_million(bytes_per_vector: int) -> float:
+    return round(bytes_per_vector * 1_000_000 / 2**20, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Coarse + rescore vs exact vector search")
+    parser.add_argument("--rows", type=int, default=100_000, help="Synthetic corpus size")
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--decay", type=float, default=0.5, help="Per-dimension std ~ (i+1)^-decay of synthetic vectors")
+    parser.add_argument("--vectors", help="Benchmark on this .npy matrix instead of synthetic vectors")
+    parser.add_argument("--store", help="Benchmark on the vectors of a local retrieval store directory")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--configs", default=DEFAULT_CONFIGS, help="quantization@dimensions (none/halfvec/int8, number or full)")
+    parser.add_argument("--rescore-factors", default="4", help="Shortlist size = k * factor")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.store:
+        matrix = store_vectors(args.store)
+    elif args.vectors:
+        matrix = np.load(args.vectors).astype(np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    else:
+        print(f"Generating {args.rows} x {args.dims} synthetic vectors...")
+        matrix = synthetic_vectors(rng, args.rows, args.dims, args.clusters, args.decay)
+    rows, dims = matrix.shape
+    k = min(args.k, rows)
+
+    # Queries near corpus rows, like questions about indexed passages
+    picked = matrix[rng.integers(0, rows, size=args.queries)]
+    queries = picked + 0.3 * rng.standard_normal(picked.shape, dtype=np.float32) * np.abs(picked).mean()
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact_latencies, truths = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        truths.append(top_k(matrix @ q, k))
+        exact_latencies.append((time.perf_counter() - t0) * 1000)
+    results = [{
+        "config": "exact", "rescore_factor": None, "scan_bytes_per_vector": dims * 4,
+        "scan_mb_per_million": mb_per_million(dims * 4), "stored_mb_per_million": mb_per_million(dims * 4),
+        "first_pass_recall": 1.0, "recall": 1.0, **summarize(exact_latencies)
+    }]
+
+    factors = [int(f) for f in args.rescore_factors.split(",")]
+    for spec in args.configs.split(","):
+        codec = parse_config(spec)
+        t0 = time.perf_counter()
+        codes, scales = codec.encode(matrix)
+        encode_s = time.perf_counter() - t0
+        coarse_queries = codec.truncate(queries)
+        first_pass = statistics.fmean(
+            recall(top_k(codec.scores(codes, scales, cq), k), truth) for cq, truth in zip(coarse_queries, truths)
+        )
+        for factor in factors:
+            latencies, recalls = [], []
+            for q, cq, truth in zip(queries, coarse_queries, truths):
+                t0 = time.perf_counter()
+                shortlist = codec.shortlist(codes, scales, cq, k * factor)
+                sims = matrix[shortlist] @ q
+                found = shortlist[top_k(sims, min(k, shortlist.size))]
+                latencies.append((time.perf_counter() - t0) * 1000)
+                recalls.append(recall(found, truth))
+            scan_bytes = codec.bytes_per_vector(dims)
+            results.append({
+                "config": str(codec), "rescore_factor": factor, "scan_bytes_per_vector": scan_bytes,
+                "scan_mb_per_million": mb_per_million(scan_bytes),
+                # Full vectors stay on disk for rescoring; only shortlisted rows are read per query
+                "stored_mb_per_million": mb_per_million(scan_bytes + dims * 4),
+                "first_pass_recall": round(first_pass, 4), "recall": round(statistics.fmean(recalls), 4),
+                "encode_s": round(encode_s, 2), **summarize(latencies)
+            })
+
+    print(f"\n{rows} vectors x {dims} dims, {len(queries)} queries, recall@{k} vs exact float32")
+    print(f"{'config':<14} | {'rescore':>7} | {'scan MB/1M':>10} | {'1st pass R':>10} | {'recall':>7} | {'p50 ms':>7} | {'p95 ms':>7}")
+    for r in results:
+        factor = f"x{r['rescore_factor']}" if r["rescore_factor"] else "-"
+        print(f"{r['config']:<14} | {factor:>7} | {r['scan_mb_per_million']:>10.1f} | {r['first_pass_recall']:>10.3f} | {r['recall']:>7.3f} | {r['p50_ms']:>7.2f} | {r['p95_ms']:>7.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": rows, "dims": dims, "queries": len(queries), "k": k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
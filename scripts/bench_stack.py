@@ -0,0 +1,82 @@
+"""
+Starts the local benchmark stack: fake OpenAI, fake Supabase and the API (uvicorn) on free
+ports, with a throwaway data directory. Shared by the benchmark and load-test scripts.
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = os.path.join(ROOT, "scripts")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+def start_stack(openai_latency_ms: str, supabase_latency_ms: str, extra_env: Optional[Dict[str, str]] = None,
+                embed_latency_ms: Optional[str] = None, seed: Optional[int] = None, workers: int = 1,
+                supabase_port: Optional[int] = None, job_workers: int = 0) -> Tuple[str, List[subprocess.Popen]]:
+    """
+    Starts fake OpenAI, fake Supabase and the API, plus job_workers indexing worker processes
+    (python -m backend.worker). Latencies are fake_latency.py specs (a plain number is a fixed
+    latency in ms). Pass supabase_port to read the fake tables directly. Returns (api_url, processes).
+    """
+    openai_port, api_port = free_port(), free_port()
+    supabase_port = supabase_port or free_port()
+    seed_args = ["--seed", str(seed)] if seed is not None else []
+    openai_args = ["--latency-ms", str(openai_latency_ms)] + (["--embed-latency-ms", str(embed_latency_ms)] if embed_latency_ms else [])
+    procs = [
+        subprocess.Popen([sys.executable, os.path.join(SCRIPTS, "fake_openai.py"), "--port", str(openai_port)] + openai_args + seed_args),
+        subprocess.Popen([sys.executable, os.path.join(SCRIPTS, "fake_supabase.py"), "--port", str(supabase_port), "--latency-ms", str(supabase_latency_ms)] + seed_args),
+    ]
+    wait_until_up(f"http://127.0.0.1:{openai_port}/docs")
+    wait_until_up(f"http://127.0.0.1:{supabase_port}/docs")
+
+    data_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "SUPABASE_URL": f"http://127.0.0.1:{supabase_port}",
+        "SUPABASE_KEY": "fake",
+        "CACHE_ENABLED": "false",
+        "EMBED_CACHE_ENABLED": "false",
+        "RERANK_ENABLED": "true",
+        "JOB_EMBEDDED_WORKERS": "0",
+        "JOB_DB_PATH": os.path.join(data_dir, "jobs.db"),
+        "UPLOAD_SPOOL_DIR": os.path.join(data_dir, "uploads"),
+        "METRICS_DIR": os.path.join(data_dir, "metrics"),
+        "LOG_LEVEL": "WARNING",
+        **(extra_env or {})
+    }
+    procs.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(api_port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL
+    ))
+    for _ in range(job_workers):
+        procs.append(subprocess.Popen([sys.executable, "-m", "backend.worker"], cwd=ROOT, env=env, stdout=subprocess.DEVNULL))
+    api_url = f"http://127.0.0.1:{api_port}"
+    wait_until_up(f"{api_url}/health")
+    return api_url, procs
+
+def stop_stack(procs: List[subprocess.Popen]):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        proc.wait()
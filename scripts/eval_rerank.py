@@ -0,0 +1,102 @@
+"""
+Offline comparison of the reranker modes on the fixed labeled set in scripts/rerank_eval_set.json:
+ordering quality (nDCG@K, MRR, precision@K against the labels) and latency per question.
+"retrieval" is the unreranked input order, the baseline both modes should beat.
+
+Embeddings and the LLM reranker use the OpenAI settings from .env (or OPENAI_BASE_URL, e.g.
+scripts/fake_openai.py for a dry run; fake embeddings carry no meaning, so only real runs
+say anything about the cosine part of the local reranker).
+
+    python scripts/eval_rerank.py
+    python scripts/eval_rerank.py --modes local --repeat 20 --output rerank_eval.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")  # Not contacted: passages carry no chunk ids
+os.environ.setdefault("SUPABASE_KEY", "unused")
+
+from backend.config import Config
+from backend.services.llm import get_embeddings, get_embedding
+from backend.services.rerank import get_reranker
+
+EVAL_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rerank_eval_set.json")
+
+def dcg(labels):
+    return sum((2 ** label - 1) / math.log2(i + 2) for i, label in enumerate(labels))
+
+def metrics(ranked_labels, all_labels, k: int):
+    ideal = dcg(sorted(all_labels, reverse=True)[:k])
+    first_relevant = next((i for i, label in enumerate(ranked_labels) if label == 2), None)
+    return {
+        "ndcg": dcg(ranked_labels[:k]) / ideal if ideal else 0.0,
+        "mrr": 1 / (first_relevant + 1) if first_relevant is not None else 0.0,
+        "precision": sum(1 for label in ranked_labels[:k] if label > 0) / k
+    }
+
+async def evaluate(mode: str, queries, k: int, repeat: int):
+    scores = {"ndcg": [], "mrr": [], "precision": []}
+    latencies = []
+    for query in queries:
+        candidates = [{"content": p["text"], "label": p["label"]} for p in query["passages"]]
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            if mode == "retrieval":
+                ranked = candidates
+            else:
+                ranked = await get_reranker(mode).rerank(query["question"], candidates, len(candidates), query["embedding"])
+            latencies.append((time.perf_counter() - t0) * 1000)
+        # Passages the LLM dropped as irrelevant count as ranked last
+        ranked_labels = [c["label"] for c in ranked]
+        all_labels = [c["label"] for c in candidates]
+        for name, value in metrics(ranked_labels, all_labels, k).items():
+            scores[name].append(value)
+    latencies.sort()
+    return {
+        f"ndcg@{k}": round(statistics.mean(scores["ndcg"]), 4),
+        "mrr": round(statistics.mean(scores["mrr"]), 4),
+        f"precision@{k}": round(statistics.mean(scores["precision"]), 4),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3)
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare reranker modes on a labeled set")
+    parser.add_argument("--modes", default="retrieval,local,llm")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per question for latency")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    with open(EVAL_SET) as f:
+        queries = json.load(f)["queries"]
+
+    # The local reranker reads chunk vectors from the embedding cache, like after ingestion
+    Config.EMBED_CACHE_ENABLED = True
+    print(f"Embedding {len(queries)} questions and their passages...")
+    get_embeddings([p["text"] for q in queries for p in q["passages"]])
+    for query in queries:
+        query["embedding"] = get_embedding(query["question"])
+
+    report = {}
+    for mode in args.modes.split(","):
+        report[mode] = await evaluate(mode, queries, args.k, args.repeat)
+        print(f"{mode:>10} | " + " | ".join(f"{name} {value}" for name, value in report[mode].items()))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+"""
+Latency distributions for the fake servers, given as a spec string (milliseconds):
+
+    200                  fixed 200ms (same as fixed:200)
+    uniform:100:300      uniform between 100 and 300
+    normal:200:50        mean 200, standard deviation 50 (never below 0)
+    lognormal:200:800    median 200, p99 800: a long tail like real API latency
+
+A seed makes the sequence of samples reproducible.
+"""
+import math
+import random
+from typing import Optional
+
+Z_99 = 2.3263  # Standard normal quantile of 0.99
+
+class LatencyModel:
+    def __init__(self, spec: str = "0", seed: Optional[int] = None):
+        self.spec = str(spec)
+        self.rng = random.Random(seed)
+        parts = self.spec.split(":")
+        if len(parts) == 1:
+            parts = ["fixed", parts[0]]
+        self.kind = parts[0]
+        self.params = [float(p) for p in parts[1:]]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if self.kind not in expected or len(self.params) != expected[self.kind]:
+            raise ValueError(f"Invalid latency spec '{spec}', see scripts/fake_latency.py")
+        if self.kind == "lognormal" and not 0 < self.params[0] <= self.params[1]:
+            raise ValueError(f"lognormal needs 0 < median <= p99, got '{spec}'")
+
+    def sample_ms(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(*self.params))
+        median, p99 = self.params
+        sigma = math.log(p99 / median) / Z_99
+        return self.rng.lognormvariate(math.log(median), sigma)
+
+    def sample(self) -> float:
+        """One latency in seconds."""
+        return self.sample_ms() / 1000
+
+    def __str__(self) -> str:
+        return self.spec
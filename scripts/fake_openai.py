@@ -0,0 +1,181 @@
+"""
+Local stand-in for the OpenAI API used by benchmarks.
+Embeddings are deterministic (seeded by the input text) and every call sleeps for a
+latency drawn from a configurable distribution (see fake_latency.py), so measurements
+reflect our code and not the network.
+
+    python scripts/fake_openai.py --port 9100 --latency-ms 200
+    python scripts/fake_openai.py --latency-ms lognormal:400:2000 --embed-latency-ms lognormal:60:300 --seed 1
+    python scripts/fake_openai.py --rpm 600 --tpm 200000   # account quota: x-ratelimit-* headers and 429s
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import time
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fake_latency import LatencyModel
+
+EMBEDDING_DIM = 1536
+
+app = FastAPI(title="Fake OpenAI")
+app.state.latency = LatencyModel("0")  # Chat completions
+app.state.embed_latency = LatencyModel("0")
+app.state.token_ms = 10.0  # Delay between streamed chunks
+app.state.quota = None
+
+class FakeQuota:
+    """Account-wide RPM / TPM buckets (0 = unlimited) with OpenAI's rate-limit headers."""
+    def __init__(self, rpm: int, tpm: int):
+        self.limits = {"requests": rpm, "tokens": tpm}
+        self.levels = {"requests": float(rpm), "tokens": float(tpm)}
+        self.updated = time.monotonic()
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        for kind, limit in self.limits.items():
+            if limit:
+                self.levels[kind] = min(float(limit), self.levels[kind] + (now - self.updated) * limit / 60)
+        self.updated = now
+
+    def headers(self) -> dict:
+        headers = {}
+        for kind, limit in self.limits.items():
+            if limit:
+                headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+                headers[f"x-ratelimit-remaining-{kind}"] = str(max(0, int(self.levels[kind])))
+                missing = max(0.0, limit - self.levels[kind])
+                headers[f"x-ratelimit-reset-{kind}"] = f"{int(missing * 60000 / limit)}ms"
+        return headers
+
+    def admit(self, tokens: int):
+        """Takes one request and the tokens, or returns a 429 response."""
+        self._refill()
+        costs = {"requests": 1, "tokens": tokens}
+        short = [kind for kind, limit in self.limits.items() if limit and self.levels[kind] < min(costs[kind], limit)]
+        if short:
+            self.rejected += 1
+            wait_ms = max(int((min(costs[k], self.limits[k]) - self.levels[k]) * 60000 / self.limits[k]) + 1 for k in short)
+            return JSONResponse(
+                {"error": {"message": f"Rate limit reached for {short[0]}", "type": short[0], "code": "rate_limit_exceeded"}},
+                status_code=429, headers={**self.headers(), "retry-after-ms": str(wait_ms)}
+            )
+        for kind in self.limits:
+            if self.limits[kind]:
+                self.levels[kind] -= costs[kind]
+        return None
+
+def _admit(tokens: int):
+    return app.state.quota.admit(tokens) if app.state.quota else None
+
+def _quota_headers() -> dict:
+    return app.state.quota.headers() if app.state.quota else {}
+
+def _fake_vector(text: str, dim: int) -> np.ndarray:
+    rng = np.random.default_rng(np.frombuffer(hashlib.sha256(text.encode()).digest(), dtype=np.uint32))
+    return rng.uniform(-1, 1, dim).astype(np.float32)
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM):
+    return _fake_vector(text, dim).tolist()
+
+def _embeddings_response(body: dict, inputs: list, tokens: int) -> JSONResponse:
+    # The openai client asks for base64 (packed float32) unless encoding_format is given
+    dim = body.get("dimensions") or EMBEDDING_DIM
+    if body.get("encoding_format") == "base64":
+        encode = lambda t: base64.b64encode(_fake_vector(t, dim).tobytes()).decode()
+    else:
+        encode = lambda t: fake_embedding(t, dim)
+    return JSONResponse({
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": encode(t)} for i, t in enumerate(inputs)],
+        "model": body.get("model"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    }, headers=_quota_headers())
+
+async def _sleep(model: LatencyModel):
+    delay = model.sample()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    tokens = sum(max(1, len(t) // 4) for t in inputs)
+    rejected = _admit(tokens)
+    if rejected:
+        return rejected
+    await _sleep(app.state.embed_latency)
+    # Large ingestion batches are built off the event loop, so they do not stall chat completions
+    return await asyncio.to_thread(_embeddings_response, body, inputs, tokens)
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    rejected = _admit(sum(max(1, len(m.get("content") or "") // 4) for m in body["messages"]) + 20)
+    if rejected:
+        return rejected
+    await _sleep(app.state.latency)
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        # Reranker: keep the given order
+        passages = body["messages"][-1]["content"].count("ID: ")
+        content = json.dumps({"ranked_indices": list(range(passages))})
+    else:
+        content = "This is a fake answer generated for benchmarking."
+    if body.get("stream"):
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        return StreamingResponse(_stream_chunks(body.get("model"), content, include_usage), media_type="text/event-stream", headers=_quota_headers())
+    return JSONResponse({
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+    }, headers=_quota_headers())
+
+async def _stream_chunks(model: str, content: str, include_usage: bool = False):
+    # One chunk per word, like token deltas
+    words = content.split(" ")
+    for i, word in enumerate(words):
+        delta = word if i == 0 else " " + word
+        chunk = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(app.state.token_ms / 1000)
+    if include_usage:
+        usage = {"prompt_tokens": 100, "completion_tokens": len(words), "total_tokens": 100 + len(words)}
+        chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": [], "usage": usage}
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Fake OpenAI server")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", default="200", help="Chat completion latency spec (fake_latency.py)")
+    parser.add_argument("--embed-latency-ms", default=None, help="Embedding latency spec, default: same as --latency-ms")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="Delay between streamed chunks")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency sampling")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before 429s, 0 = unlimited")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens per minute before 429s, 0 = unlimited")
+    args = parser.parse_args()
+    app.state.latency = LatencyModel(args.latency_ms, args.seed)
+    app.state.embed_latency = LatencyModel(args.embed_latency_ms or args.latency_ms, None if args.seed is None else args.seed + 1)
+    app.state.token_ms = args.token_ms
+    if args.rpm or args.tpm:
+        app.state.quota = FakeQuota(args.rpm, args.tpm)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
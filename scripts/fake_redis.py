@@ -0,0 +1,109 @@
+"""
+Minimal in-memory Redis-protocol (RESP) server for local runs and benchmarks of the shared
+chat cache tier. Supports the commands RedisChatStore uses plus a few for inspection:
+PING, AUTH, SELECT, GET, SET (EX/PX), DEL, EXISTS, DBSIZE, FLUSHDB.
+
+    python scripts/fake_redis.py --port 6390
+    CHAT_CACHE_L2_URL=redis://127.0.0.1:6390/0 uvicorn backend.main:app --workers 4
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+# db -> key -> (value, expires_at or None)
+_data: Dict[int, Dict[bytes, Tuple[bytes, Optional[float]]]] = {}
+
+def _bulk(value: Optional[bytes]) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+def _get(db: int, key: bytes) -> Optional[bytes]:
+    item = _data.get(db, {}).get(key)
+    if item is None:
+        return None
+    value, expires_at = item
+    if expires_at is not None and time.time() >= expires_at:
+        del _data[db][key]
+        return None
+    return value
+
+def execute(state: dict, args: List[bytes]) -> bytes:
+    command = args[0].upper()
+    db = state["db"]
+    if command == b"PING":
+        return b"+PONG\r\n"
+    if command == b"AUTH":
+        return b"+OK\r\n"
+    if command == b"SELECT":
+        state["db"] = int(args[1])
+        return b"+OK\r\n"
+    if command == b"GET":
+        return _bulk(_get(db, args[1]))
+    if command == b"SET":
+        expires_at = None
+        options = [a.upper() for a in args[3:]]
+        if b"EX" in options:
+            expires_at = time.time() + float(args[3 + options.index(b"EX") + 1])
+        elif b"PX" in options:
+            expires_at = time.time() + float(args[3 + options.index(b"PX") + 1]) / 1000
+        _data.setdefault(db, {})[args[1]] = (args[2], expires_at)
+        return b"+OK\r\n"
+    if command == b"DEL":
+        removed = sum(1 for key in args[1:] if _data.get(db, {}).pop(key, None) is not None)
+        return b":%d\r\n" % removed
+    if command == b"EXISTS":
+        return b":%d\r\n" % sum(1 for key in args[1:] if _get(db, key) is not None)
+    if command == b"DBSIZE":
+        return b":%d\r\n" % len(_data.get(db, {}))
+    if command == b"FLUSHDB":
+        _data.pop(db, None)
+        return b"+OK\r\n"
+    return b"-ERR unknown command '%s'\r\n" % command
+
+async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command (e.g. typed into telnet)
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        header = await reader.readline()
+        length = int(header[1:-2])
+        data = await reader.readexactly(length + 2)
+        args.append(data[:-2])
+    return args
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    state = {"db": 0}
+    try:
+        while True:
+            args = await read_command(reader)
+            if args is None:
+                break
+            if not args:
+                continue
+            writer.write(execute(state, args))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(port: int):
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    print(f"Fake Redis listening on 127.0.0.1:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Redis (RESP) server")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    asyncio.run(serve(args.port))
+
+if __name__ == "__main__":
+    main()
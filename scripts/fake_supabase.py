@@ -0,0 +1,223 @@
+"""
+Local stand-in for the Supabase PostgREST endpoints used by the API and the indexing worker
+(search RPCs, the `sources` and `chunks` tables), backed by a small in-memory synthetic
+corpus. Uploads are indexed into the same corpus, so search sees them. Every request
+sleeps for a latency drawn from a configurable distribution (see fake_latency.py).
+
+    python scripts/fake_supabase.py --port 9200 --latency-ms 20
+    python scripts/fake_supabase.py --latency-ms lognormal:15:80 --seed 1
+    SUPABASE_URL=http://127.0.0.1:9200 SUPABASE_KEY=fake uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from fake_openai import fake_embedding
+from fake_latency import LatencyModel
+
+app = FastAPI(title="Fake Supabase")
+app.state.latency = LatencyModel("0")
+app.state.sources = {}
+app.state.chunks = {}  # (source_id, chunk_index) -> row
+
+# Query parameters that are not column filters
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+def seed(num_sources: int = 5, chunks_per_source: int = 40):
+    rng = random.Random(42)
+    words = "rerank cache vector search hybrid keyword semantic index chunk embedding answer latency".split()
+    for s in range(num_sources):
+        source_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        app.state.sources[source_id] = {
+            "id": source_id,
+            "filename": f"doc_{s}.txt",
+            "filetype": "text/plain",
+            "status": "indexed",
+            "error": None,
+            "content_hash": None,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        for c in range(chunks_per_source):
+            app.state.chunks[(source_id, c)] = {
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "source_id": source_id,
+                "chunk_index": c,
+                "content": " ".join(rng.choice(words) for _ in range(150)),
+                "content_hash": None,
+                "embedding": None  # Computed on read, like fake_openai would return
+            }
+
+async def _sleep():
+    delay = app.state.latency.sample()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+def _parse_in(value: str) -> List[str]:
+    # PostgREST filter syntax: in.(a,b,c)
+    return [v.strip('"') for v in value[len("in.("):-1].split(",") if v]
+
+def _matches(row: Dict[str, Any], column: str, condition: str) -> bool:
+    op, _, operand = condition.partition(".")
+    value = row.get(column)
+    if op == "in":
+        return str(value) in _parse_in(condition)
+    if op in ("eq", "neq"):
+        return (str(value) == operand) == (op == "eq")
+    if op in ("gt", "gte", "lt", "lte"):
+        if value is None:
+            return False
+        left, right = (float(value), float(operand)) if isinstance(value, (int, float)) else (str(value), operand)
+        return {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[op]
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+def _filter(rows: List[Dict[str, Any]], request: Request) -> List[Dict[str, Any]]:
+    for column, condition in request.query_params.multi_items():
+        if column not in RESERVED_PARAMS:
+            rows = [row for row in rows if _matches(row, column, condition)]
+    return rows
+
+def _project(rows: List[Dict[str, Any]], request: Request) -> List[Dict[str, Any]]:
+    order = request.query_params.get("order")
+    if order:
+        column, _, direction = order.partition(".")
+        rows = sorted(rows, key=lambda r: str(r.get(column)), reverse=direction.startswith("desc"))
+    limit = request.query_params.get("limit")
+    if limit:
+        rows = rows[:int(limit)]
+    select = request.query_params.get("select", "*")
+    if select.strip() == "*":
+        return [dict(row) for row in rows]
+    columns = [c.strip() for c in select.split(",")]
+    return [{c: row.get(c) for c in columns} for row in rows]
+
+def _chunk_out(row: Dict[str, Any]) -> Dict[str, Any]:
+    # pgvector columns come back as text, like from PostgREST
+    embedding = row["embedding"] if row["embedding"] is not None else fake_embedding(row["content"])
+    return {**row, "embedding": str(embedding)}
+
+async def _rows(request: Request) -> List[Dict[str, Any]]:
+    # Chunk upserts carry full embeddings: parse them off the event loop, so they do not stall searches
+    body = await asyncio.to_thread(json.loads, await request.body())
+    return body if isinstance(body, list) else [body]
+
+@app.post("/rest/v1/rpc/{function}")
+async def rpc(function: str, request: Request):
+    params = await request.json()
+    await _sleep()
+    filter_ids = params.get("filter_source_ids")
+    rows = [c for c in app.state.chunks.values() if not filter_ids or c["source_id"] in filter_ids]
+    # Deterministic per question/function so both legs overlap partially
+    rng = random.Random(f"{function}:{params.get('query_text') or len(params.get('query_embedding') or '')}")
+    picked = rng.sample(rows, min(params.get("match_count", 10), len(rows)))
+    rows = [{k: v for k, v in c.items() if k != "embedding"} | {"similarity": 1.0 / (i + 1)} for i, c in enumerate(picked)]
+    if function == "hybrid_search":
+        for row in rows:
+            row["filename"] = app.state.sources.get(row["source_id"], {}).get("filename")
+    return rows
+
+@app.get("/rest/v1/chunks")
+async def list_chunks(request: Request):
+    await _sleep()
+    rows = _filter(list(app.state.chunks.values()), request)
+    return await asyncio.to_thread(lambda: JSONResponse(_project([_chunk_out(row) for row in rows], request)))
+
+@app.post("/rest/v1/chunks")
+async def upsert_chunks(request: Request):
+    # Upsert keyed by (source_id, chunk_index), as on_conflict in the ingestion code
+    rows = await _rows(request)
+    await _sleep()
+    for row in rows:
+        key = (str(row["source_id"]), int(row["chunk_index"]))
+        existing = app.state.chunks.get(key)
+        app.state.chunks[key] = {
+            "id": existing["id"] if existing else str(uuid.uuid4()),
+            "source_id": key[0],
+            "chunk_index": key[1],
+            "content": row.get("content", ""),
+            "content_hash": row.get("content_hash"),
+            "embedding": row.get("embedding")
+        }
+    return JSONResponse([], status_code=201)
+
+@app.delete("/rest/v1/chunks")
+async def delete_chunks(request: Request):
+    await _sleep()
+    rows = _filter(list(app.state.chunks.values()), request)
+    for row in rows:
+        app.state.chunks.pop((row["source_id"], row["chunk_index"]), None)
+    return []
+
+@app.get("/rest/v1/sources")
+async def list_sources(request: Request):
+    await _sleep()
+    return _project(_filter(list(app.state.sources.values()), request), request)
+
+def _hash_taken(row: Dict[str, Any], source_id: Optional[str] = None) -> bool:
+    """Mirrors the unique index on live sources' content_hash (sql/03)."""
+    if not row.get("content_hash") or row.get("status") == "failed":
+        return False
+    return any(
+        other["id"] != source_id and other.get("content_hash") == row["content_hash"] and other.get("status") != "failed"
+        for other in app.state.sources.values()
+    )
+
+UNIQUE_VIOLATION = {
+    "code": "23505",
+    "message": "duplicate key value violates unique constraint \"idx_sources_content_hash_live\"",
+    "details": "Key (content_hash) already exists.",
+    "hint": None
+}
+
+@app.post("/rest/v1/sources")
+async def insert_source(request: Request):
+    rows = await _rows(request)
+    await _sleep()
+    created = []
+    for row in rows:
+        record = {"id": str(uuid.uuid4()), "error": None, "created_at": datetime.now(timezone.utc).isoformat(), **row}
+        if _hash_taken(record):
+            return JSONResponse(UNIQUE_VIOLATION, status_code=409)
+        app.state.sources[record["id"]] = record
+        created.append(record)
+    return JSONResponse(created, status_code=201)
+
+@app.patch("/rest/v1/sources")
+async def update_source(request: Request):
+    body = await request.json()
+    await _sleep()
+    rows = _filter(list(app.state.sources.values()), request)
+    if any(_hash_taken({**row, **body}, row["id"]) for row in rows):
+        return JSONResponse(UNIQUE_VIOLATION, status_code=409)
+    for row in rows:
+        row.update(body)
+    return rows
+
+@app.delete("/rest/v1/sources")
+async def delete_source(request: Request):
+    await _sleep()
+    rows = _filter(list(app.state.sources.values()), request)
+    for row in rows:
+        del app.state.sources[row["id"]]
+        # on delete cascade
+        for key in [k for k in app.state.chunks if k[0] == row["id"]]:
+            del app.state.chunks[key]
+    return rows
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Fake Supabase (PostgREST) server")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency-ms", default="20", help="Latency spec (fake_latency.py)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency sampling")
+    args = parser.parse_args()
+    seed()
+    app.state.latency = LatencyModel(args.latency_ms, args.seed)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""
+Offline load test: drives /chat, /chat with a source filter and /documents/upload at a fixed
+concurrency against the local stack (fake OpenAI and Supabase with latency distributions,
+see fake_latency.py) and reports latency percentiles, throughput and per-stage breakdowns
+(from /metrics) as JSON. With --baseline the run is compared against a stored report and
+the script exits with status 1 on a regression, so it can gate performance changes.
+
+    python scripts/loadtest.py --concurrency 16 --duration 20 --output loadtest.json
+    python scripts/loadtest.py --baseline scripts/loadtest_baseline.json
+    python scripts/loadtest.py --save-baseline scripts/loadtest_baseline.json
+    python scripts/loadtest.py --url http://127.0.0.1:8000 --mix chat=1   # running server, no fakes
+
+Baselines are only comparable on the same machine with the same options (they are stored
+in the report's "config"); regenerate scripts/loadtest_baseline.json on the CI host.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+import httpx
+from bench_stack import start_stack, stop_stack
+
+SCENARIOS = ("chat", "chat_filtered", "upload")
+WORDS = "rerank cache vector search hybrid keyword semantic index chunk embedding answer latency document upload worker queue".split()
+SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(latencies_ms: List[float], statuses: Dict[str, int], elapsed: float) -> Dict:
+    ok = sorted(latencies_ms)
+    requests = sum(statuses.values())
+    errors = sum(n for status, n in statuses.items() if not status.startswith("2"))
+    return {
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "status": dict(sorted(statuses.items())),
+        "rps": round(len(ok) / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(sum(ok) / len(ok), 2) if ok else 0.0,
+        "p50_ms": round(percentile(ok, 50), 2),
+        "p95_ms": round(percentile(ok, 95), 2),
+        "p99_ms": round(percentile(ok, 99), 2),
+        "max_ms": round(ok[-1], 2) if ok else 0.0
+    }
+
+# --- /metrics scraping ---
+
+def parse_metrics(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE_PATTERN.match(line)
+        if not match or line.startswith("#"):
+            continue
+        name, labels, value = match.groups()
+        samples[(name, tuple(sorted(LABEL_PATTERN.findall(labels or ""))))] = float(value)
+    return samples
+
+def metrics_delta(before: Dict, after: Dict) -> Dict:
+    return {key: value - before.get(key, 0.0) for key, value in after.items()}
+
+def histogram_quantile(q: float, buckets: List[Tuple[float, float]]) -> float:
+    """Prometheus-style quantile from cumulative (upper bound, count) buckets, linear within a bucket."""
+    buckets = sorted(buckets)
+    total = buckets[-1][1] if buckets else 0
+    if total <= 0:
+        return 0.0
+    target = q * total
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= target:
+            if math.isinf(bound):
+                return lower_bound
+            span = count - lower_count
+            return lower_bound + (bound - lower_bound) * ((target - lower_count) / span if span else 1.0)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+def stage_breakdown(delta: Dict) -> Dict:
+    """Per-stage count, mean and estimated p50/p95 of rag_chat_stage_seconds during the run."""
+    buckets, sums, counts = defaultdict(list), {}, {}
+    for (name, labels), value in delta.items():
+        labels = dict(labels)
+        if name == "rag_chat_stage_seconds_bucket":
+            le = labels["le"]
+            buckets[labels["stage"]].append((math.inf if le == "+Inf" else float(le), value))
+        elif name == "rag_chat_stage_seconds_sum":
+            sums[labels["stage"]] = value
+        elif name == "rag_chat_stage_seconds_count":
+            counts[labels["stage"]] = value
+    return {
+        stage: {
+            "count": int(count),
+            "mean_ms": round(sums.get(stage, 0.0) / count * 1000, 2),
+            "p50_ms": round(histogram_quantile(0.5, buckets[stage]) * 1000, 2),
+            "p95_ms": round(histogram_quantile(0.95, buckets[stage]) * 1000, 2)
+        }
+        for stage, count in sorted(counts.items()) if count > 0
+    }
+
+def ingestion_breakdown(delta: Dict) -> Dict:
+    chunks, seconds = {}, {}
+    for (name, labels), value in delta.items():
+        labels = dict(labels)
+        if name == "rag_ingest_chunks_total":
+            chunks[labels["stage"]] = value
+        elif name == "rag_ingest_stage_seconds_total":
+            seconds[labels["stage"]] = value
+    return {
+        stage: {"chunks": int(n), "seconds": round(seconds.get(stage, 0.0), 3), "chunks_per_sec": round(n / seconds[stage], 1) if seconds.get(stage) else 0.0}
+        for stage, n in sorted(chunks.items()) if n > 0
+    }
+
+def token_usage(delta: Dict) -> Dict:
+    usage = defaultdict(int)
+    for (name, labels), value in delta.items():
+        if name == "rag_openai_tokens_total" and value > 0:
+            labels = dict(labels)
+            usage[f"{labels['operation']}:{labels['kind']}"] += int(value)
+    return dict(sorted(usage.items()))
+
+async def scrape(client: httpx.AsyncClient) -> Dict:
+    resp = await client.get("/metrics")
+    return parse_metrics(resp.text) if resp.status_code == 200 else {}
+
+# --- Load generation ---
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, float], seed: int, upload_kb: int, source_ids: List[str]):
+        self.client = client
+        self.mix = mix
+        self.seed = seed
+        self.upload_kb = upload_kb
+        self.source_ids = source_ids
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.job_ids: List[int] = []
+
+    def _question(self, rng: random.Random) -> str:
+        return "How does " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))) + f" work? #{rng.getrandbits(32)}"
+
+    async def request(self, scenario: str, rng: random.Random):
+        if scenario == "chat":
+            call = self.client.post("/chat", json={"question": self._question(rng)})
+        elif scenario == "chat_filtered":
+            filter_ids = rng.sample(self.source_ids, min(len(self.source_ids), rng.randint(1, 2)))
+            call = self.client.post("/chat", json={"question": self._question(rng), "source_ids": filter_ids})
+        else:
+            words = []
+            while sum(len(w) + 1 for w in words) < self.upload_kb * 1024:
+                words.append(rng.choice(WORDS))
+            content = f"Load test document {rng.getrandbits(64)}\n" + " ".join(words)
+            call = self.client.post("/documents/upload", files={"file": (f"loadtest_{rng.getrandbits(32)}.txt", content.encode(), "text/plain")})
+
+        t0 = time.perf_counter()
+        try:
+            resp = await call
+            status = str(resp.status_code)
+            if scenario == "upload" and resp.status_code == 200 and resp.json().get("job_id"):
+                self.job_ids.append(resp.json()["job_id"])
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        self.statuses[scenario][status] += 1
+        if status.startswith("2"):
+            self.latencies[scenario].append(elapsed_ms)
+
+    async def run(self, concurrency: int, duration: float, total_requests: int) -> float:
+        """Closed loop: each client sends its next request when the previous one finished. Returns elapsed seconds."""
+        names, weights = list(self.mix), list(self.mix.values())
+        deadline = time.perf_counter() + duration if duration > 0 else math.inf
+        issued = 0
+
+        async def client_loop(client_id: int):
+            nonlocal issued
+            rng = random.Random(f"{self.seed}:{client_id}")
+            while time.perf_counter() < deadline and (not total_requests or issued < total_requests):
+                issued += 1
+                await self.request(rng.choices(names, weights)[0], rng)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(i) for i in range(concurrency)))
+        return time.perf_counter() - start
+
+    async def drain_jobs(self, timeout: float):
+        """Waits until the uploads' indexing jobs finished, so ingestion metrics cover them."""
+        deadline = time.perf_counter() + timeout
+        pending = set(self.job_ids)
+        while pending and time.perf_counter() < deadline:
+            for job_id in list(pending):
+                resp = await self.client.get(f"/jobs/{job_id}")
+                if resp.status_code != 200 or resp.json().get("status") in ("done", "failed"):
+                    pending.discard(job_id)
+            if pending:
+                await asyncio.sleep(0.5)
+        return len(pending)
+
+# --- Baseline comparison ---
+
+def compare(report: Dict, baseline: Dict, tolerance: float, min_delta_ms: float, min_tail: int) -> Tuple[List[Dict], bool]:
+    """
+    Flags a regression when a latency percentile grows by more than tolerance (and at least
+    min_delta_ms), throughput drops by more than tolerance, or the error rate rises by more than 1%.
+    A percentile is only gated when both runs have at least min_tail samples above it (p95 needs
+    20 * min_tail requests), since the tail of a short run is mostly noise.
+    """
+    rows, regressed = [], False
+    for scenario, current in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base:
+            continue
+        samples = min(current["requests"] - current["errors"], base["requests"] - base["errors"])
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "rps", "error_rate"):
+            old, new = base.get(metric, 0.0), current.get(metric, 0.0)
+            gated = True
+            if metric == "rps":
+                bad = old > 0 and new < old * (1 - tolerance)
+            elif metric == "error_rate":
+                bad = new > old + 0.01
+            else:
+                tail = 1 - int(metric[1:3]) / 100
+                gated = samples * tail >= min_tail
+                bad = gated and new > old * (1 + tolerance) and new - old >= min_delta_ms
+            change = (new - old) / old if old else 0.0
+            rows.append({"scenario": scenario, "metric": metric, "baseline": old, "current": new, "change": round(change, 4), "gated": gated, "regression": bad})
+            regressed = regressed or bad
+    return rows, regressed
+
+def print_report(report: Dict):
+    print(f"\n{'scenario':<14} | {'requests':>8} | {'errors':>6} | {'rps':>7} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    for name, s in list(report["scenarios"].items()) + [("total", report["total"])]:
+        print(f"{name:<14} | {s['requests']:>8} | {s['errors']:>6} | {s['rps']:>7.2f} | {s['p50_ms']:>8.1f} | {s['p95_ms']:>8.1f} | {s['p99_ms']:>8.1f}")
+    if report["stages"]:
+        print(f"\n{'stage':<16} | {'count':>6} | {'mean ms':>8} | {'~p50 ms':>8} | {'~p95 ms':>8}")
+        for stage, s in report["stages"].items():
+            print(f"{stage:<16} | {s['count']:>6} | {s['mean_ms']:>8.1f} | {s['p50_ms']:>8.1f} | {s['p95_ms']:>8.1f}")
+    for stage, s in report["ingestion"].items():
+        print(f"ingest {stage:<9} | {s['chunks']:>6} chunks | {s['chunks_per_sec']:>8.1f} chunks/sec")
+
+async def run_load(api_url: str, args, mix: Dict[str, float]) -> Dict:
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=api_url, timeout=args.timeout, limits=limits) as client:
+        docs = (await client.get("/documents")).json()
+        source_ids = [d["id"] for d in docs if d.get("status") == "indexed"]
+        if "chat_filtered" in mix and not source_ids:
+            raise RuntimeError("chat_filtered needs at least one indexed document")
+
+        warmup = LoadGenerator(client, {"chat": 1}, args.seed + 1000, args.upload_kb, source_ids)
+        await warmup.run(min(args.concurrency, 4), 0, args.warmup)
+
+        before = await scrape(client)
+        generator = LoadGenerator(client, mix, args.seed, args.upload_kb, source_ids)
+        elapsed = await generator.run(args.concurrency, args.duration, args.requests)
+        undrained = await generator.drain_jobs(args.drain_seconds) if generator.job_ids else 0
+        delta = metrics_delta(before, await scrape(client))
+
+    all_latencies = [ms for values in generator.latencies.values() for ms in values]
+    all_statuses = defaultdict(int)
+    for statuses in generator.statuses.values():
+        for status, n in statuses.items():
+            all_statuses[status] += n
+    return {
+        "config": {
+            "concurrency": args.concurrency, "duration": args.duration, "requests": args.requests, "mix": mix,
+            "openai_latency_ms": args.openai_latency_ms, "embed_latency_ms": args.embed_latency_ms,
+            "supabase_latency_ms": args.supabase_latency_ms, "workers": args.workers, "seed": args.seed,
+            "upload_kb": args.upload_kb, "url": args.url or "local stack"
+        },
+        "elapsed_s": round(elapsed, 2),
+        "scenarios": {name: summarize(generator.latencies[name], generator.statuses[name], elapsed) for name in mix if generator.statuses[name]},
+        "total": summarize(all_latencies, all_statuses, elapsed),
+        "stages": stage_breakdown(delta),
+        "ingestion": ingestion_breakdown(delta),
+        "openai_tokens": token_usage(delta),
+        "undrained_jobs": undrained
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /chat and /documents/upload")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load (0 = until --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0 = until --duration)")
+    parser.add_argument("--mix", default="chat=0.7,chat_filtered=0.2,upload=0.1", help="Scenario weights")
+    parser.add_argument("--warmup", type=int, default=8, help="Unmeasured chat requests before the run")
+    parser.add_argument("--upload-kb", type=int, default=8, help="Size of each uploaded document")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--drain-seconds", type=float, default=60, help="Wait for upload indexing jobs after the run")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--url", help="Test a running API instead of starting the local stack")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the local stack")
+    parser.add_argument("--openai-latency-ms", default="lognormal:300:1200", help="Chat completion latency spec (fake_latency.py)")
+    parser.add_argument("--embed-latency-ms", default="lognormal:40:200", help="Embedding latency spec")
+    parser.add_argument("--supabase-latency-ms", default="lognormal:15:80", help="PostgREST latency spec")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Compare against this report, exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative change before a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore latency changes smaller than this")
+    parser.add_argument("--min-tail-samples", type=int, default=5, help="Samples above a percentile needed to gate on it")
+    parser.add_argument("--save-baseline", help="Write this run's report as the new baseline")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    procs = []
+    api_url = args.url
+    if not api_url:
+        extra_env = {"JOB_EMBEDDED_WORKERS": "1", "JOB_MAX_PENDING": "10000"}
+        api_url, procs = start_stack(args.openai_latency_ms, args.supabase_latency_ms, extra_env,
+                                     embed_latency_ms=args.embed_latency_ms, seed=args.seed, workers=args.workers)
+    try:
+        report = asyncio.run(run_load(api_url, args, mix))
+    finally:
+        stop_stack(procs)
+
+    print_report(report)
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressed = compare(report, baseline, args.tolerance, args.min_delta_ms, args.min_tail_samples)
+        report["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "regression": regressed, "rows": rows}
+        print(f"\nBaseline {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else ("ok" if row["gated"] else "too few samples")
+            print(f"  {row['scenario']:<14} {row['metric']:<10} {row['baseline']:>10} -> {row['current']:>10} ({row['change']:+.1%}) {flag}")
+        if regressed:
+            exit_code = 1
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({k: v for k, v in report.items() if k != "comparison"}, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
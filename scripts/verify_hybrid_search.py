@@ -0,0 +1,56 @@
+"""
+Equivalence check between the single-call `hybrid_search` RPC (sql/04_hybrid_search_rpc.sql)
+and the reference path: `match_chunks` + `match_chunks_keyword` fused by `rrf_fusion`.
+Runs against the Supabase project configured in .env.
+
+    python scripts/verify_hybrid_search.py "How does reranking work?" "caching"
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.main import _hybrid_search_rpc, _hybrid_search_two_rpc
+from backend.services.llm import get_embedding_async
+
+DEFAULT_QUESTIONS = [
+    "How does reranking work?",
+    "What is caching used for?",
+    "hybrid search keyword semantic",
+]
+
+async def compare(question: str) -> bool:
+    embedding = await get_embedding_async(question)
+
+    t0 = time.perf_counter()
+    reference = await _hybrid_search_two_rpc(question, embedding, [])
+    t_reference = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    fused = await _hybrid_search_rpc(question, embedding, [])
+    t_fused = (time.perf_counter() - t0) * 1000
+
+    ref_ids = [(str(m["source_id"]), m["chunk_index"]) for m in reference]
+    rpc_ids = [(str(m["source_id"]), m["chunk_index"]) for m in fused]
+    scores_match = all(abs(a["similarity"] - b["similarity"]) < 1e-9 for a, b in zip(reference, fused))
+
+    ok = ref_ids == rpc_ids and scores_match
+    print(f"[{'OK' if ok else 'DIFF'}] '{question}': {len(ref_ids)} results | two-RPC {t_reference:.1f}ms vs hybrid_search {t_fused:.1f}ms")
+    if not ok:
+        for i, (a, b) in enumerate(zip(reference + [None] * len(fused), fused + [None] * len(reference))):
+            if a is None and b is None:
+                break
+            print(f"  {i+1}. ref={a and (a['source_id'], a['chunk_index'], round(a['similarity'], 6))} rpc={b and (b['source_id'], b['chunk_index'], round(b['similarity'], 6))}")
+    return ok
+
+async def main():
+    questions = sys.argv[1:] or DEFAULT_QUESTIONS
+    results = [await compare(q) for q in questions]
+    if not all(results):
+        sys.exit(1)
+    print("[SUCCESS] hybrid_search matches rrf_fusion on all questions.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
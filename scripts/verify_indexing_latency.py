@@ -0,0 +1,130 @@
+"""
+Checks that /chat p99 stays flat while a large PDF is being indexed. Runs offline against
+the local stack (fake OpenAI and Supabase with fixed latencies, see bench_stack.py) with one
+indexing worker process, as deployed. The chat caches are off and every request asks a
+distinct question, so each one runs retrieval, rerank and generation.
+
+The API, the worker (and its extraction processes) and the fakes each need a core of their
+own: on a smaller host the probe measures CPU sharing, not /chat.
+
+    python scripts/verify_indexing_latency.py --pdf-pages 1500 --samples 40
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import httpx
+from bench_stack import start_stack, stop_stack
+
+MIN_CPUS = 4  # API, indexing worker, extraction process, fakes
+
+def build_pdf(path: str, pages: int):
+    """Writes a minimal text PDF with the given number of pages (no extra dependencies)."""
+    line = "Reranking helps improve search relevance by re-scoring candidates. " * 2
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(pages):
+        text_ops = "".join(f"BT /F1 9 Tf 20 {800 - i * 12} Td (Page {p} line {i}: {line}) Tj ET\n" for i in range(60))
+        stream = text_ops.encode("latin-1")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{text_ops}endstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for i, obj in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1"))
+        xref_at = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+        for off in offsets:
+            f.write(f"{off:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode())
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+class ChatProbe:
+    """Sends /chat requests one at a time, each with a new question, and records their latency."""
+    def __init__(self, client: httpx.Client):
+        self.client = client
+        self.sent = 0
+
+    def measure(self, samples: int):
+        durations = []
+        for _ in range(samples):
+            self.sent += 1
+            question = f"How does reranking work? (probe {self.sent})"
+            start = time.perf_counter()
+            resp = self.client.post("/chat", json={"question": question, "source_ids": []})
+            resp.raise_for_status()
+            durations.append((time.perf_counter() - start) * 1000)
+        return durations
+
+def report(label, durations):
+    print(f"{label}: p50={statistics.median(durations):.1f}ms p99={percentile(durations, 99):.1f}ms max={max(durations):.1f}ms")
+
+def run_verification(args) -> bool:
+    if (os.cpu_count() or 1) < MIN_CPUS:
+        print(f"[WARNING] {os.cpu_count()} CPU(s): indexing and /chat share cores, expect a higher p99 ratio than in production.")
+    api_url, procs = start_stack(args.openai_latency_ms, args.supabase_latency_ms, {"JOB_POLL_SECONDS": "0.1"},
+                                 embed_latency_ms=args.embed_latency_ms, job_workers=1)
+    try:
+        client = httpx.Client(base_url=api_url, timeout=60)
+        probe = ChatProbe(client)
+        probe.measure(3)  # Warm up connections
+
+        print("--- Baseline: /chat while idle ---")
+        idle = probe.measure(args.samples)
+        report("Idle", idle)
+
+        print(f"\n--- Building {args.pdf_pages}-page PDF and uploading ---")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "large_indexing_probe.pdf")
+            build_pdf(path, args.pdf_pages)
+            with open(path, "rb") as f:
+                resp = client.post("/documents/upload", files={"file": ("large_indexing_probe.pdf", f, "application/pdf")})
+        resp.raise_for_status()
+        source_id = resp.json()["id"]
+
+        print("\n--- /chat while the PDF is indexing ---")
+        busy = probe.measure(args.samples)
+        report("Indexing", busy)
+
+        status = next((d["status"] for d in client.get("/documents").json() if d["id"] == source_id), "unknown")
+        print(f"Document status at end of probe: {status}")
+        if not status.startswith("indexing") and status != "uploaded":
+            print("[WARNING] Indexing finished before the probe ended; increase --pdf-pages.")
+        client.delete(f"/documents/{source_id}")
+
+        idle_p99, busy_p99 = percentile(idle, 99), percentile(busy, 99)
+        print(f"\np99 ratio (indexing / idle): {busy_p99 / max(idle_p99, 1e-6):.2f}")
+        if busy_p99 <= idle_p99 * args.max_ratio or busy_p99 - idle_p99 <= args.min_delta_ms:
+            print("[SUCCESS] /chat p99 stays flat while a large PDF is indexing.")
+            return True
+        print("[FAIL] /chat p99 degraded while indexing.")
+        return False
+    finally:
+        stop_stack(procs)
+
+def main():
+    parser = argparse.ArgumentParser(description="/chat p99 while a large PDF is indexing")
+    parser.add_argument("--pdf-pages", type=int, default=1500)
+    parser.add_argument("--samples", type=int, default=40, help="/chat requests per phase")
+    parser.add_argument("--openai-latency-ms", default="50", help="Latency spec, see scripts/fake_latency.py")
+    parser.add_argument("--embed-latency-ms", default="20", help="Latency spec, see scripts/fake_latency.py")
+    parser.add_argument("--supabase-latency-ms", default="5", help="Latency spec, see scripts/fake_latency.py")
+    parser.add_argument("--max-ratio", type=float, default=1.5, help="Allowed p99 growth while indexing")
+    parser.add_argument("--min-delta-ms", type=float, default=20.0, help="Ignore p99 growth smaller than this")
+    args = parser.parse_args()
+    sys.exit(0 if run_verification(args) else 1)
+
+if __name__ == "__main__":
+    main()
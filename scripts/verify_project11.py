@@ -91,7 +91,7 @@ def run_verification():
     else:
         print("[WARNING] Cache might not have hit, or system is slow.")
 
-    print("\nCheck the SERVER LOGS for '[CACHE MISS]', 'Mini-Report', and '[CACHE HIT]'.")
+    print("\nCheck the SERVER LOGS for 'chat.cache_miss', 'chat.retrieval', 'chat.rerank' and 'chat.cache_hit'.")
 
 if __name__ == "__main__":
     run_verification()
@@ -0,0 +1,83 @@
+"""
+Replacing a document while its indexing job is still running: PUT /documents/{id} must cancel
+the earlier jobs of the source, so only the newest content ends up stored. Runs offline against
+the local stack (fake OpenAI and Supabase, see bench_stack.py) with two worker threads and slow
+embeddings, so the first job is mid-ingest when the replacements arrive.
+
+    python scripts/verify_replace_in_flight.py
+"""
+import hashlib
+import sys
+import time
+import httpx
+from bench_stack import free_port, start_stack, stop_stack
+
+WINDOW_CHUNKS = 4
+
+def document(marker: str, chunks: int) -> bytes:
+    # ~800 new characters per 1000-character chunk (200 overlap), every word carries the marker
+    words = []
+    while sum(len(w) + 1 for w in words) < chunks * 800 - 100:
+        words.append(f"{marker}{len(words)}")
+    return " ".join(words).encode()
+
+def wait_for(predicate, timeout: float, interval: float = 0.05):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(interval)
+    raise TimeoutError("condition not reached")
+
+def run_verification() -> bool:
+    supabase_port = free_port()
+    extra_env = {"JOB_EMBEDDED_WORKERS": "2", "JOB_POLL_SECONDS": "0.05", "INGEST_WINDOW_CHUNKS": str(WINDOW_CHUNKS)}
+    api_url, procs = start_stack("20", "2", extra_env, embed_latency_ms="150", supabase_port=supabase_port)
+    try:
+        api = httpx.Client(base_url=api_url, timeout=30)
+        rest = httpx.Client(base_url=f"http://127.0.0.1:{supabase_port}/rest/v1", timeout=30)
+
+        versions = [("alpha", 60), ("bravo", 10), ("charlie", 14)]
+        marker, chunks = versions[0]
+        resp = api.post("/documents/upload", files={"file": ("replace.txt", document(marker, chunks), "text/plain")})
+        resp.raise_for_status()
+        source_id, first_job = resp.json()["id"], resp.json()["job_id"]
+        wait_for(lambda: api.get(f"/jobs/{first_job}").json()["progress"], timeout=30)
+        print(f"[OK] First job {first_job} is mid-ingest: {api.get(f'/jobs/{first_job}').json()['progress']}")
+
+        # Two PUTs in a row while the first job runs
+        job_ids = [first_job]
+        for marker, chunks in versions[1:]:
+            resp = api.put(f"/documents/{source_id}", files={"file": ("replace.txt", document(marker, chunks), "text/plain")})
+            resp.raise_for_status()
+            job_ids.append(resp.json()["job_id"])
+
+        jobs = wait_for(lambda: (lambda js: js if all(j["status"] in ("done", "failed", "cancelled") for j in js) else None)(
+            [api.get(f"/jobs/{job_id}").json() for job_id in job_ids]), timeout=60)
+        ok = True
+        for job_id, job in zip(job_ids, jobs):
+            print(f"     job {job_id}: {job['status']} ({job['progress'] or job['error']})")
+        if [j["status"] for j in jobs] != ["cancelled", "cancelled", "done"]:
+            print("[FAIL] Only the newest job should run to completion")
+            ok = False
+
+        marker, chunks = versions[-1]
+        source = rest.get("/sources", params={"id": f"eq.{source_id}"}).json()[0]
+        stored = rest.get("/chunks", params={"source_id": f"eq.{source_id}", "select": "chunk_index,content"}).json()
+        others = [m for m, _ in versions if m != marker]
+        stale = [c["chunk_index"] for c in stored if any(m in c["content"] for m in others) or marker not in c["content"]]
+        if source["status"] != "indexed" or source["content_hash"] != hashlib.sha256(document(marker, chunks)).hexdigest():
+            print(f"[FAIL] Source should be indexed with the newest content hash, got status '{source['status']}'")
+            ok = False
+        if stale or len(stored) != chunks:
+            print(f"[FAIL] Expected {chunks} '{marker}' chunks, got {len(stored)} chunks, stale: {stale}")
+            ok = False
+        if ok:
+            print(f"[SUCCESS] Source holds exactly the {chunks} chunks of the newest version.")
+        return ok
+    finally:
+        stop_stack(procs)
+
+if __name__ == "__main__":
+    sys.exit(0 if run_verification() else 1)
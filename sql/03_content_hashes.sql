@@ -0,0 +1,20 @@
+-- Content hashes for deduplication and incremental re-indexing
+
+-- 1. SHA-256 of the whole uploaded file: identical uploads short-circuit to the existing source
+alter table sources add column if not exists content_hash text;
+create index if not exists idx_sources_content_hash on sources (content_hash);
+-- At most one live source per content, so concurrent identical uploads cannot both insert.
+-- Older duplicates (from before this index) keep their data but lose the hash.
+update sources s set content_hash = null
+where s.status <> 'failed' and s.content_hash is not null and exists (
+    select 1 from sources o
+    where o.content_hash = s.content_hash and o.status <> 'failed' and (o.created_at, o.id) < (s.created_at, s.id)
+);
+create unique index if not exists idx_sources_content_hash_live on sources (content_hash) where status <> 'failed';
+
+-- 2. SHA-256 of each chunk's embedding model@dimensions and text: unchanged chunks reuse their stored embedding
+alter table chunks add column if not exists content_hash text;
+create index if not exists idx_chunks_content_hash on chunks (content_hash);
+
+-- 3. One row per (source, position), so re-indexing can upsert in place
+create unique index if not exists idx_chunks_source_chunk_index on chunks (source_id, chunk_index);
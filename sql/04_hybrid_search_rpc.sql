@@ -0,0 +1,65 @@
+-- Single round-trip hybrid search: semantic + keyword legs as CTEs, fused with
+-- Reciprocal Rank Fusion in SQL and joined with sources.filename.
+-- Mirrors rrf_fusion in backend/main.py: score = sum over legs of 1 / (k + rank), rank 0-based;
+-- ties keep semantic order first, then keyword order.
+create or replace function hybrid_search (
+  query_embedding vector(1536),
+  query_text text,
+  match_count int,
+  candidate_count int,
+  match_threshold float default 0.3,
+  rrf_k int default 60,
+  filter_source_ids uuid[] default null
+)
+returns table (
+  id uuid,
+  source_id uuid,
+  chunk_index int,
+  content text,
+  similarity float, -- RRF score, same field name as the two-RPC path
+  filename text
+)
+language sql stable
+as $$
+  with semantic as (
+    select
+      c.id,
+      row_number() over (order by c.embedding <=> query_embedding) - 1 as rank
+    from chunks c
+    where 1 - (c.embedding <=> query_embedding) > match_threshold
+    and (filter_source_ids is null or c.source_id = any(filter_source_ids))
+    order by c.embedding <=> query_embedding
+    limit candidate_count
+  ),
+  keyword as (
+    select
+      c.id,
+      row_number() over (order by ts_rank(to_tsvector('english', c.content), websearch_to_tsquery('english', query_text)) desc) - 1 as rank
+    from chunks c
+    where to_tsvector('english', c.content) @@ websearch_to_tsquery('english', query_text)
+    and (filter_source_ids is null or c.source_id = any(filter_source_ids))
+    order by ts_rank(to_tsvector('english', c.content), websearch_to_tsquery('english', query_text)) desc
+    limit candidate_count
+  ),
+  fused as (
+    select
+      coalesce(s.id, k.id) as id,
+      coalesce(1.0 / (rrf_k + s.rank), 0) + coalesce(1.0 / (rrf_k + k.rank), 0) as score,
+      s.rank as semantic_rank,
+      k.rank as keyword_rank
+    from semantic s
+    full outer join keyword k on k.id = s.id
+  )
+  select
+    c.id,
+    c.source_id,
+    c.chunk_index,
+    c.content,
+    f.score::float as similarity,
+    src.filename
+  from fused f
+  join chunks c on c.id = f.id
+  join sources src on src.id = c.source_id
+  order by f.score desc, f.semantic_rank asc nulls last, f.keyword_rank asc
+  limit match_count;
+$$;
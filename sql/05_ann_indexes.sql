@@ -0,0 +1,184 @@
+-- ANN index and index-friendly query shapes for semantic and keyword search.
+-- Requires pgvector >= 0.5 (HNSW). Run after 00-04.
+
+-- 1. HNSW index for cosine distance.
+-- m / ef_construction trade build time and memory for recall; tune before building on large tables.
+create index if not exists idx_chunks_embedding_hnsw on chunks
+  using hnsw (embedding vector_cosine_ops) with (m = 16, ef_construction = 64);
+
+-- Alternative for very large tables or faster builds: IVFFlat (build after loading data,
+-- lists ~ rows / 1000 up to 1M rows, sqrt(rows) above; query-time knob is ivfflat.probes).
+-- create index if not exists idx_chunks_embedding_ivfflat on chunks
+--   using ivfflat (embedding vector_cosine_ops) with (lists = 1000);
+
+-- 2. Stored tsvector column with a GIN index, so keyword ranking does not re-parse content per row
+alter table chunks add column if not exists content_tsv tsvector
+  generated always as (to_tsvector('english', content)) stored;
+create index if not exists idx_chunks_content_tsv on chunks using gin (content_tsv);
+drop index if exists idx_chunks_content_fts; -- Expression index from 02, replaced by content_tsv
+
+-- 3. HNSW scan settings of the search functions (transaction-local). With a source filter, HNSW
+-- filters after the scan, so a small source in a large corpus could get few or no rows: pgvector
+-- >= 0.8 keeps scanning until enough rows pass the filter (iterative scan, bounded by
+-- hnsw.max_scan_tuples); older versions get a candidate list 10x larger (ef_search is capped at 1000).
+create or replace function configure_hnsw_scan(ef_search int, filtered boolean)
+returns void
+language plpgsql
+as $$
+begin
+  if not filtered then
+    perform set_config('hnsw.ef_search', ef_search::text, true);
+  elsif (select string_to_array(extversion, '.')::int[] >= array[0, 8] from pg_extension where extname = 'vector') then
+    -- Rows may come slightly out of order, the callers order by the exact distance again
+    perform set_config('hnsw.iterative_scan', 'relaxed_order', true);
+    perform set_config('hnsw.ef_search', ef_search::text, true);
+  else
+    perform set_config('hnsw.ef_search', least(1000, ef_search * 10)::text, true);
+  end if;
+end;
+$$;
+
+-- 4. match_chunks: nearest neighbours via ORDER BY distance LIMIT (index scan), the distance is
+-- computed once and the similarity threshold is applied to the shortlist afterwards.
+drop function if exists match_chunks(vector, float, int, uuid[]);
+create or replace function match_chunks (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  filter_source_ids uuid[] default null,
+  ef_search int default 40
+)
+returns table (
+  id uuid,
+  source_id uuid,
+  chunk_index int,
+  content text,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  -- Candidate list size of the HNSW scan (recall vs latency), widened for filtered queries
+  perform configure_hnsw_scan(greatest(ef_search, match_count), filter_source_ids is not null);
+
+  return query
+  select
+    nn.id,
+    nn.source_id,
+    nn.chunk_index,
+    nn.content,
+    1 - nn.distance as similarity
+  from (
+    select
+      c.id,
+      c.source_id,
+      c.chunk_index,
+      c.content,
+      c.embedding <=> query_embedding as distance
+    from chunks c
+    where (filter_source_ids is null or c.source_id = any(filter_source_ids))
+    order by c.embedding <=> query_embedding
+    limit match_count
+  ) nn
+  where 1 - nn.distance > match_threshold
+  order by nn.distance;
+end;
+$$;
+
+-- 5. match_chunks_keyword: uses the stored tsvector and parses the query once
+create or replace function match_chunks_keyword (
+  query_text text,
+  match_count int,
+  filter_source_ids uuid[] default null
+)
+returns table (
+  id uuid,
+  source_id uuid,
+  chunk_index int,
+  content text,
+  similarity float
+)
+language sql stable
+as $$
+  select
+    c.id,
+    c.source_id,
+    c.chunk_index,
+    c.content,
+    ts_rank(c.content_tsv, q.query)::float as similarity
+  from chunks c, websearch_to_tsquery('english', query_text) as q(query)
+  where c.content_tsv @@ q.query
+  and (filter_source_ids is null or c.source_id = any(filter_source_ids))
+  order by similarity desc
+  limit match_count;
+$$;
+
+-- 6. hybrid_search (from 04) with the same index-friendly legs
+drop function if exists hybrid_search(vector, text, int, int, float, int, uuid[]);
+create or replace function hybrid_search (
+  query_embedding vector(1536),
+  query_text text,
+  match_count int,
+  candidate_count int,
+  match_threshold float default 0.3,
+  rrf_k int default 60,
+  filter_source_ids uuid[] default null,
+  ef_search int default 40
+)
+returns table (
+  id uuid,
+  source_id uuid,
+  chunk_index int,
+  content text,
+  similarity float,
+  filename text
+)
+language plpgsql
+as $$
+begin
+  perform configure_hnsw_scan(greatest(ef_search, candidate_count), filter_source_ids is not null);
+
+  return query
+  with nn as (
+    select c.id, c.embedding <=> query_embedding as distance
+    from chunks c
+    where (filter_source_ids is null or c.source_id = any(filter_source_ids))
+    order by c.embedding <=> query_embedding
+    limit candidate_count
+  ),
+  semantic as (
+    select nn.id, row_number() over (order by nn.distance) - 1 as rank
+    from nn
+    where 1 - nn.distance > match_threshold
+  ),
+  keyword as (
+    select c.id, row_number() over (order by ts_rank(c.content_tsv, q.query) desc) - 1 as rank
+    from chunks c, websearch_to_tsquery('english', query_text) as q(query)
+    where c.content_tsv @@ q.query
+    and (filter_source_ids is null or c.source_id = any(filter_source_ids))
+    order by ts_rank(c.content_tsv, q.query) desc
+    limit candidate_count
+  ),
+  fused as (
+    select
+      coalesce(s.id, k.id) as fid,
+      coalesce(1.0 / (rrf_k + s.rank), 0) + coalesce(1.0 / (rrf_k + k.rank), 0) as score,
+      s.rank as semantic_rank,
+      k.rank as keyword_rank
+    from semantic s
+    full outer join keyword k on k.id = s.id
+  )
+  select
+    c.id,
+    c.source_id,
+    c.chunk_index,
+    c.content,
+    f.score::float as similarity,
+    src.filename
+  from fused f
+  join chunks c on c.id = f.fid
+  join sources src on src.id = c.source_id
+  order by f.score desc, f.semantic_rank asc nulls last, f.keyword_rank asc
+  limit match_count;
+end;
+$$;
@@ -0,0 +1,71 @@
+-- Two-stage semantic search: HNSW over a small coarse vector, exact rescoring of the shortlist.
+-- Requires pgvector >= 0.7 (halfvec, subvector). Run after 05. Used by the API with
+-- VECTOR_COARSE_DIMENSIONS=256 and VECTOR_COARSE_QUANTIZATION=halfvec; other values, or coarse search
+-- together with HYBRID_SEARCH_RPC (whose semantic leg is full precision), are rejected at startup.
+--
+-- The coarse vector is the first 256 components of chunks.embedding as halfvec (Matryoshka-style
+-- truncation: text-embedding-3 models front-load information). It is an index expression, not a
+-- column, so ingestion writes nothing extra: the index is ~12x smaller than the vector(1536) HNSW
+-- index (2 bytes x 256 vs 4 bytes x 1536 per row) and the full vectors are only read for rescoring.
+-- pgvector has no int8 vector type, VECTOR_COARSE_QUANTIZATION=int8 applies to the local backend only.
+-- To use another size, replace 256 in the index and in the function (both must match exactly, or
+-- the planner cannot use the index) and set VECTOR_COARSE_DIMENSIONS to the same value.
+--
+-- With EMBEDDING_DIMENSIONS (shortened embeddings from the API), declare chunks.embedding and the
+-- query_embedding parameters in 01-06 as vector(EMBEDDING_DIMENSIONS) instead of vector(1536).
+
+create index if not exists idx_chunks_embedding_coarse_hnsw on chunks
+  using hnsw ((subvector(embedding, 1, 256)::halfvec(256)) halfvec_cosine_ops) with (m = 16, ef_construction = 64);
+
+-- Once coarse search is in use, the full-size HNSW index from 05 is no longer needed:
+-- drop index if exists idx_chunks_embedding_hnsw;
+
+create or replace function match_chunks_coarse (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  filter_source_ids uuid[] default null,
+  ef_search int default 40,
+  candidate_count int default 40
+)
+returns table (
+  id uuid,
+  source_id uuid,
+  chunk_index int,
+  content text,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  -- The HNSW scan has to produce the whole shortlist, also under a source filter (sql/05)
+  perform configure_hnsw_scan(greatest(ef_search, candidate_count), filter_source_ids is not null);
+
+  return query
+  select
+    rescored.id,
+    rescored.source_id,
+    rescored.chunk_index,
+    rescored.content,
+    1 - rescored.distance as similarity
+  from (
+    select
+      shortlist.id,
+      shortlist.source_id,
+      shortlist.chunk_index,
+      shortlist.content,
+      shortlist.embedding <=> query_embedding as distance
+    from (
+      select c.id, c.source_id, c.chunk_index, c.content, c.embedding
+      from chunks c
+      where (filter_source_ids is null or c.source_id = any(filter_source_ids))
+      order by (subvector(c.embedding, 1, 256)::halfvec(256)) <=> (subvector(query_embedding, 1, 256)::halfvec(256))
+      limit greatest(candidate_count, match_count)
+    ) shortlist
+    order by shortlist.embedding <=> query_embedding
+    limit match_count
+  ) rescored
+  where 1 - rescored.distance > match_threshold
+  order by rescored.distance;
+end;
+$$;